@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Benchmark `get_all_objects` on saved page fixtures.
+
+    python benchmarks/bench_get_all_objects.py [fixture.html ...]
+
+Also times the old permutation approach (every '{' x every '}' slice
+through yaml) on a small prefix of each page, for comparison.
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from redditdownload.plugins.jsobjects import (  # noqa: E402
+    get_all_objects, iter_object_spans, try_yaml_load)
+
+
+LEGACY_PREFIX = 2000
+
+
+def legacy_get_all_objects(text):
+    def indexall(topstr, substr):
+        return (m.start() for m in re.finditer(re.escape(substr), topstr))
+    results = (try_yaml_load(text[from_:to_ + 1])
+               for from_ in indexall(text, '{')
+               for to_ in indexall(text, '}'))
+    return (val for val in results if val is not None)
+
+
+def timeit(func, *ar, **kwa):
+    start = time.perf_counter()
+    res = func(*ar, **kwa)
+    return time.perf_counter() - start, res
+
+
+def bench(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    name = os.path.basename(path)
+    print('%s: %d KB' % (name, len(text) // 1024))
+    elapsed, spans = timeit(lambda: list(iter_object_spans(text)))
+    print('  scan:            %8.1f ms  (%d spans)' % (elapsed * 1000, len(spans)))
+    elapsed, objs = timeit(lambda: list(get_all_objects(text, lenient=False)))
+    print('  json only:       %8.1f ms  (%d objects)' % (elapsed * 1000, len(objs)))
+    elapsed, objs = timeit(lambda: list(get_all_objects(text)))
+    print('  json + lenient:  %8.1f ms  (%d objects)' % (elapsed * 1000, len(objs)))
+    prefix = text[:LEGACY_PREFIX]
+    elapsed, objs = timeit(lambda: list(legacy_get_all_objects(prefix)))
+    print('  legacy, first %d chars only: %8.1f ms' % (LEGACY_PREFIX, elapsed * 1000))
+    elapsed, objs = timeit(lambda: list(get_all_objects(prefix)))
+    print('  new, first %d chars only:    %8.1f ms' % (LEGACY_PREFIX, elapsed * 1000))
+
+
+def main(paths):
+    paths = paths or sorted(glob.glob(os.path.join(here, 'fixtures', '*.html')))
+    for path in paths:
+        bench(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Compare the `htmlparse` backends on saved page fixtures.
+
+    python benchmarks/bench_htmlparse.py [fixture.html ...]
+
+Backends whose libraries aren't installed are reported as skipped.
+"""
+
+import os
+import sys
+import glob
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from redditdownload import htmlparse  # noqa: E402
+
+
+ROUNDS = 5
+
+# (label, want, limit): what the resolvers ask for
+CASES = (
+    ('img+a (img_scrap_stuff)', ('img', 'a'), None),
+    ('a (flickr crawler)', ('a',), None),
+    ('first source (imgur video)', ('source',), 1),
+)
+
+
+def bench(path):
+    with open(path, encoding='utf-8') as f:
+        html = f.read()
+    print('%s: %d KB' % (os.path.basename(path), len(html) // 1024))
+    for label, want, limit in CASES:
+        print('  %s' % label)
+        for backend in htmlparse.BACKENDS:
+            extractor = htmlparse._extractors[backend]
+            try:
+                start = time.perf_counter()
+                for _ in range(ROUNDS):
+                    page = extractor(html, frozenset(want), limit)
+                elapsed = (time.perf_counter() - start) / ROUNDS
+            except ImportError as exc:
+                print('    %-7s skipped (%s)' % (backend, exc))
+                continue
+            print('    %-7s %8.2f ms  %r' % (backend, elapsed * 1000, page))
+
+
+def main(paths):
+    paths = paths or sorted(glob.glob(os.path.join(here, 'fixtures', '*.html')))
+    for path in paths:
+        bench(path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -17,3 +17,11 @@ class WrongDataException(Exception):
     def __init__(self, data, message):
         self.data = data
         self.message = message
+
+
+class RedditAPIException(Exception):
+    """Raised when a reddit listing can't be fetched or decoded"""
+
+
+class ImageSizeException(Exception):
+    """Raised when the media dimensions don't pass the size filter"""
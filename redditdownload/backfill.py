@@ -0,0 +1,237 @@
+"""Historical backfill (``--backfill FROM..TO``) past the listing cap.
+
+Reddit listings end after ~1000 posts, so the full history of a subreddit
+has to come from a Pushshift-compatible archive, queried by time window::
+
+    GET <api>?subreddit=pics&after=<epoch>&before=<epoch>&size=100&sort=asc
+
+The range is split into windows that are fetched in parallel, paced by a
+shared :class:`RateLimiter`. A window returning a full page was capped:
+its posts (oldest first) cover it up to the newest one returned, and the
+rest of the window is split in two and fetched again, so busy periods are
+refined while quiet ones cost a single request. Posts on window edges are
+deduplicated by id. With ``--memory-budget`` windows are only fetched
+ahead while their pages fit in it (see memory.py).
+
+A window whose request fails is queued again, after an exponential
+backoff, up to :data:`RETRIES` times; the windows that still fail are
+reported with a :class:`BackfillError` once everything else is done.
+"""
+
+import json
+import time
+import logging
+import calendar
+import datetime
+import threading
+import urllib.parse
+from collections import deque
+from urllib.request import Request
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import httpcache
+from . import memory
+
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_API = 'https://api.pushshift.io/reddit/search/submission/'
+# Posts per request (the archive's max `size`); a full page means capped.
+PAGE_SIZE = 100
+WORKERS = 4
+# Requests per second, shared by all workers.
+DEFAULT_RATE = 1.0
+# Memory of a post, parsed, for the memory budget.
+ITEM_BYTES = 4 * 1024
+# Tries of a failing window after the first, waiting BACKOFF * 2 ** n seconds.
+RETRIES = 3
+BACKOFF = 2.0
+
+_hdr = {'User-Agent': 'RedditImageGrab script.'}
+
+
+class BackfillError(IOError):
+    """Windows that couldn't be fetched; `windows` is a list of (start, end)"""
+
+    def __init__(self, windows):
+        self.windows = windows
+        IOError.__init__(self, 'backfill windows failed: %s (retry with --backfill over them)'
+                         % ', '.join('%d..%d' % window for window in windows))
+
+
+def _parse_time(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            parsed = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return calendar.timegm(parsed.timetuple())
+    raise ValueError('invalid time %r, expected YYYY-MM-DD[THH:MM[:SS]] '
+                     'or epoch seconds' % value)
+
+
+def parse_range(value):
+    """``'FROM..TO'`` -> ``(start, end)`` epoch seconds (UTC), TO defaults to now
+
+    >>> parse_range('2017-01-01..2017-01-02')
+    (1483228800, 1483315200)
+    >>> parse_range('1483228800..1483228900')
+    (1483228800, 1483228900)
+    """
+    start, sep, end = value.partition('..')
+    if not sep:
+        raise ValueError('invalid range %r, expected FROM..TO' % value)
+    start = _parse_time(start)
+    end = _parse_time(end) if end.strip() else int(time.time())
+    if end <= start:
+        raise ValueError('empty range %r' % value)
+    return start, end
+
+
+class RateLimiter(object):
+    """Spaces calls to `acquire` at least 1 / rate seconds apart, across threads"""
+
+    def __init__(self, rate=DEFAULT_RATE, clock=time.time, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+def window_url(api, subreddit, start, end, size=PAGE_SIZE):
+    """Archive query for the posts of `subreddit` in [start, end)"""
+    query = urllib.parse.urlencode([
+        # combined listings: the archive takes a comma separated list
+        ('subreddit', subreddit.replace('+', ',')),
+        ('after', start - 1), ('before', end),
+        ('size', size), ('sort', 'asc'), ('sort_type', 'created_utc')])
+    return '%s%s%s' % (api, '&' if '?' in api else '?', query)
+
+
+def parse_items(data):
+    """Submissions of an archive (``{"data": [...]}``) or reddit listing
+    response, with the fields the downloader relies on filled in"""
+    if isinstance(data.get('data'), dict):
+        items = [child['data'] for child in data['data'].get('children', [])]
+    else:
+        items = list(data.get('data') or [])
+    for item in items:
+        item.setdefault('score', 0)
+        item.setdefault('over_18', False)
+        item.setdefault('title', '')
+        item.setdefault('url', '')
+        item['created_utc'] = int(float(item.get('created_utc') or 0))
+    return items
+
+
+def fetch_window(api, subreddit, start, end, size=PAGE_SIZE, limiter=None):
+    """Posts of `subreddit` in [start, end), oldest first"""
+    if limiter is not None:
+        limiter.acquire()
+    url = window_url(api, subreddit, start, end, size)
+    response = httpcache.urlopen(Request(url, headers=_hdr))
+    items = parse_items(json.loads(response.read().decode('utf-8')))
+    return sorted(items, key=lambda item: item['created_utc'])
+
+
+def _fetch_later(delay, *ar):
+    if delay:
+        time.sleep(delay)
+    return fetch_window(*ar)
+
+
+def split_range(start, end, parts):
+    """[start, end) into up to `parts` contiguous windows
+
+    >>> split_range(0, 10, 3)
+    [(0, 3), (3, 6), (6, 10)]
+    """
+    parts = max(1, min(parts, end - start))
+    step = (end - start) // parts
+    edges = [start + step * i for i in range(parts)] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def backfill(subreddit, start, end, api=DEFAULT_API, workers=WORKERS,
+             rate=DEFAULT_RATE, size=PAGE_SIZE, limiter=None, retries=RETRIES,
+             backoff=BACKOFF):
+    """Yield pages (lists of new-to-this-run posts, newest first) of
+    `subreddit` between `start` and `end`, as the windows complete
+
+    :param rate: requests per second over all workers
+    :param retries: tries of a failing window after the first one
+    :raises BackfillError: at the end, when windows failed every try
+    """
+    limiter = limiter or RateLimiter(rate)
+    seen = set()
+    failed = []
+    page_bytes = size * ITEM_BYTES
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        # (start, end, failures) of the windows to fetch when the memory
+        # budget allows
+        waiting = deque()
+
+        def submit_waiting():
+            while waiting and memory.try_acquire(page_bytes, force=not pending):
+                window = waiting.popleft()
+                delay = backoff * 2 ** (window[2] - 1) if window[2] else 0
+                future = pool.submit(_fetch_later, delay, api, subreddit, window[0],
+                                     window[1], size, limiter)
+                pending[future] = window
+
+        waiting.extend((a, b, 0) for a, b in split_range(start, end, workers * 2))
+        try:
+            submit_waiting()
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    w_start, w_end, failures = pending.pop(future)
+                    try:
+                        try:
+                            items = future.result()
+                        except Exception as exc:
+                            _log.warning("Backfill window %s..%s failed (try %d): %r",
+                                         w_start, w_end, failures + 1, exc)
+                            if failures < retries:
+                                waiting.append((w_start, w_end, failures + 1))
+                            else:
+                                failed.append((w_start, w_end))
+                            continue
+                        if len(items) >= size:
+                            # capped: covered up to the newest post returned (that
+                            # second may hold more), refine the rest of the window
+                            rest = items[-1]['created_utc']
+                            if rest <= w_start:
+                                _log.warning("More than %d posts at %s, some are missed",
+                                             size, w_start)
+                                rest = w_start + 1
+                            if rest < w_end:
+                                waiting.extend((a, b, 0)
+                                               for a, b in split_range(rest, w_end, 2))
+                        page = [item for item in items if item['id'] not in seen]
+                        seen.update(item['id'] for item in page)
+                        if page:
+                            yield page[::-1]
+                    finally:
+                        # (the page is processed once the loop comes back)
+                        memory.release_ahead(page_bytes)
+                submit_waiting()
+        finally:
+            # stopped early: the windows still being fetched
+            for _ in pending:
+                memory.release_ahead(page_bytes)
+    if failed:
+        raise BackfillError(sorted(failed))
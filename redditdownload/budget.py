@@ -0,0 +1,182 @@
+"""Byte / time budgets (``--byte-budget``, ``--deadline``).
+
+With a budget the submissions of each listing page (the look-ahead
+window) are not taken in listing order but ranked: by score, or by score
+per MiB (``--budget-rank density``) using the Content-Length of a HEAD
+request or an estimate from the preview dimensions. The best ones are
+downloaded first; one that doesn't fit in the bytes left is passed over
+for smaller ones, and when the budget runs out the run stops. Whatever
+was passed over is checkpointed to ``._deferred.json`` in the folder and
+goes first on the next run::
+
+    redditdl.py EarthPorn walls --byte-budget 500 --deadline 06:30
+"""
+
+import os
+import json
+import time
+import logging
+import datetime
+import tempfile
+from urllib.request import urlopen, Request
+from concurrent.futures import ThreadPoolExecutor
+
+from .httpcache import MiB
+from .resolution import preview_source_size
+
+
+_log = logging.getLogger(__name__)
+
+DEFERRED_FILE = '._deferred.json'
+RANKS = ('score', 'density')
+# Rough size of a reddit image per pixel of its preview source dimensions.
+BYTES_PER_PIXEL = 0.5
+# Assumed size of a submission that can't be estimated.
+DEFAULT_SIZE = MiB
+HEAD_WORKERS = 8
+HEAD_TIMEOUT = 10
+
+_media_exts = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm', '.gifv')
+_hdr = {'User-Agent': 'RedditImageGrab script.'}
+
+
+def parse_deadline(value, now=None):
+    """``'HH:MM'`` (local time, the next one to come) or a duration
+    (``'90s'``, ``'45m'``, ``'2h'``) -> epoch seconds
+
+    >>> parse_deadline('45m', now=1000)
+    3700
+    >>> parse_deadline('90s', now=1000)
+    1090
+    """
+    now = time.time() if now is None else now
+    value = value.strip()
+    units = dict(s=1, m=60, h=3600)
+    try:
+        if value[-1:] in units:
+            return int(now + float(value[:-1]) * units[value[-1]])
+        hours, minutes = (int(part) for part in value.split(':'))
+        start = datetime.datetime.fromtimestamp(now)
+        deadline = start.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+    except ValueError:
+        raise ValueError('invalid deadline %r, expected HH:MM or e.g. 45m' % value)
+    if deadline <= start:
+        deadline += datetime.timedelta(days=1)
+    return int(time.mktime(deadline.timetuple()))
+
+
+class Budget(object):
+    """What's left of a run's `bytes` (None: unlimited) before `deadline`
+    (epoch seconds, None: none)"""
+
+    def __init__(self, bytes=None, deadline=None, clock=time.time):
+        self.bytes_left = bytes
+        self.deadline = deadline
+        self.clock = clock
+
+    def spend(self, size):
+        if self.bytes_left is not None and size:
+            self.bytes_left -= size
+
+    def fits(self, size):
+        """Whether a download of `size` bytes (None: unknown) fits"""
+        return self.bytes_left is None or size is None or size <= self.bytes_left
+
+    def exhausted(self):
+        """Why the budget is used up, None if it isn't"""
+        if self.bytes_left is not None and self.bytes_left <= 0:
+            return 'byte budget used up'
+        if self.deadline is not None and self.clock() >= self.deadline:
+            return 'deadline reached'
+        return None
+
+
+def head_size(url, timeout=HEAD_TIMEOUT):
+    """Content-Length of `url` by a HEAD request, None if unknown"""
+    try:
+        with urlopen(Request(url, headers=_hdr, method='HEAD'), timeout=timeout) as response:
+            return int(response.info().get('content-length'))
+    except Exception as exc:  # no / bad length, HTTP errors...
+        _log.debug("HEAD %s: %r", url, exc)
+        return None
+
+
+def estimate_size(item, head=None):
+    """Expected bytes of a submission's media: the Content-Length of a
+    direct media link, else from the preview dimensions, else None
+
+    :param head: callable(url) -> size, head_size by default
+    """
+    url = item.get('url') or ''
+    if os.path.splitext(url.split('?')[0])[1].lower() in _media_exts:
+        size = (head or head_size)(url)
+        if size:
+            return size
+    dimensions = preview_source_size(item)
+    if dimensions:
+        return int(dimensions[0] * dimensions[1] * BYTES_PER_PIXEL)
+    return None
+
+
+def estimate_sizes(items, head=None, workers=HEAD_WORKERS):
+    """{id: estimated size} of `items`, the HEAD requests run concurrently"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = pool.map(lambda item: estimate_size(item, head), items)
+        return {item['id']: size for item, size in zip(items, sizes)}
+
+
+def rank(items, sizes=None, by='score', first=()):
+    """`items` best first: the ids in `first` (deferred by a previous run),
+    then by score or, for 'density', score per MiB (unknown sizes count as
+    the average of the known ones)
+
+    >>> items = [dict(id='a', score=10), dict(id='b', score=50), dict(id='c', score=30)]
+    >>> [item['id'] for item in rank(items)]
+    ['b', 'c', 'a']
+    >>> sizes = dict(a=MiB, b=20 * MiB, c=MiB)
+    >>> [item['id'] for item in rank(items, sizes, 'density', first={'a'})]
+    ['a', 'c', 'b']
+    """
+    sizes = sizes or {}
+    known = [size for size in sizes.values() if size]
+    default = sum(known) / len(known) if known else DEFAULT_SIZE
+
+    def value(item):
+        score = item.get('score') or 0
+        if by == 'density':
+            return score / (float(sizes.get(item['id']) or default) / MiB)
+        return score
+
+    return sorted(items, key=lambda item: (item['id'] not in first, -value(item)))
+
+
+def load_deferred(target_dir, subreddit):
+    """Submissions of `subreddit` deferred by a previous run"""
+    try:
+        with open(os.path.join(target_dir, DEFERRED_FILE)) as f:
+            return json.load(f).get(subreddit, [])
+    except (IOError, OSError, ValueError):
+        return []
+
+
+def save_deferred(target_dir, subreddit, items):
+    """Checkpoint the deferred submissions of `subreddit` (replacing the
+    previous ones)"""
+    path = os.path.join(target_dir, DEFERRED_FILE)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        data = {}
+    if items:
+        data[subreddit] = items
+    else:
+        data.pop(subreddit, None)
+    if not data and not os.path.exists(path):
+        return
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    fd, tmp = tempfile.mkstemp(dir=target_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
@@ -0,0 +1,233 @@
+"""Metadata catalog of the downloaded submissions (``--catalog``).
+
+A SQLite database with one row per submission and one per downloaded
+file, and an FTS5 full-text index over the titles (plain ``LIKE`` where
+SQLite is built without FTS5). Rows are queued by the pipeline and written
+in batched transactions. ``redditdl.py query`` answers searches and
+stats from the catalog alone, without touching the download folders::
+
+    redditdl.py query --catalog walls/._catalog.sqlite "mountain lake" --subreddit EarthPorn
+    redditdl.py query --catalog walls/._catalog.sqlite --stats
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from argparse import ArgumentParser
+
+
+CATALOG_FILE = '._catalog.sqlite'
+BATCH_SIZE = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id TEXT PRIMARY KEY,
+    subreddit TEXT,
+    title TEXT,
+    author TEXT,
+    score INTEGER,
+    over_18 INTEGER,
+    created_utc REAL,
+    url TEXT,
+    permalink TEXT
+);
+CREATE INDEX IF NOT EXISTS submissions_subreddit ON submissions (subreddit, created_utc);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    submission_id TEXT,
+    url TEXT,
+    size INTEGER,
+    sha1 TEXT,
+    added REAL
+);
+CREATE INDEX IF NOT EXISTS files_submission ON files (submission_id);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+"""
+
+# external content FTS5 table, kept in sync by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS submissions_fts USING fts5(
+    title, content='submissions', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS submissions_ai AFTER INSERT ON submissions BEGIN
+    INSERT INTO submissions_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS submissions_ad AFTER DELETE ON submissions BEGIN
+    INSERT INTO submissions_fts (submissions_fts, rowid, title)
+    VALUES ('delete', old.rowid, old.title);
+END;
+CREATE TRIGGER IF NOT EXISTS submissions_au AFTER UPDATE ON submissions BEGIN
+    INSERT INTO submissions_fts (submissions_fts, rowid, title)
+    VALUES ('delete', old.rowid, old.title);
+    INSERT INTO submissions_fts (rowid, title) VALUES (new.rowid, new.title);
+END;
+"""
+
+_UPSERT_SUBMISSION = """
+INSERT INTO submissions (id, subreddit, title, author, score, over_18, created_utc, url, permalink)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    subreddit = excluded.subreddit, title = excluded.title, author = excluded.author,
+    score = excluded.score, over_18 = excluded.over_18, url = excluded.url,
+    permalink = excluded.permalink
+"""
+
+_UPSERT_FILE = """
+INSERT OR REPLACE INTO files (path, submission_id, url, size, sha1, added)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def quote_terms(text):
+    """Plain words as an FTS5 query: every term a quoted string
+
+    >>> quote_terms('st. helens x-ray')
+    '"st." "helens" "x-ray"'
+    """
+    return ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+class Catalog(object):
+    """Catalog at `path`; safe to share between threads"""
+
+    def __init__(self, path=CATALOG_FILE, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._submissions = {}  # id -> row, pending
+        self._files = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.executescript(_SCHEMA)
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:  # built without FTS5
+            self.fts = False
+
+    def add_submission(self, item):
+        """Queue a listing item"""
+        row = (item['id'], item.get('subreddit'), item.get('title'), item.get('author'),
+               item.get('score'), int(bool(item.get('over_18'))), item.get('created_utc'),
+               item.get('url'), item.get('permalink'))
+        with self._lock:
+            self._submissions[item['id']] = row
+        self._maybe_flush()
+
+    def add_file(self, submission_id, url, path, size=None, sha1=None):
+        """Queue a downloaded file of a submission"""
+        with self._lock:
+            self._files.append((os.path.abspath(path), submission_id, url, size, sha1,
+                                time.time()))
+        self._maybe_flush()
+
+    def remove_files(self, paths):
+        """Drop the files at `paths` (e.g. evicted by the quota)"""
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM files WHERE path = ?',
+                                   [(os.path.abspath(path),) for path in paths])
+
+    def move_files(self, moves):
+        """Follow the files moved from the first to the second path of
+        each of `moves` (e.g. by fanout.migrate)"""
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE files SET path = ? WHERE path = ?',
+                                   [(os.path.abspath(new), os.path.abspath(old))
+                                    for old, new in moves])
+
+    def _maybe_flush(self):
+        if len(self._submissions) + len(self._files) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the queued rows in one transaction"""
+        with self._lock:
+            submissions, self._submissions = list(self._submissions.values()), {}
+            files, self._files = self._files, []
+            if not submissions and not files:
+                return
+            with self._conn:
+                self._conn.executemany(_UPSERT_SUBMISSION, submissions)
+                self._conn.executemany(_UPSERT_FILE, files)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def search(self, text=None, subreddit=None, limit=50):
+        """(id, subreddit, score, title, path) of the matching submissions,
+        best matches first; `text` is an FTS5 query, or plain words when
+        it isn't valid FTS5 syntax (e.g. "don't", "x-ray")"""
+        try:
+            return self._search(text, subreddit, limit)
+        except sqlite3.OperationalError:
+            if not (text and self.fts):
+                raise
+            return self._search(quote_terms(text), subreddit, limit)
+
+    def _search(self, text, subreddit, limit):
+        where, params = [], []
+        if text and self.fts:
+            source = ('submissions_fts JOIN submissions s '
+                      'ON s.rowid = submissions_fts.rowid')
+            where.append('submissions_fts MATCH ?')
+            params.append(text)
+            order = 'submissions_fts.rank'
+        else:
+            source = 'submissions s'
+            if text:
+                where.append('s.title LIKE ?')
+                params.append('%%%s%%' % text)
+            order = 's.created_utc DESC'
+        if subreddit:
+            where.append('s.subreddit = ? COLLATE NOCASE')
+            params.append(subreddit)
+        query = ('SELECT s.id, s.subreddit, s.score, s.title, f.path FROM %s '
+                 'LEFT JOIN files f ON f.submission_id = s.id %s ORDER BY %s LIMIT ?' % (
+                     source, 'WHERE ' + ' AND '.join(where) if where else '', order))
+        with self._lock:
+            return self._conn.execute(query, params + [limit]).fetchall()
+
+    def stats(self):
+        """(subreddit, submissions, files, bytes) per subreddit"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT s.subreddit, COUNT(DISTINCT s.id), COUNT(f.path), '
+                'COALESCE(SUM(f.size), 0) FROM submissions s '
+                'LEFT JOIN files f ON f.submission_id = s.id '
+                'GROUP BY s.subreddit ORDER BY 2 DESC').fetchall()
+
+
+def main(args=None):
+    """``redditdl.py query``"""
+    parser = ArgumentParser(prog='redditdl.py query',
+                            description='Search the catalog of downloaded submissions.')
+    parser.add_argument('text', nargs='?', default=None,
+                        help='Full-text query on the titles, e.g. "mountain AND lake".')
+    parser.add_argument('--catalog', metavar='PATH', default=CATALOG_FILE,
+                        help='Catalog database (default %(default)s).')
+    parser.add_argument('--subreddit', default=None, help='Only this subreddit.')
+    parser.add_argument('--limit', type=int, default=50, help='Max results.')
+    parser.add_argument('--stats', default=False, action='store_true',
+                        help='Submission / file counts and sizes per subreddit.')
+    args = parser.parse_args(args)
+    if not os.path.isfile(args.catalog):
+        # (connecting would make an empty one)
+        parser.error('no catalog at %s' % args.catalog)
+
+    catalog = Catalog(args.catalog)
+    try:
+        if args.stats:
+            for subreddit, submissions, files, size in catalog.stats():
+                print('%-24s %8i submissions %8i files %10.1f MiB' % (
+                    subreddit, submissions, files, size / 2.0 ** 20))
+        else:
+            for item_id, subreddit, score, title, path in catalog.search(
+                    args.text, args.subreddit, args.limit):
+                print('%s\t%s\t%s\t%s\t%s' % (item_id, subreddit, score, title, path or ''))
+    finally:
+        catalog.close()
+    return 0
@@ -0,0 +1,237 @@
+"""Process pool for the CPU-bound stages of the pipeline.
+
+HTML parsing, image decoding and the imgur "does not exist" comparison
+are sent here with :func:`run` so they don't hold the GIL while the
+network side keeps going. Plain hashing is not: hashlib releases the GIL
+itself, so it stays in the calling thread. With 0 workers (the
+default) everything runs inline in the calling thread; :func:`submit`
+starts work the caller doesn't wait for (post-processing), in the pool or
+in a background thread.
+
+Task functions are module-level (picklable) and return compact records of
+plain tuples / dicts. Large ``bytes``/``str`` arguments are moved to the
+workers through shared memory (or a temp file where shared memory is not
+available) rather than being pickled through the pool's pipe.
+"""
+
+import os
+import atexit
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # py < 3.8
+    shared_memory = None
+
+
+_log = logging.getLogger(__name__)
+
+# Arguments larger than this are passed out-of-band.
+SPILL_THRESHOLD = 256 * 1024
+
+_workers = 0
+_executor = None
+_background = None
+_lock = threading.Lock()
+
+
+def configure(workers):
+    """Set the amount of worker processes; 0 runs the tasks inline"""
+    global _workers
+    shutdown()
+    _workers = max(0, int(workers or 0))
+
+
+def get_executor():
+    global _executor
+    if not _workers:
+        return None
+    with _lock:
+        if _executor is None:
+            # 'spawn': forking a process that runs download threads is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def shutdown():
+    global _executor, _background
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _background is not None:
+            _background.shutdown(wait=True)
+            _background = None
+
+
+atexit.register(shutdown)
+
+
+class SharedBuffer(object):
+    """Picklable handle of a bytes/str argument placed in shared memory"""
+
+    def __init__(self, data):
+        self.is_text = isinstance(data, str)
+        data = data.encode('utf-8') if self.is_text else data
+        self.size = len(data)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, self.size))
+        self._shm.buf[:self.size] = data
+        self.name = self._shm.name
+
+    def __getstate__(self):
+        return dict(name=self.name, size=self.size, is_text=self.is_text)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+
+    def load(self):
+        try:
+            shm = shared_memory.SharedMemory(name=self.name, track=False)
+        except TypeError:
+            # py < 3.13: registers again with the (shared) resource
+            # tracker, which is harmless as the owner unlinks it.
+            shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            data = bytes(shm.buf[:self.size])
+        finally:
+            shm.close()
+        return data.decode('utf-8') if self.is_text else data
+
+    def release(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+
+class FileBuffer(object):
+    """Picklable handle of a bytes/str argument spilled to a temp file"""
+
+    def __init__(self, data):
+        self.is_text = isinstance(data, str)
+        fd, self.path = tempfile.mkstemp(prefix='redditdl-', suffix='.buf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if self.is_text else data)
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        return data.decode('utf-8') if self.is_text else data
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _spill(value, handles):
+    if not isinstance(value, (bytes, bytearray, str)) or len(value) < SPILL_THRESHOLD:
+        return value
+    handle = None
+    if shared_memory is not None:
+        try:
+            handle = SharedBuffer(bytes(value) if isinstance(value, bytearray) else value)
+        except OSError as exc:  # e.g. no /dev/shm in a container
+            _log.debug("shared memory unavailable: %r", exc)
+    if handle is None:
+        handle = FileBuffer(value)
+    handles.append(handle)
+    return handle
+
+
+def load(value):
+    """In a task: resolve a possibly spilled argument back to its value"""
+    if isinstance(value, (SharedBuffer, FileBuffer)):
+        return value.load()
+    return value
+
+
+def run(func, *args):
+    """Run `func(*args)` in the pool (or inline) and return its result"""
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    handles = []
+    try:
+        args = [_spill(arg, handles) for arg in args]
+        return executor.submit(func, *args).result()
+    finally:
+        for handle in handles:
+            handle.release()
+
+
+def submit(func, *args):
+    """Start `func(*args)` in the pool and return its Future; without
+    workers it runs in a background thread instead of inline"""
+    global _background
+    executor = get_executor()
+    if executor is None:
+        with _lock:
+            if _background is None:
+                _background = ThreadPoolExecutor(max_workers=1,
+                                                 thread_name_prefix='cpupool')
+            return _background.submit(func, *args)
+    handles = []
+    try:
+        future = executor.submit(func, *[_spill(arg, handles) for arg in args])
+    except BaseException:
+        for handle in handles:
+            handle.release()
+        raise
+    future.add_done_callback(lambda _: [handle.release() for handle in handles])
+    return future
+
+
+# Tasks. These run in the worker processes: keep the imports light and the
+# results small.
+
+def task_extract_page(html, want, base_url=None, backend=None):
+    """htmlparse.extract -> (imgs, links, sources)
+
+    :param backend: htmlparse.get_backend() of the caller (the workers
+        don't share its setting)
+    """
+    from . import htmlparse
+    page = htmlparse.extract(load(html), want, base_url=base_url, backend=backend)
+    return page.imgs, page.links, page.sources
+
+
+def task_hash(data, algo='sha1'):
+    """hex digest of `data`"""
+    return hashlib.new(algo, load(data)).hexdigest()
+
+
+def task_image_size(data):
+    """(width, height) from the header or a full PIL decode; None if not an image"""
+    from .imagesize import sniff_size
+    data = load(data)
+    size = sniff_size(data)
+    if size is not None:
+        return tuple(size)
+    try:
+        from io import BytesIO
+        from PIL import Image
+        return tuple(Image.open(BytesIO(data)).size)
+    except Exception:
+        return None
+
+
+def task_files_equal(path_a, path_b, chunk_size=64 * 1024):
+    """Byte comparison of two files"""
+    if os.path.getsize(path_a) != os.path.getsize(path_b):
+        return False
+    with open(path_a, 'rb') as fa, open(path_b, 'rb') as fb:
+        while True:
+            chunk_a, chunk_b = fa.read(chunk_size), fb.read(chunk_size)
+            if chunk_a != chunk_b:
+                return False
+            if not chunk_a:
+                return True
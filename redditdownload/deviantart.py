@@ -1,10 +1,6 @@
 """module to parse deviantart page."""
-try:  # py2
-    from urllib2 import urlopen
-except ImportError:  # py3
-    from urllib.request import urlopen
-
-from bs4 import BeautifulSoup
+from .httpcache import urlopen
+from . import htmlparse
 
 
 def process_deviant_url(url):
@@ -22,10 +18,9 @@ def process_deviant_url(url):
         return [url]
     else:
         imgs = []
-        html_soup = BeautifulSoup(urlopen(url).read(), 'lxml')
+        page = htmlparse.extract(urlopen(url).read(), want=('img',))
         marker = 'filters:no_upscale():origin()/'
-        soup_imgs = [xx.get('src') for xx in html_soup.select('img')
-                     if marker in xx.get('src')]
+        soup_imgs = [src for src in page.imgs if marker in src]
         for ori_img in soup_imgs:
             img_parts = ori_img.split(marker)[1].split('/', 1)
             img_server = img_parts[0]
@@ -0,0 +1,216 @@
+"""Hashed directory fan-out (``--fanout N``).
+
+Instead of one flat folder per subreddit, files are placed N levels of
+two hex digits deep, by the md5 of their file name::
+
+    wallpapers/abc123.jpg  ->  wallpapers/87/60/abc123.jpg   (N = 2)
+
+which keeps every directory small (256 entries per level). The layout is
+applied by :class:`storage.DirectorySink`; existing folders are converted
+with::
+
+    python -m redditdownload.fanout <dir> <N> [--catalog PATH]
+
+(``N = 0`` flattens them back). Only the media files are moved (not the
+state files, tar shards, lists or a catalog kept in the folder); the
+quota indexes and postprocess records (which GIFs became MP4s) of the
+folders follow them, and so does the ``--catalog``
+given (a folder holding the default ``._catalog.sqlite`` is refused
+without it).
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+from argparse import ArgumentParser
+
+from .catalog import Catalog, CATALOG_FILE
+from .postprocess import RECORD_FILE
+
+
+_log = logging.getLogger(__name__)
+
+_level_re = re.compile(r'^[0-9a-f]{2}$')
+
+# What downloads are saved as.
+MEDIA_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm')
+
+
+def fanout_dirs(name, levels):
+    """Subdirectories of file `name`
+
+    >>> fanout_dirs('abc123.jpg', 2)
+    ['87', '60']
+    """
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()
+    return [digest[i * 2:i * 2 + 2] for i in range(levels)]
+
+
+def fanout_path(path, levels):
+    """Where `path` (a flat destination path) goes with `levels` of fan-out"""
+    if not levels:
+        return path
+    dirname, name = os.path.split(path)
+    return os.path.join(dirname, *(fanout_dirs(name, levels) + [name]))
+
+
+def base_dir(dirpath, name, root):
+    """Folder file `name` in `dirpath` belongs to, i.e. without the fan-out
+    levels (those matching the hash of the name, so that e.g. a subreddit
+    folder called 'de' is left alone)"""
+    levels = []
+    head = dirpath
+    while head != root and _level_re.match(os.path.basename(head)):
+        levels.insert(0, os.path.basename(head))
+        head = os.path.dirname(head)
+    for count in range(len(levels), 0, -1):
+        if fanout_dirs(name, count) == levels[-count:]:
+            for _ in range(count):
+                dirpath = os.path.dirname(dirpath)
+            break
+    return dirpath
+
+
+def iter_files(root):
+    """(base dir, path) of the downloaded files under `root`"""
+    root = os.path.normpath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.startswith('.'):  # ._history.txt & other state files
+                continue
+            yield base_dir(dirpath, name, root), os.path.join(dirpath, name)
+
+
+def is_download(name):
+    """Whether file `name` looks like a downloaded media file
+
+    >>> is_download('abc123.JPG'), is_download('shard-0001.tar')
+    (True, False)
+    """
+    return os.path.splitext(name)[1].lower() in MEDIA_EXTS
+
+
+def migrate(root, levels, dry_run=False, catalog=None):
+    """Move the downloads under `root` into the `levels` deep layout,
+    updating the quota indexes and the :class:`catalog.Catalog` at
+    `catalog`; returns the amount moved"""
+    from .quota import Quota, QUOTA_FILE  # (quota imports iter_files)
+    moved = 0
+    emptied = set()
+    quotas = {}  # base dir -> Quota
+    moves = []
+    for base, path in list(iter_files(root)):
+        if not is_download(path):
+            continue
+        target = fanout_path(os.path.join(base, os.path.basename(path)), levels)
+        if target == path:
+            continue
+        if os.path.exists(target):
+            _log.warning("Not moving %s: %s exists", path, target)
+            continue
+        moved += 1
+        if dry_run:
+            print('%s -> %s' % (path, target))
+            continue
+        target_dir = os.path.dirname(target)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        os.rename(path, target)
+        moves.append((path, target))
+        if base not in quotas:
+            quotas[base] = (Quota(base) if os.path.exists(os.path.join(base, QUOTA_FILE))
+                            else None)
+        if quotas[base] is not None:
+            quotas[base].update(path, target, os.path.getsize(target))
+        if os.path.dirname(path) != base:
+            emptied.add((base, os.path.dirname(path)))
+    for quota in quotas.values():
+        if quota is not None:
+            quota.close()
+    if catalog is not None and moves:
+        db = Catalog(catalog)
+        try:
+            db.move_files(moves)
+        finally:
+            db.close()
+    if not dry_run:
+        emptied.update(_migrate_records(root, levels))
+    # drop the fan-out folders emptied by the move
+    for base, dirpath in sorted(emptied, key=lambda entry: -len(entry[1])):
+        while dirpath != base:
+            try:
+                os.rmdir(dirpath)
+            except OSError:  # not empty
+                break
+            dirpath = os.path.dirname(dirpath)
+    return moved
+
+
+def _migrate_records(root, levels):
+    """Rewrite the postprocess records (see postprocess.py) into the
+    folders of the files they are about, with their new paths; returns the
+    (base dir, folder) of the record files removed"""
+    root = os.path.normpath(root)
+    sources = {}  # record file -> base dir
+    moved = {}  # record file -> [line, ...]
+    for dirpath, _, filenames in os.walk(root):
+        if RECORD_FILE not in filenames:
+            continue
+        record_file = os.path.join(dirpath, RECORD_FILE)
+        sources[record_file] = dirpath
+        with open(record_file) as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+                name = os.path.basename(record['path'])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue  # torn line
+            base = sources[record_file] = base_dir(dirpath, name, root)
+            record['path'] = fanout_path(os.path.join(base, name), levels)
+            if record.get('new_path'):
+                record['new_path'] = fanout_path(
+                    os.path.join(base, os.path.basename(record['new_path'])), levels)
+            target = os.path.join(os.path.dirname(record['path']), RECORD_FILE)
+            moved.setdefault(target, []).append(json.dumps(record) + '\n')
+    # (written before the old ones go: a crash leaves duplicates, not gaps)
+    for record_file, lines in moved.items():
+        target_dir = os.path.dirname(record_file)
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        with open(record_file + '.tmp', 'w') as f:
+            f.writelines(lines)
+        os.replace(record_file + '.tmp', record_file)
+    removed = set()
+    for record_file, base in sources.items():
+        if record_file not in moved:
+            os.remove(record_file)
+            removed.add((base, os.path.dirname(record_file)))
+    return removed
+
+
+def main(args=None):
+    parser = ArgumentParser(description='Move the downloads in a folder into '
+                            'a hashed fan-out layout (see --fanout).')
+    parser.add_argument('dir', help='Download folder (subfolders are included).')
+    parser.add_argument('levels', type=int, help='Fan-out levels, 0 to flatten.')
+    parser.add_argument('--dry-run', default=False, action='store_true',
+                        help='Only print what would be moved.')
+    parser.add_argument('--catalog', metavar='PATH', default=None,
+                        help='Catalog (see --catalog) whose file paths to update.')
+    args = parser.parse_args(args)
+    if args.catalog is None and not args.dry_run:
+        for dirpath, _, filenames in os.walk(args.dir):
+            if CATALOG_FILE in filenames:
+                parser.error('%s would go stale: pass it with --catalog' % (
+                    os.path.join(dirpath, CATALOG_FILE)))
+    moved = migrate(args.dir, args.levels, dry_run=args.dry_run, catalog=args.catalog)
+    print('%s %i files' % ('Would move' if args.dry_run else 'Moved', moved))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Pluggable HTML link extraction for the resolvers.
+
+Resolvers only need a handful of things out of a page: ``<img src>``,
+``<a href>`` and ``<source type src>``. They state which ones with `want`
+and the fastest available backend extracts just that:
+
+* ``lxml``   -- ``lxml.html`` + XPath (fastest, optional dependency)
+* ``stdlib`` -- ``html.parser`` tokenizer; can stop early once `limit`
+  results per wanted tag are found
+* ``bs4``    -- BeautifulSoup with :data:`BS4_PARSER` (html5lib by default);
+  slowest but the most forgiving, kept as a fallback
+
+>>> page = extract('<a href="/x">x</a><img src="a.png">', base_url='http://h/')
+>>> page.links, page.imgs
+(['http://h/x'], ['http://h/a.png'])
+"""
+
+import os
+import re
+import logging
+import urllib.parse
+from html.parser import HTMLParser
+
+
+_log = logging.getLogger(__name__)
+
+ALL_TAGS = ('img', 'a', 'source')
+BACKENDS = ('lxml', 'stdlib', 'bs4')
+BS4_PARSER = 'html5lib'
+
+_xml_declaration_re = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+# Preferred backend; None means the first importable one in BACKENDS.
+_backend = os.environ.get('REDDITDL_HTML_BACKEND') or None
+
+
+class Page(object):
+    """Extraction result: lists of urls plus (type, src) pairs of <source>"""
+
+    def __init__(self, imgs=None, links=None, sources=None):
+        self.imgs = imgs or []
+        self.links = links or []
+        self.sources = sources or []
+
+    def __repr__(self):
+        return '<Page imgs=%d links=%d sources=%d>' % (
+            len(self.imgs), len(self.links), len(self.sources))
+
+    def absolutize(self, base_url):
+        join = urllib.parse.urljoin
+        self.imgs = [join(base_url, v) for v in self.imgs]
+        self.links = [join(base_url, v) for v in self.links]
+        self.sources = [(t, join(base_url, v)) for t, v in self.sources]
+        return self
+
+
+def _decode(html):
+    if isinstance(html, bytes):
+        return html.decode('utf-8', 'replace')
+    return html
+
+
+class BackendFailed(Exception):
+    """An optional backend couldn't parse the page (the next one is tried)"""
+
+
+def _extract_lxml(html, want, limit):
+    import lxml.etree
+    import lxml.html
+    # lxml refuses str input declaring an encoding (already decoded)
+    html = _xml_declaration_re.sub('', html, count=1)
+    try:
+        tree = lxml.html.fromstring(html)
+    except (lxml.etree.LxmlError, ValueError) as exc:  # e.g. 'Document is empty'
+        raise BackendFailed(exc)
+    page = Page()
+    if 'img' in want:
+        page.imgs = [v for v in tree.xpath('//img/@src') if v][:limit]
+    if 'a' in want:
+        page.links = [v for v in tree.xpath('//a/@href') if v][:limit]
+    if 'source' in want:
+        page.sources = [(el.get('type'), el.get('src'))
+                        for el in tree.xpath('//source[@type][@src]')][:limit]
+    return page
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _LinkParser(HTMLParser):
+
+    _attr_of = {'img': 'src', 'a': 'href'}
+
+    def __init__(self, want, limit):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.want = want
+        self.limit = limit
+        self.page = Page()
+        self._lists = {'img': self.page.imgs, 'a': self.page.links,
+                       'source': self.page.sources}
+
+    def _done(self):
+        return all(len(self._lists[tag]) >= self.limit for tag in self.want)
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in self.want:
+            return
+        target = self._lists[tag]
+        if self.limit is not None and len(target) >= self.limit:
+            return
+        attrs = dict(attrs)
+        if tag == 'source':
+            if attrs.get('type') and attrs.get('src'):
+                target.append((attrs['type'], attrs['src']))
+        elif attrs.get(self._attr_of[tag]):
+            target.append(attrs[self._attr_of[tag]])
+        else:
+            return
+        if self.limit is not None and self._done():
+            raise _StopParsing()
+
+    handle_startendtag = handle_starttag
+
+
+def _extract_stdlib(html, want, limit):
+    parser = _LinkParser(want, limit)
+    try:
+        parser.feed(html)
+        parser.close()
+    except _StopParsing:
+        pass
+    return parser.page
+
+
+def _extract_bs4(html, want, limit):
+    import bs4
+    try:
+        soup = bs4.BeautifulSoup(html, BS4_PARSER)
+    except bs4.FeatureNotFound as exc:  # BS4_PARSER isn't installed
+        raise ImportError(str(exc))
+    except getattr(bs4.builder, 'ParserRejectedMarkup', ()) as exc:  # (bs4 >= 4.9)
+        raise BackendFailed(exc)
+    page = Page()
+    if 'img' in want:
+        page.imgs = [v.get('src') for v in soup.find_all('img', src=True, limit=limit)]
+    if 'a' in want:
+        page.links = [v.get('href') for v in soup.find_all('a', href=True, limit=limit)]
+    if 'source' in want:
+        page.sources = [(v.get('type'), v.get('src'))
+                        for v in soup.find_all('source', type=True, src=True, limit=limit)]
+    return page
+
+
+_extractors = {
+    'lxml': _extract_lxml,
+    'stdlib': _extract_stdlib,
+    'bs4': _extract_bs4,
+}
+
+
+def set_backend(name):
+    """Prefer backend `name` (one of BACKENDS); None to pick automatically"""
+    global _backend
+    if name is not None and name not in _extractors:
+        raise ValueError('unknown html backend %r, expected one of %r' % (name, BACKENDS))
+    _backend = name
+
+
+def get_backend():
+    """The preferred backend (None: automatic); pass it along to work done
+    in other processes, which don't share the setting"""
+    return _backend
+
+
+def _candidates(backend):
+    backend = backend or _backend
+    if backend:
+        return [backend] + [b for b in BACKENDS if b != backend]
+    return list(BACKENDS)
+
+
+def extract(html, want=ALL_TAGS, base_url=None, limit=None, backend=None):
+    """Extract what the resolver wants from `html`
+
+    :param want: subset of ALL_TAGS
+    :param base_url: make the urls absolute against it
+    :param limit: max results per wanted tag (lets the stdlib backend stop
+        parsing early)
+    :param backend: force a backend; others are still tried if it isn't
+        installed or can't parse the page
+    :rtype: Page
+    """
+    if backend is not None and backend not in _extractors:
+        raise ValueError('unknown html backend %r, expected one of %r' % (backend, BACKENDS))
+    html = _decode(html)
+    want = frozenset(want)
+    for name in _candidates(backend):
+        try:
+            page = _extractors[name](html, want, limit)
+        except ImportError:
+            continue
+        except BackendFailed as exc:
+            _log.debug("html backend %r failed: %r", name, exc)
+            continue
+        return page.absolutize(base_url) if base_url else page
+    return Page()
@@ -0,0 +1,326 @@
+"""On-disk HTTP cache for page / API fetches.
+
+Entries are stored under sha1(url)-named files and follow the RFC 7234
+basics: ``Cache-Control`` (no-store, no-cache, max-age), ``Expires``, the
+Last-Modified heuristic, and revalidation with ``ETag`` / ``Last-Modified``.
+The total size is capped; least recently used entries are evicted first.
+
+Usage::
+
+    httpcache.configure('~/.cache/redditdl', max_size=256 * MiB)
+    response = httpcache.urlopen(url)   # urllib-like response object
+
+Without :func:`configure` :func:`urlopen` is a plain ``urllib`` fetch.
+"""
+
+import io
+import os
+import json
+import time
+import email.utils
+import hashlib
+import logging
+import tempfile
+import threading
+from urllib.request import urlopen as _urlopen, Request
+from urllib.error import HTTPError
+
+from . import memory
+
+
+_log = logging.getLogger(__name__)
+
+MiB = 2 ** 20
+DEFAULT_MAX_SIZE = 256 * MiB
+# Part of the (Date - Last-Modified) age used as freshness when the server
+# gives no explicit expiry (RFC 7234 4.2.2).
+HEURISTIC_FRACTION = 0.1
+# Content types worth caching (pages & API responses; media isn't).
+CACHED_TYPES = ('text/', 'application/json', 'application/javascript',
+                'application/xml', 'application/xhtml+xml')
+# Reserved from the memory budget for bodies without a Content-Length.
+BODY_ESTIMATE = MiB
+
+_default_cache = None
+
+
+def _parse_http_date(value):
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def parse_cache_control(value):
+    """``'max-age=60, no-cache'`` -> ``{'max-age': '60', 'no-cache': None}``"""
+    res = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            res[name.lower()] = arg.strip('"') if arg else None
+    return res
+
+
+def freshness_lifetime(headers, now=None):
+    """Seconds the response may be served without revalidation (may be 0)
+
+    :param headers: dict with lowercase header names
+    """
+    now = time.time() if now is None else now
+    cc = parse_cache_control(headers.get('cache-control'))
+    if 'no-cache' in cc or 'no-store' in cc:
+        return 0
+    if 'max-age' in cc:
+        try:
+            return max(0, int(cc['max-age']))
+        except (TypeError, ValueError):
+            return 0
+    date = _parse_http_date(headers.get('date')) or now
+    expires = _parse_http_date(headers.get('expires'))
+    if headers.get('expires') is not None:
+        return max(0, expires - date) if expires is not None else 0
+    last_modified = _parse_http_date(headers.get('last-modified'))
+    if last_modified is not None and last_modified < date:
+        return (date - last_modified) * HEURISTIC_FRACTION
+    return 0
+
+
+class CachedResponse(object):
+    """Minimal stand-in for the object returned by ``urllib`` urlopen
+
+    The body is held on the memory budget until the response is closed or
+    dropped.
+    """
+
+    def __init__(self, url, status, headers, body, from_cache=False):
+        self.url = url
+        self.status = self.code = status
+        self.headers = headers  # lowercase names
+        self.body = body
+        self.from_cache = from_cache
+        self._fo = io.BytesIO(body)
+        self._held = memory.hold(len(body))
+
+    def read(self, *ar):
+        return self._fo.read(*ar)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self._fo.close()
+        self._held.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ar):
+        self.close()
+
+
+def urllib_transport(url, headers, timeout=None):
+    """Default transport: ``(status, headers, body, final_url)`` via urllib,
+    a 304 is returned as a status rather than raised.
+    """
+    req = Request(url, headers=headers)
+    try:
+        resp = _urlopen(req, timeout=timeout) if timeout else _urlopen(req)
+    except HTTPError as exc:
+        if exc.code == 304:
+            return 304, {k.lower(): v for k, v in exc.headers.items()}, b'', url
+        raise
+    with resp:
+        try:
+            expected = int(resp.info().get('content-length'))
+        except (TypeError, ValueError):
+            expected = BODY_ESTIMATE
+        with memory.reserve(expected):
+            body = resp.read()
+        return (resp.getcode(), {k.lower(): v for k, v in resp.info().items()},
+                body, resp.geturl())
+
+
+class HTTPCache(object):
+    """Disk cache of GET responses keyed by url"""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._total = sum(size for _, _, size in self._entries())
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return base + '.meta', base + '.body'
+
+    def _entries(self):
+        """(body_path, last_used, size) of every stored entry"""
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.body'):
+                    st = entry.stat()
+                    yield entry.path, st.st_mtime, st.st_size
+
+    def lookup(self, url):
+        """Stored (meta, body) for `url` or None"""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('url') != url:
+            return None
+        try:
+            os.utime(body_path)  # LRU bookkeeping
+        except OSError:
+            pass
+        return meta, body
+
+    @staticmethod
+    def is_fresh(meta, now=None):
+        now = time.time() if now is None else now
+        return now < meta.get('expires', 0)
+
+    @staticmethod
+    def conditional_headers(meta):
+        headers = {}
+        if meta['headers'].get('etag'):
+            headers['If-None-Match'] = meta['headers']['etag']
+        if meta['headers'].get('last-modified'):
+            headers['If-Modified-Since'] = meta['headers']['last-modified']
+        return headers
+
+    def _write(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def store(self, url, status, headers, body, final_url=None):
+        """Save a response if it's cacheable; returns its meta or None"""
+        cc = parse_cache_control(headers.get('cache-control'))
+        if status != 200 or 'no-store' in cc:
+            return None
+        content_type = (headers.get('content-type') or 'text/').lower()
+        if not content_type.startswith(CACHED_TYPES):
+            return None  # media would evict the pages
+        lifetime = freshness_lifetime(headers)
+        if not lifetime and not (headers.get('etag') or headers.get('last-modified')):
+            return None  # would never be usable
+        meta = dict(url=url, final_url=final_url or url, status=status,
+                    headers=headers, stored=time.time(),
+                    expires=time.time() + lifetime)
+        meta_path, body_path = self._paths(url)
+        with self._lock:
+            try:
+                self._total -= os.path.getsize(body_path)
+            except OSError:
+                pass
+            self._write(body_path, body)
+            self._write(meta_path, json.dumps(meta).encode('utf-8'))
+            self._total += len(body)
+            if self._total > self.max_size:
+                self._evict()
+        return meta
+
+    def revalidated(self, url, meta, headers):
+        """Update a stored entry after a 304"""
+        merged = dict(meta['headers'])
+        merged.update({k: v for k, v in headers.items()
+                       if k in ('cache-control', 'expires', 'date', 'etag', 'last-modified')})
+        meta = dict(meta, headers=merged, expires=time.time() + freshness_lifetime(merged))
+        meta_path, _ = self._paths(url)
+        with self._lock:
+            self._write(meta_path, json.dumps(meta).encode('utf-8'))
+        return meta
+
+    def _evict(self):
+        """Drop least recently used entries down to 90% of max_size
+        (called with the lock held)"""
+        target = self.max_size * 0.9
+        for body_path, _, size in sorted(self._entries(), key=lambda e: e[1]):
+            if self._total <= target:
+                break
+            for path in (body_path, body_path[:-len('.body')] + '.meta'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total -= size
+            _log.debug("Evicted %r", body_path)
+
+    def fetch(self, url, headers=None, transport=urllib_transport, **kwa):
+        """GET through the cache; returns a :class:`CachedResponse`
+
+        :param transport: callable(url, headers, **kwa) returning
+            (status, lowercase-headers, body, final_url)
+        """
+        headers = dict(headers or {})
+        cached = self.lookup(url)
+        if cached is not None:
+            meta, body = cached
+            if self.is_fresh(meta):
+                return CachedResponse(meta['final_url'], meta['status'],
+                                      meta['headers'], body, from_cache=True)
+            headers.update(self.conditional_headers(meta))
+        status, resp_headers, resp_body, final_url = transport(url, headers, **kwa)
+        if status == 304 and cached is not None:
+            meta = self.revalidated(url, cached[0], resp_headers)
+            return CachedResponse(meta['final_url'], meta['status'],
+                                  meta['headers'], cached[1], from_cache=True)
+        response = CachedResponse(final_url, status, resp_headers, resp_body)
+        self.store(url, status, resp_headers, resp_body, final_url=final_url)
+        return response
+
+
+def configure(cache_dir, max_size=DEFAULT_MAX_SIZE):
+    """Set up the process-wide cache used by :func:`urlopen`;
+    `cache_dir` of None disables caching.
+    """
+    global _default_cache
+    _default_cache = HTTPCache(cache_dir, max_size) if cache_dir else None
+    return _default_cache
+
+
+def get_cache():
+    return _default_cache
+
+
+def fetch(url, headers=None, transport=urllib_transport, **kwa):
+    """GET `url` through the process-wide cache (if configured)"""
+    if _default_cache is not None:
+        return _default_cache.fetch(url, headers, transport=transport, **kwa)
+    status, resp_headers, body, final_url = transport(url, dict(headers or {}), **kwa)
+    return CachedResponse(final_url, status, resp_headers, body)
+
+
+def urlopen(url, timeout=None):
+    """Drop-in for ``urllib.request.urlopen`` for page / JSON fetches
+
+    :param url: url string or ``urllib.request.Request`` (its headers are used)
+    """
+    headers = {}
+    if isinstance(url, Request):
+        headers = dict(url.header_items())
+        url = url.full_url
+    kwa = dict(timeout=timeout) if timeout else {}
+    return fetch(url, headers, **kwa)
@@ -0,0 +1,155 @@
+"""Read image/video dimensions from the first few KB of a file.
+
+Supports JPEG (SOFn), PNG (IHDR), GIF, WebP (VP8/VP8L/VP8X) and MP4/MOV
+(``tkhd``), which is enough to reject small or portrait images before their
+body is downloaded.
+"""
+
+import struct
+
+
+# Give up sniffing after this many bytes; whatever was read is not wasted as
+# the caller keeps it as the beginning of the file.
+SNIFF_LIMIT = 256 * 1024
+SNIFF_CHUNK = 8 * 1024
+
+_jpeg_sof_markers = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _jpeg_size(data):
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # no payload
+            pos += 2
+            continue
+        seg_len = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in _jpeg_sof_markers:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + seg_len
+    return None
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25:
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height
+    return None
+
+
+def _mp4_size(data):
+    """Dimensions from the first video `tkhd` box (needs `moov` up front)"""
+    pos = data.find(b'tkhd')
+    while pos >= 4:
+        box = pos - 4
+        version = data[pos + 4] if pos + 4 < len(data) else None
+        if version is None:
+            return None
+        # size(4) type(4) version(1) flags(3) times/ids, reserved(8),
+        # layer/alternate/volume/reserved(8), matrix(36), width, height
+        offset = box + 12 + (32 if version == 1 else 20) + 8 + 8 + 36
+        if offset + 8 > len(data):
+            return None
+        width, height = struct.unpack('>II', data[offset:offset + 8])
+        if width and height:  # audio tracks have 0x0
+            return width >> 16, height >> 16
+        pos = data.find(b'tkhd', pos + 4)
+    return None
+
+
+def sniff_size(data):
+    """Return (width, height) from the header bytes in `data` or None if the
+    format is unknown or more data is needed.
+    """
+    if data[:3] == b'\xff\xd8\xff':
+        return _jpeg_size(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) >= 24 and data[12:16] == b'IHDR':
+            return struct.unpack('>II', data[16:24])
+        return None
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) >= 10:
+            return struct.unpack('<HH', data[6:10])
+        return None
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _webp_size(data)
+    if data[4:8] == b'ftyp':
+        return _mp4_size(data)
+    return None
+
+
+def read_head(fileobj, limit=SNIFF_LIMIT, chunk_size=SNIFF_CHUNK):
+    """Read from `fileobj` just until the dimensions are known
+
+    :return: (head_bytes, size) where size is None when it couldn't be
+        determined within `limit` bytes
+    """
+    head = b''
+    while len(head) < limit:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        head += chunk
+        size = sniff_size(head)
+        if size is not None:
+            return head, size
+    return head, None
+
+
+def parse_aspect(value):
+    """Parse a minimum width/height ratio given as ``16:9`` or ``1.77``"""
+    if ':' in value:
+        width, height = (float(part) for part in value.split(':', 1))
+        if width <= 0 or height <= 0:
+            raise ValueError('aspect ratio must be positive, got %r' % value)
+        ratio = width / height
+    else:
+        ratio = float(value)
+    if ratio <= 0:
+        raise ValueError('aspect ratio must be positive, got %r' % value)
+    return ratio
+
+
+class SizeFilter(object):
+    """Minimum dimension / aspect ratio requirements for downloaded media"""
+
+    def __init__(self, min_width=0, min_height=0, min_aspect=None):
+        self.min_width = min_width or 0
+        self.min_height = min_height or 0
+        self.min_aspect = min_aspect
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a filter from parsed cli arguments; None if no limit is set"""
+        if not (args.min_width or args.min_height or args.aspect):
+            return None
+        return cls(args.min_width, args.min_height, args.aspect)
+
+    def check(self, size):
+        """Return the reason `size` is rejected, or None if it is accepted
+        (unknown sizes are accepted)
+        """
+        if size is None:
+            return None
+        width, height = size
+        if width < self.min_width or height < self.min_height:
+            return 'too small (%dx%d)' % (width, height)
+        if self.min_aspect and (not height or float(width) / height < self.min_aspect):
+            return 'aspect ratio too narrow (%dx%d)' % (width, height)
+        return None
@@ -0,0 +1,188 @@
+"""Job spec files: a subreddit list where every entry has its own options.
+
+Given instead of a subreddit (or subreddit list) file, by extension:
+
+* ``.jsonl`` -- one JSON object per line::
+
+    {"subreddit": "EarthPorn", "dir": "nature", "num": 20, "score": 1000}
+    {"subreddit": "wallpapers", "sort_type": "top", "min_width": 1920, "priority": 5}
+
+* ``.json`` -- an array of such objects
+* ``.yaml`` / ``.yml`` -- a list of them, or one per document (needs PyYAML)
+* ``.toml`` -- ``[[job]]`` tables
+
+Entries are parsed one at a time (TOML files as a whole), so huge lists
+are never held as text, and unlike parse_subreddit_list nothing creates
+folders: they are made by the first write into them.
+
+Entry keys: ``subreddit`` (a name, ``r/name`` or listing url), ``dir``
+(folder relative to the destination, default: the subreddit), the
+:data:`ENTRY_OPTIONS` (command line options, which they override; values
+may be given as on the command line, e.g. ``"max_resolution": "1920x1080"``;
+flags take booleans, the others a string or number),
+``priority`` (higher runs first) and ``weight`` (share of the polls in
+``--watch``: weight 2 is polled twice as often).
+"""
+
+import os
+import re
+import json
+from collections import namedtuple
+
+
+SPEC_EXTS = ('.jsonl', '.json', '.yaml', '.yml', '.toml')
+# Options an entry may set.
+ENTRY_OPTIONS = (
+    'num', 'score', 'sort_type', 'sfw', 'nsfw', 'regex', 'title_contain', 'skipAlbums',
+    'mirror_gfycat', 'filename_format', 'update', 'restart', 'incremental',
+    'min_width', 'min_height', 'aspect', 'max_resolution')
+# Of those, the flags: their values are booleans.
+FLAG_OPTIONS = (
+    'sfw', 'nsfw', 'skipAlbums', 'mirror_gfycat', 'update', 'restart', 'incremental')
+
+_subreddit_re = re.compile(r'^(?:(?:https?://)?(?:www\.)?reddit\.com)?/?(?:r/)?([A-Za-z0-9_]+)/?$')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class JobSpecError(ValueError):
+    pass
+
+
+class Job(namedtuple('Job', 'subreddit dir overrides weight priority')):
+    """An entry of a job spec
+
+    :param overrides: sorted tuple of (option, value)
+    """
+    __slots__ = ()
+
+
+def is_job_spec(path):
+    return os.path.splitext(path)[1].lower() in SPEC_EXTS
+
+
+def _iter_jsonl(f):
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                raise JobSpecError('line %d: %s' % (number, exc))
+
+
+def _iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """Items of a top-level JSON array, decoded as the file is read"""
+    decoder = json.JSONDecoder()
+    buf, pos, started = '', 0, False
+    eof = False
+    while True:
+        # skip whitespace & separators
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+        if pos >= len(buf):
+            raise JobSpecError('unterminated JSON array')
+        if not started:
+            if buf[pos] != '[':
+                raise JobSpecError('expected a JSON array of jobs')
+            started, pos = True, pos + 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # item cut by the chunk boundary: read more
+            more = f.read(chunk_size)
+            if not more:
+                raise JobSpecError('invalid JSON near %r' % buf[pos:pos + 40])
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item
+        buf, pos = buf[end:], 0
+
+
+def _iter_yaml(f):
+    import yaml
+    for document in yaml.safe_load_all(f):
+        if isinstance(document, list):
+            for entry in document:
+                yield entry
+        elif document is not None:
+            yield document
+
+
+def _iter_toml(path):
+    try:
+        import tomllib
+    except ImportError:  # py < 3.11
+        import tomli as tomllib
+    with open(path, 'rb') as f:
+        data = tomllib.load(f)
+    for entry in data.get('job', []):
+        yield entry
+
+
+def iter_entries(path):
+    """Raw entries (dicts) of a job spec file"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.toml':
+        yield from _iter_toml(path)
+        return
+    with open(path) as f:
+        if ext == '.jsonl':
+            yield from _iter_jsonl(f)
+        elif ext == '.json':
+            yield from _iter_json_array(f)
+        elif ext in ('.yaml', '.yml'):
+            yield from _iter_yaml(f)
+        else:
+            raise JobSpecError('unknown job spec format %r' % ext)
+
+
+def parse_entry(entry, base_dir):
+    """Job of a raw entry
+
+    >>> parse_entry({'subreddit': '/r/EarthPorn/', 'score': 50, 'priority': 1}, 'pics')
+    Job(subreddit='EarthPorn', dir='pics/EarthPorn', overrides=(('score', 50),), weight=1.0, priority=1)
+    """
+    if not isinstance(entry, dict):
+        raise JobSpecError('job entries are mappings, got %r' % (entry,))
+    entry = dict(entry)
+    match = _subreddit_re.match(str(entry.pop('subreddit', '')).strip())
+    if not match:
+        raise JobSpecError('no valid subreddit in %r' % (entry,))
+    subreddit = match.group(1)
+    folder = os.path.join(base_dir, str(entry.pop('dir', None) or subreddit))
+    try:
+        weight = float(entry.pop('weight', 1))
+        priority = int(entry.pop('priority', 0))
+    except (TypeError, ValueError):
+        raise JobSpecError('%s: weight and priority are numbers' % subreddit)
+    if weight <= 0:
+        raise JobSpecError('%s: weight must be positive' % subreddit)
+    # 'sort-type' as well as 'sort_type'
+    overrides = {key.replace('-', '_'): value for key, value in entry.items()}
+    unknown = sorted(set(overrides) - set(ENTRY_OPTIONS))
+    if unknown:
+        raise JobSpecError('%s: unknown option(s) %s' % (subreddit, ', '.join(unknown)))
+    for name, value in sorted(overrides.items()):
+        if name in FLAG_OPTIONS:
+            if not isinstance(value, bool):
+                raise JobSpecError('%s: %s is true or false, got %r' % (subreddit, name, value))
+        elif isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise JobSpecError('%s: %s is a string or number, got %r' % (subreddit, name, value))
+    return Job(subreddit, folder, tuple(sorted(overrides.items())), weight, priority)
+
+
+def iter_jobs(path, base_dir):
+    """Jobs of the job spec file at `path`, folders relative to `base_dir`"""
+    for number, entry in enumerate(iter_entries(path), 1):
+        try:
+            yield parse_entry(entry, base_dir)
+        except JobSpecError as exc:
+            raise JobSpecError('%s, job %d: %s' % (path, number, exc))
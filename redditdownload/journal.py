@@ -0,0 +1,171 @@
+"""Structured event journal (``--journal``) and the console output.
+
+Every result of a run (saved, skipped with its reason, failed with the
+error class, and how long it took) is one JSON line of the journal::
+
+    {"time": 1500000000.1, "event": "skipped", "subreddit": "pics", "id": "6abc",
+     "url": "...", "path": null, "reason": "Regex match failed", "error": null,
+     "elapsed": 0.0}
+
+The download loop only puts the events on a bounded queue; a background
+thread writes them in batches, with one flush per batch, so the loop never
+waits on the disk (unless the queue is full, which throttles it rather than
+dropping events). The console output is derived from the same results and
+rate-limited by :class:`Console`.
+"""
+
+import sys
+import json
+import queue
+import logging
+import threading
+import time
+from collections import Counter
+
+
+_log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+# Longest an event waits in a partial batch, seconds.
+FLUSH_INTERVAL = 1.0
+# Console lines per second.
+CONSOLE_RATE = 20
+
+_CLOSE = object()
+
+
+def to_event(result, now=None):
+    """JSON-able dict of a DownloadResult"""
+    return dict(time=round(time.time() if now is None else now, 3),
+                event=result.status, subreddit=result.subreddit, id=result.item_id,
+                url=result.url, path=result.path, reason=result.reason,
+                error=result.error, elapsed=result.elapsed)
+
+
+class Journal(object):
+    """JSON lines journal appended to `path` by a background thread
+
+    The file is opened up front, so a bad path fails in the caller; the
+    thread starts with the first event and stops on close(). The journal
+    may be used again after that.
+    """
+
+    def __init__(self, path, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._fo = open(path, 'a')
+
+    def record(self, result):
+        """Queue the event of a DownloadResult"""
+        self.write(to_event(result))
+
+    def write(self, event):
+        """Queue a JSON-able dict"""
+        if self._thread is None:
+            with self._lock:
+                if self._fo is None:  # closed: reopen
+                    self._fo = open(self.path, 'a')
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='journal')
+                    self._thread.daemon = True
+                    self._thread.start()
+        self._queue.put(event)
+
+    def _batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not _CLOSE:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._batch()
+            lines = []
+            for event in batch:
+                if event is _CLOSE:
+                    continue
+                try:
+                    lines.append(json.dumps(event) + '\n')
+                except (TypeError, ValueError):
+                    _log.exception("Not journaled: %r", event)
+            try:
+                self._fo.writelines(lines)
+                self._fo.flush()
+            except (IOError, OSError) as exc:
+                # keep draining the queue: a dead writer would block the loop
+                _log.error("Writing %d events to %s failed: %r", len(lines), self.path, exc)
+            if batch[-1] is _CLOSE:
+                return
+
+    def close(self):
+        """Write out what's queued and stop the writer thread"""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(_CLOSE)
+                self._thread.join()
+                self._thread = None
+            if self._fo is None:
+                return
+            try:
+                self._fo.close()
+            except (IOError, OSError) as exc:
+                _log.error("Closing %s failed: %r", self.path, exc)
+            self._fo = None
+
+
+class Console(object):
+    """Prints the lines `formatter` makes of the results, at most `rate`
+    a second (0: no limit); the others are counted and summarized once a
+    second, so a fast run doesn't spend its time writing to the terminal
+
+    :param formatter: callable(DownloadResult) -> line or None
+    """
+
+    def __init__(self, formatter, rate=CONSOLE_RATE, out=None, clock=time.time):
+        self.formatter = formatter
+        self.rate = rate
+        self.out = out
+        self.clock = clock
+        self._window = None
+        self._lines = 0
+        self._suppressed = Counter()
+
+    def __call__(self, result):
+        line = self.formatter(result)
+        if line is None:
+            return
+        now = self.clock()
+        if self._window is None or now - self._window >= 1:
+            self.summarize()
+            self._window, self._lines = now, 0
+        if not self.rate or self._lines < self.rate:
+            self._lines += 1
+            self._print(line)
+        else:
+            self._suppressed[result.status] += 1
+
+    def summarize(self):
+        """Print the count of the lines left out"""
+        if not self._suppressed:
+            return
+        self._print('    ... %i more (%s)' % (
+            sum(self._suppressed.values()),
+            ', '.join('%i %s' % (count, status)
+                      for status, count in self._suppressed.most_common())))
+        self._suppressed.clear()
+
+    def _print(self, line):
+        print(line, file=self.out or sys.stdout)
@@ -0,0 +1,257 @@
+"""Bounded-memory mode (``--memory-budget``).
+
+The buffers that are in flight at the same time reserve their bytes
+from one process-wide budget first:
+
+* work buffers (the chunks of segmented downloads, the copy buffer of a
+  download, image probes of img_scrap_stuff) :func:`acquire` theirs,
+  blocking until others release theirs, so the workers slow down instead
+  of growing;
+* read-ahead (backfill windows fetched ahead of the download loop) only
+  :func:`try_acquire`: what doesn't fit isn't fetched yet;
+* buffers that outlive the work that read them (page bodies kept by
+  httpcache responses, the images img_scrap_stuff found) are :func:`hold`
+  until released, which is when their consumer is done with them.
+
+Read-ahead and held buffers never wait, and work buffers are released
+without waiting on anything else, so the budget can't deadlock:
+a work reservation goes through when no other work is in flight, even
+if it (or the read-ahead) is over the budget.
+
+The resident set size is watched too: while it is over the budget, work
+reservations wait for the others in flight to be released, whatever the
+accounted total says, and no read-ahead is started.
+
+:func:`report` is the gauge: accounted bytes (current and peak), RSS
+(current and peak), the time producers spent blocked and, when
+:mod:`tracemalloc` is tracing (``PYTHONTRACEMALLOC=1``), the traced
+Python allocations.
+
+Without :func:`configure` reservations cost nothing.
+"""
+
+import os
+import sys
+import gc
+import time
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+
+_log = logging.getLogger(__name__)
+
+# How often a blocked producer re-checks the RSS (seconds).
+POLL_INTERVAL = 0.5
+
+_budget = None
+
+
+def rss():
+    """Resident set size of the process in bytes, None if unknown"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size in bytes, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryBudget(object):
+    """Byte reservations against `limit`
+
+    :param rss: callable returning the RSS (None: unknown), checked
+        against `limit` as well
+    """
+
+    def __init__(self, limit, rss=rss, poll_interval=POLL_INTERVAL):
+        self.limit = limit
+        self.rss = rss
+        self.poll_interval = poll_interval
+        self.used = 0
+        self.peak = 0
+        self.waits = 0
+        self.blocked = 0.0  # seconds
+        self._working = 0  # work reservations in flight
+        self._cond = threading.Condition()
+
+    def _fits(self, size):
+        if self.used + size > self.limit:
+            return False
+        current = self.rss()
+        return current is None or current <= self.limit
+
+    def _add(self, size):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    def acquire(self, size):
+        """Reserve `size` bytes of work buffer, blocking while they don't
+        fit and other work is in flight"""
+        with self._cond:
+            if self._working and not self._fits(size):
+                self.waits += 1
+                started = time.time()
+                collected = False
+                while self._working and not self._fits(size):
+                    if not collected:
+                        gc.collect()  # freed garbage may bring the RSS down
+                        collected = True
+                    # (RSS changes aren't notified: poll)
+                    self._cond.wait(self.poll_interval)
+                self.blocked += time.time() - started
+            self._working += 1
+            self._add(size)
+
+    def release(self, size):
+        """Give back an :meth:`acquire` reservation"""
+        with self._cond:
+            self._working -= 1
+            self.used -= size
+            self._cond.notify_all()
+
+    def try_acquire(self, size, force=False):
+        """Reserve `size` bytes of read-ahead if they fit (or `force`);
+        returns whether they were reserved"""
+        with self._cond:
+            if not force and not self._fits(size):
+                return False
+            self._add(size)
+            return True
+
+    def release_ahead(self, size):
+        """Give back a :meth:`try_acquire` reservation"""
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, size):
+        self.acquire(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def report(self):
+        """Gauge: dict of accounted bytes, RSS and blocking"""
+        return dict(limit=self.limit, reserved=self.used, reserved_peak=self.peak,
+                    waits=self.waits, blocked=round(self.blocked, 3), **gauge())
+
+
+def gauge():
+    """RSS and (if tracing) tracemalloc figures, in bytes"""
+    res = dict(rss=rss(), rss_peak=peak_rss())
+    if tracemalloc.is_tracing():
+        res['traced'], res['traced_peak'] = tracemalloc.get_traced_memory()
+    return res
+
+
+def configure(limit):
+    """Account the in-flight buffers of the process against `limit`
+    bytes; None disables it"""
+    global _budget
+    _budget = MemoryBudget(limit) if limit else None
+    return _budget
+
+
+def get_budget():
+    return _budget
+
+
+def acquire(size):
+    """Reserve `size` bytes from the process-wide budget (if configured)"""
+    if _budget is not None:
+        _budget.acquire(size)
+
+
+def release(size):
+    if _budget is not None:
+        _budget.release(size)
+
+
+def try_acquire(size, force=False):
+    """Reserve `size` bytes of read-ahead if they fit the process-wide
+    budget (always true without one)"""
+    return _budget is None or _budget.try_acquire(size, force)
+
+
+def release_ahead(size):
+    if _budget is not None:
+        _budget.release_ahead(size)
+
+
+@contextmanager
+def reserve(size):
+    """Hold `size` bytes of the process-wide budget (if configured) for
+    the duration of the block"""
+    if _budget is None:
+        yield
+        return
+    with _budget.reserve(size):
+        yield
+
+
+class Held(object):
+    """A :func:`hold` on the budget, given back by :meth:`release` (once)
+    or when dropped"""
+
+    def __init__(self, budget, size):
+        self.size = size
+        self._budget = budget
+
+    def release(self):
+        budget, self._budget = self._budget, None
+        if budget is not None:
+            budget.release_ahead(self.size)
+
+    __del__ = release
+
+
+def hold(size):
+    """Account `size` bytes of a buffer that outlives the work reservation
+    it was read under, until the returned :class:`Held` is released; never
+    waits (work does, for those bytes, while other work is in flight)"""
+    if _budget is not None:
+        _budget.try_acquire(size, force=True)
+    return Held(_budget, size)
+
+
+def report():
+    """Gauge of the process-wide budget, or of the process without one"""
+    return _budget.report() if _budget is not None else gauge()
+
+
+def format_report(report):
+    """One line summary of a :func:`report`
+
+    >>> format_report(dict(limit=2 ** 30, reserved=0, reserved_peak=3 * 2 ** 20,
+    ...                    waits=2, blocked=1.5, rss=200 * 2 ** 20, rss_peak=None))
+    'Memory: RSS 200.0 MiB, reserved peak 3.0 MiB of 1024.0 MiB, 2 waits (1.5s blocked)'
+    """
+    def mib(value):
+        return '?' if value is None else '%.1f MiB' % (value / 2.0 ** 20)
+    line = 'Memory: RSS %s' % mib(report.get('rss'))
+    if report.get('rss_peak'):
+        line += ' (peak %s)' % mib(report['rss_peak'])
+    if 'traced' in report:
+        line += ', traced %s (peak %s)' % (mib(report['traced']), mib(report['traced_peak']))
+    if 'limit' in report:
+        line += ', reserved peak %s of %s, %d waits (%ss blocked)' % (
+            mib(report['reserved_peak']), mib(report['limit']), report['waits'],
+            report['blocked'])
+    return line
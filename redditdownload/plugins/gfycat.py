@@ -6,6 +6,8 @@ import random
 import string
 import requests
 
+from ..httpcache import urlopen
+
 class gfycat(object):
 
     """
@@ -32,7 +34,7 @@ class gfycat(object):
             # added simple User-Ajent string to avoid CloudFlare block this request
             headers = {'User-Agent': 'Mozilla/5.0'}
             req = urllib.request.Request(url+param, None, headers)
-            connection = urllib.request.urlopen(req).read()
+            connection = urlopen(req).read()
         except urllib.error.HTTPError as err:
             raise ValueError(err.read())
         result = namedtuple("result", "raw json")
@@ -12,22 +12,29 @@ import json
 import logging
 import urllib.parse
 import traceback
+import itertools
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-from PIL import Image
-from io import StringIO
-import lxml
-import html5lib  # Heavily recommended for bs4 (apparently)
-import bs4
 import requests
-import magic  # python-magic
 
-import pyaux
+from ..imagesize import sniff_size
+from .. import httpcache
+from .. import htmlparse
+from .. import cpupool
+from .. import memory
 
 
 # Config-ish
 _requests_params = dict(timeout=20, verify=False)  ## Also global-ish stuff
-_CACHE_GET = False
-_BS_PARSER = "html5lib"  # "lxml"  # "html5lib", "lxml", "xml", "html.parser"
+# Concurrency and request size for `probe_image` in `do_horrible_things`
+_PROBE_WORKERS = 8
+_PROBE_BYTES = 16 * 1024
+# Concurrent full downloads of the images that passed the probes (per page)
+_FETCH_WORKERS = 2
+# What `do_horrible_thing` considers a notably large image
+_MIN_IMAGE_SIZE = (800, 600)
 
 
 # A bit sillily extensive; still, imgur and gfycat are loved by the reddits.
@@ -49,122 +56,6 @@ def indexall_re(topstr, substr_re):
     return (m.start() for m in re.finditer(substr_re, topstr))
 
 
-def walker(text, opening='{', closing='}'):
-    """ A near-useless experiment that was intended for `get_all_objects` """
-    stack = []
-    for pos in range(len(text)):
-        if text[pos:pos + len(opening)] == opening:
-            stack.append(pos)
-            continue
-        if text[pos:pos + len(closing)] == closing:
-            try:
-                start_pos = stack.pop(-1)
-            except IndexError:
-                continue
-            yield text[start_pos:pos + 1]
-
-
-def try_yaml_load(some_str, **kwa):
-    import yaml
-    try:
-        return yaml.safe_load(some_str, **kwa)
-    except Exception:
-        return
-
-
-def get_all_objects(text, beginning=r'{', debug=False):
-    """ Zealous obtainer of mappings from a text, e.g. in javascript
-    or JSON or whatever. Anything between '{' and '}'
-
-    The monstrous advanced version.
-
-    Not performant.
-
-    Requires pyyaml.
-
-    >>> st = 'a str with var stuff = {a: [{"v": 12}]} and such'
-    >>> next(get_all_objects(st))
-    {'a': [{'v': 12}]}
-    """
-
-    def _dbg_actual(st, *ar):
-        print("D: ", st % ar)
-
-    _dbg = _dbg_actual if debug else (lambda *ar: None)
-
-    import yaml
-
-    # Allow any escape to be treated as the character itself.
-    class ddd(dict):
-        def __getitem__(self, key):
-            try:
-                return dict.__getitem__(self, key)
-            except KeyError:
-                self.__setitem__(key, key)
-                return key
-
-    class TheLoader(yaml.SafeLoader):
-        ESCAPE_REPLACEMENTS = ddd(yaml.SafeLoader.ESCAPE_REPLACEMENTS)
-
-    from io import StringIO
-    # optimised slicing
-    if isinstance(text, str):
-        _dbg("encoding")
-        text = text.encode('utf-8')
-    _dbg("Length: %r", len(text))
-    beginnings = list(indexall_re(text, beginning))
-    _dbg("Beginnings amount: %r", len(beginnings))
-    _dbg("Beginnings list: %r", beginnings[:15] + (beginnings[15:] and ['...']))
-    text = StringIO(text)
-    for from_ in beginnings:
-        current_pos = text.tell()
-        _dbg("At %r", current_pos)
-#         if from_ < current_pos:
-#             _dbg("Skipping the beginning %r" % (from_,))
-#             # NOTE: this will skip the recursed structures.
-#             # Which is quite helpful.
-#             continue
-        text.seek(from_)
-        loader = TheLoader(text)
-        try:
-            art_res = loader.get_data()
-        except Exception as exc:
-            _dbg("Nope: %r / %s / %r", exc, exc, exc.args)
-            text.seek(from_)
-            _dbg("Stuff was: %r", repr(text.read(50)).decode('string-escape'))
-            continue
-        assert isinstance(part_res, dict)
-        yield part_res
-
-def get_all_objects(text, beginning=r'{'):
-    import yaml
-    # TODO?: somehow optimise the slicing?
-    for from_ in indexall_re(text, beginning):
-        loader = yaml.SafeLoader(StringIO(text))
-        loader.forward(from_)
-        # loader.update(from_)
-        try:
-            part_res = loader.get_data()
-        except Exception:
-            continue
-        assert isinstance(part_res, dict)
-        yield part_res
-
-
-def get_all_objects(text):
-    # Helper functions
-
-    # Permutate them all
-    results = (try_yaml_load(text[from_:to_ + 1])
-               for from_ in indexall(text, '{')
-               for to_ in indexall(text, '}'))
-    # Drop the failures
-    results = (val for val in results if val is not None)
-    # assert all(isinstance(val, dict) for val in results)
-    # NOTE: returns a generator
-    return results
-
-
 # Debug helper
 def setdiff(set_a, set_b):
     """ RTFS """
@@ -188,8 +79,10 @@ def get_reqr():
     from requests.adapters import HTTPAdapter
 
     reqr = requests.Session()
-    reqr.mount('http://', HTTPAdapter(max_retries=5))
-    reqr.mount('https://', HTTPAdapter(max_retries=5))
+    # Pool big enough for the concurrent probes.
+    pool_size = max(10, _PROBE_WORKERS)
+    reqr.mount('http://', HTTPAdapter(max_retries=5, pool_maxsize=pool_size))
+    reqr.mount('https://', HTTPAdapter(max_retries=5, pool_maxsize=pool_size))
     _common_reqr = reqr
     return reqr
 
@@ -224,22 +117,44 @@ def get_get(*ar, **kwa):
     raise GetError(ee)
 
 
-def get(url, cache_file=None, req_params=None, bs=True, response=False, undecoded=False,
+def _requests_transport(url, headers, **kwa):
+    """ `httpcache` transport over the common requests session """
+    headers = dict(headers, **kwa.pop('headers', {}))
+    resp = get_get(url, headers=headers, **kwa)
+    resp_headers = {k.lower(): v for k, v in resp.headers.items()}
+    return resp.status_code, resp_headers, resp.content, resp.url
+
+
+def _decode_body(body, headers):
+    charset = 'utf-8'
+    for part in headers.get('content-type', '').split(';')[1:]:
+        name, _, value = part.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"')
+    try:
+        return body.decode(charset, 'replace')
+    except LookupError:
+        return body.decode('utf-8', 'replace')
+
+
+def get(url, req_params=None, response=False, undecoded=False, hold=False,
         _max_len=30 * MiB):
-    # TODO!: cache_dir (for per-url cache files with expiration)
-    # (e.g. urlhash-named files with a hash->url logfile)
+    """ Pages (i.e. not `undecoded`) are fetched through the `httpcache`
+    disk cache when it is configured.
 
+    With `hold` (and `undecoded`) the data stays accounted on the memory
+    budget: the `memory.Held` is returned last, to be released by whoever
+    is done with the data. """
+    held = None
     if undecoded:
-        bs = False
-    resp = None
-    if _CACHE_GET and cache_file is not None and os.path.isfile(cache_file):
-        with open(cache_file) as f:
-            data_bytes = f.read()
-            data = data_bytes if undecoded else data_bytes.decode('utf-8')
-    else:
         resp = get_get(url, stream=True, **(req_params or {}))
         #if resp.status_code != 200: ...
-        if undecoded:
+        try:
+            expected = min(int(resp.headers.get('content-length')), _max_len)
+        except (TypeError, ValueError):
+            expected = _max_len
+        # (the downloads wait for each other under --memory-budget)
+        with memory.reserve(expected):
             data = bytearray()
             for chunk in resp.iter_content(chunk_size=16384):
                 data += chunk
@@ -247,63 +162,45 @@ def get(url, cache_file=None, req_params=None, bs=True, response=False, undecode
                     print("Too large")
                     break
             data = bytes(data)  ## Have to, alas.
-            data_bytes = data
-        else:
-            data = resp.text
-            data_bytes = data.encode('utf-8')
-        if cache_file is not None:
-            with open(cache_file, 'w') as f:
-                f.write(data_bytes)
-    if not bs:  ## ... should've done a dict.
-        if response:
-            return data, resp
-        return data
-    # ...
-    # NOTE: It appears that in at least one case BS might lose some
-    #   links on unicode data (but no the same utf-8 data) with all
-    #   parser but html5lib.
-    bs = bs4.BeautifulSoup(data, _BS_PARSER)
-    bs._source_url = url
+            if hold:
+                held = memory.hold(len(data))
+    else:
+        resp = httpcache.fetch(url, transport=_requests_transport, **(req_params or {}))
+        data = _decode_body(resp.body, resp.headers)
+    if held is not None:
+        return (data, resp, held) if response else (data, held)
     if response:
-        return data, bs, resp
-    return data, bs
+        return data, resp
+    return data
 
 
 def _filter(l):
     return [v for v in l if v]  # filter(None, l)
 
 
-def _url_abs(l, base_url):
-    return (urllib.parse.urljoin(base_url, v) for v in l)
-
+def _preprocess(l):
+    return sorted(set(_filter(l)))
 
-def _preprocess_bs_links(bs, links):
-    try:
-        base_url = bs._source_url
-    except AttributeError:
-        return links
-    return _url_abs(links, base_url)
 
+def get_page(url, want=htmlparse.ALL_TAGS, **kwa):
+    """ `get` + `htmlparse.extract` (with absolute urls)
 
-def _preprocess(l, bs=None):
-    res = sorted(set(_filter(l)))
-    res = _preprocess_bs_links(bs, res) if bs is not None else res
-    return res
+    returns (html, page)
+    """
+    html = get(url, **kwa)
+    imgs, links, sources = cpupool.run(cpupool.task_extract_page, html, want, url,
+                                       htmlparse.get_backend())
+    return html, htmlparse.Page(imgs, links, sources)
 
 
-def bs2img(some_bs):
-    """ BS to <img src=... /> addresses """
-    # Sometimes more processing than needed, but whatever.
-    return list(_preprocess(
-        (v.get('src') for v in some_bs.findAll('img')),
-        bs=some_bs))
+def page2img(page):
+    """ htmlparse.Page to <img src=... /> addresses """
+    return list(_preprocess(page.imgs))
 
 
-def bs2lnk(some_bs):
-    """ BS to <a href=... /> addresses """
-    return list(_preprocess(
-        (v.get('href') for v in some_bs.findAll('a')),
-        bs=some_bs))
+def page2lnk(page):
+    """ htmlparse.Page to <a href=... /> addresses """
+    return list(_preprocess(page.links))
 
 
 example_flickr_url_album = "https://www.flickr.com/photos/deeplovephotography/with/15485825656/"
@@ -317,54 +214,108 @@ url4 = example_flickr_url_page
 flickr_page_re = re.compile(r'flickr\.com/photos.*[0-9]{9}')
 flickr_sizes = 'o k h l c'.split()  # 'z m n s t q sq'
 flickr_url_re = r'("(?:http|\\/\\/)[^"]+")'
+# Album crawling limits, see `crawl_flickr`
+_FLICKR_WORKERS = 8
+_FLICKR_PER_HOST = 4
+_FLICKR_MAX_PAGES = 100
+_FLICKR_MAX_DEPTH = 1
 
 
-def flickr_album_to_pages(bs):
-    links = bs2lnk(bs)
+def flickr_album_to_pages(page):
+    links = page2lnk(page)
     page_links = [lnk for lnk in links if flickr_page_re.search(lnk)]
     page_links = sorted(page_links)
     return page_links
 
 
-def do_flickr_things(url, bs=None, html=None, maybe_album=True, **kwa):
-    """ ...
+def _url_key(url):
+    """ Normalised url for the crawler's visited set """
+    parts = urllib.parse.urlsplit(url)
+    return (parts.netloc.lower(), parts.path.rstrip('/'), parts.query)
+
+
+class _HostLimiter(object):
+    """ Per-host concurrency limit: a lazily-created semaphore per netloc """
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._sems = {}
+
+    def __call__(self, url):
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.per_host)
+        return sem
+
+
+def crawl_flickr(url, page=None, html=None, max_depth=_FLICKR_MAX_DEPTH,
+                 max_pages=_FLICKR_MAX_PAGES, workers=_FLICKR_WORKERS,
+                 per_host=_FLICKR_PER_HOST):
+    """ Breadth-first concurrent crawl of a flickr album (or page).
+
+    Each page is fetched at most once; pages linked from a page at depth
+    less than `max_depth` are followed; at most `max_pages` pages are
+    fetched in total.
 
     returns (is_complete_success, [candidate_link, ...])
     """
-    log = _log.getChild('do_flickr_things').info
-    if maybe_album:
-        log("Processing flickr maybe_album %r", url)
-    else:
-        log("Processing flickr page %r", url)
-
-    if bs is None:
-        html, bs = get(url, bs=True)
+    log = _log.getChild('crawl_flickr')
+    host_limit = _HostLimiter(per_host)
+    visited = {_url_key(url)}
+    results = []
+
+    def _process(page_url, depth, page=None, page_html=None):
+        if page is None:
+            with host_limit(page_url):
+                page_html, page = get_page(page_url, want=('a',))
+        children = flickr_album_to_pages(page) if depth < max_depth else []
+        return flickr_page_links(page, page_html), children
+
+    level = [(url, page, html)]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        while level:
+            futures = [pool.submit(_process, page_url, depth, page_, page_html)
+                       for page_url, page_, page_html in level]
+            next_level = []
+            for (page_url, _, _), future in zip(level, futures):
+                try:
+                    page_res, children = future.result()
+                except GetError as exc:
+                    log.info("Failed flickr page %r: %r", page_url, exc)
+                    results.append((False, []))
+                    continue
+                results.append(page_res)
+                for child in children:
+                    key = _url_key(child)
+                    if key in visited or len(visited) >= max_pages:
+                        continue
+                    visited.add(key)
+                    next_level.append((child, None, None))
+            level = next_level
+            depth += 1
+    log.info("Crawled %r flickr pages from %r", len(results), url)
+
+    result_links = sorted(set(
+        res_link
+        for _, page_res_links in results
+        for res_link in page_res_links))
+    return all(page_res for page_res, _ in results), result_links
+
+
+def flickr_page_links(page, html):
+    """ Image links of a single flickr page, preferring the biggest size.
 
-    if maybe_album:
-        page_urls = flickr_album_to_pages(bs)
-        # Add the self-link in case it is not an album
-        page_urls = list(page_urls) + [url]
-        # TODO?: exception handling? Probably don't want (yet) though.
-        results = [do_flickr_things(page_url, maybe_album=False, **kwa)
-                   for page_url in page_urls]
-
-        result_links = [
-            res_link
-            for _, page_res_links in results
-            for res_link in page_res_links]
-        result_links = sorted(set(result_links))
-        result = (
-            all(page_res for page_res, _ in results),
-            result_links)
-        return result
-
-    # Otherwise just recursed or just don't want an album
-
-    links_by_bs = bs2lnk(bs)
+    returns (is_complete_success, [candidate_link, ...])
+    """
+    links_by_page = page2lnk(page)
     links_by_re = re.findall(flickr_url_re, html)
     # The regex can handle JSON (i.e. extra backslashes), so try to process that too.
     links_by_re = [try_loads(lnk) for lnk in links_by_re]
-    page_links = sorted(set(links_by_bs) | set(links_by_re))
+    page_links = sorted(set(links_by_page) | set(links_by_re))
 
     # Links by extension
     img_ext_links = [lnk for lnk in page_links if re.search(img_ext_re, lnk)]
@@ -385,25 +336,129 @@ def do_flickr_things(url, bs=None, html=None, maybe_album=True, **kwa):
         return False, img_ext_links
 
 
-def do_horrible_thing(url, base_url=None):
-    data, resp = get(url, undecoded=True, response=True)
-    mime = magic.from_buffer(data)
+def do_flickr_things(url, page=None, html=None, maybe_album=True, **kwa):
+    """ ...
+
+    `kwa` are passed to `crawl_flickr` (max_depth, max_pages, workers,
+    per_host).
+
+    returns (is_complete_success, [candidate_link, ...])
+    """
+    log = _log.getChild('do_flickr_things').info
+    if maybe_album:
+        log("Processing flickr maybe_album %r", url)
+        # The page itself is included in case it is not an album
+        return crawl_flickr(url, page=page, html=html, **kwa)
+
+    log("Processing flickr page %r", url)
+    if page is None:
+        html, page = get_page(url, want=('a',))
+    return flickr_page_links(page, html)
+
+
+def probe_image(url, probe_bytes=_PROBE_BYTES):
+    """ Find out the content type and dimensions of `url` from a ranged GET
+    of its first `probe_bytes` (servers ignoring Range get cut off there).
+
+    returns (mime, (width, height) or None)
+    """
+    resp = get_get(url, stream=True, headers={'Range': 'bytes=0-%d' % (probe_bytes - 1)})
     try:
-        # XXX/TODO: Use Image.frombytes or something
-        img = Image.open(StringIO(data))
-    except IOError:
+        mime = resp.headers.get('content-type', '').split(';')[0].strip().lower()
+        if resp.status_code >= 400 or mime.startswith('text/'):
+            return mime, None
+        head = b''
+        for chunk in resp.iter_content(chunk_size=4096):
+            head += chunk
+            size = sniff_size(head)
+            if size is not None:
+                return mime, size
+            if len(head) >= probe_bytes:
+                break
+        return mime, None
+    finally:
+        resp.close()
+
+
+def _image_size_pil(data):
+    """ Fallback for the formats `sniff_size` doesn't know (decoded in
+    the cpupool) """
+    return cpupool.run(cpupool.task_image_size, data)
+
+
+def check_image(url, min_size=_MIN_IMAGE_SIZE):
+    """ Probe `url` for being a notably large image.
+
+    returns (mime, size or None) if it may be one, None if it isn't """
+    mime, size = probe_image(url)
+    if size is None and not mime.startswith('image/'):
         _log.log(3, "dht: Not an image file (%r): %r", mime, url)
         return
-    width, height = img.size
-    if width < 800 or height < 600:
-        _log.log(3, "dht: Image too small (%r, %r): %r", width, height, url)
+    if size is not None and (size[0] < min_size[0] or size[1] < min_size[1]):
+        _log.log(3, "dht: Image too small (%r, %r): %r", size[0], size[1], url)
         return
+    return mime, size
+
+
+def fetch_image(url, mime, size, min_size=_MIN_IMAGE_SIZE):
+    """ Download an image that passed `check_image` in full.
+
+    returns (data, resp, held), None if it isn't a large image after all """
+    data, resp, held = get(url, undecoded=True, response=True, hold=True)
+    if size is None:
+        size = _image_size_pil(data)
+        if size is None:
+            _log.log(3, "dht: Not an image file (%r): %r", mime, url)
+            held.release()
+            return
+        if size[0] < min_size[0] or size[1] < min_size[1]:
+            _log.log(3, "dht: Image too small (%r, %r): %r", size[0], size[1], url)
+            held.release()
+            return
+    width, height = size
     _log.log(5, "dht: Image (%dx%d %db): %r", width, height, len(data), url)
-    return data, resp
+    return data, resp, held
+
+
+def do_horrible_thing(url, base_url=None, min_size=_MIN_IMAGE_SIZE):
+    probed = check_image(url, min_size=min_size)
+    if probed is None:
+        return
+    return fetch_image(url, *probed, min_size=min_size)
+
+
+def _fetch_images(probed, fetch_image_func, workers=_FETCH_WORKERS):
+    """ Download the `probed` ([(url, (mime, size)), ...]) images, at most
+    `workers` ahead of the consumer, yielding them in order """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        pending = collections.deque()
+        probed = iter(probed)
+        while True:
+            for turl, (mime, size) in itertools.islice(probed, workers - len(pending)):
+                pending.append((turl, pool.submit(fetch_image_func, turl, mime, size)))
+            if not pending:
+                break
+            turl, future = pending.popleft()
+            try:
+                stuff = future.result()
+            except GetError:
+                continue  ## ... will be logged anyway.
+            if stuff:
+                data, resp, held = stuff
+                yield turl, data, dict(resp=resp, held=held)
 
 
-def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_to_skip=None):
-    html, bs = get(url, cache_file='tmpf5_do_horrible_things.html', bs=True)
+def do_horrible_things(url=url2, check_image_func=check_image,
+                       fetch_image_func=fetch_image, urls_to_skip=None):
+    """ Large images linked from the page at `url`
+
+    The links are probed concurrently (ranged requests only); the images
+    that pass are downloaded as the result is iterated, a couple at a time.
+
+    returns ([checked_url, ...], iter([(image_url, image_data, extras), ...]));
+    `extras['held']` keeps the data on the memory budget: release it once
+    done with the data (before taking the next image). """
+    html, page = get_page(url, want=('img', 'a'))
 
     def _pp(lst):
         """ 'postprocess' a list of links """
@@ -415,12 +470,12 @@ def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_
         # (urljoin should be done already though)
         return [urllib.parse.urljoin(url, val) for val in res]
 
-    imgs, links = bs2img(bs), bs2lnk(bs)
+    imgs, links = page2img(page), page2lnk(page)
     to_check = imgs + links
     # ...
     if 'flickr.' in url:
         _log.debug("dhts: also trying flickr at %r", url)
-        flickr_res, flickr_stuff = do_flickr_things(url, bs=bs, html=html)
+        flickr_res, flickr_stuff = do_flickr_things(url, page=page, html=html)
         if flickr_stuff and isinstance(flickr_stuff, list):
             if flickr_res:
                 to_check = flickr_stuff  ## Good enough, get just that
@@ -434,23 +489,27 @@ def do_horrible_things(url=url2, do_horrible_thing_func=do_horrible_thing, urls_
     # Synopsis: check each url on the page for being a notably large image and download all such
     # TODO?: grab all-all URLs (including plaintext)?
     _log.debug("dhts: %r (of %r) urls to check", len(to_check), to_check_baselen)
-    res = []
-    for turl in to_check:
+
+    def _check(turl):
         try:
-            stuff = do_horrible_thing_func(turl, base_url=url)
+            return check_image_func(turl)
         except GetError:
-            continue  ## ... will be logged anyway.
-        if stuff:
-            data, resp = stuff[:2]
-            res.append((turl, data, dict(resp=resp)))
-    _log.debug("dhts: %r images found", len(res))
-    return to_check, res
+            return None  ## ... will be logged anyway.
+
+    with ThreadPoolExecutor(max_workers=max(1, _PROBE_WORKERS)) as pool:
+        # `map` keeps the (sorted) url order of the results.
+        probed = [(turl, stuff) for turl, stuff in zip(to_check, pool.map(_check, to_check))
+                  if stuff]
+    _log.debug("dhts: %r images to fetch", len(probed))
+    return to_check, _fetch_images(probed, fetch_image_func)
 
 
 if __name__ == '__main__':
+    import pyaux.runlib
     pyaux.runlib.init_logging(level=1)
     logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(21)
     pyaux.use_exc_ipdb()
     cres = do_horrible_things(sys.argv[1])
+    cres = cres[0], list(cres[1])
     import IPython
     IPython.embed(banner1="`cres`.")
@@ -21,6 +21,11 @@ import math
 import time
 from collections import Counter
 from ...Exceptions import FileExistsException
+from ...imagesize import read_head
+from ...httpcache import urlopen
+from ... import cpupool
+from ... import segmented
+from ... import storage
 
 __doc__ = """
 Quickly and easily download images from Imgur.
@@ -45,7 +50,7 @@ class ImgurException(Exception):
 
 class ImgurDownloader:
     def __init__(self, imgur_url, dir_download=os.getcwd(), file_name='',
-                delete_dne=True, debug=False):
+                delete_dne=True, debug=False, size_filter=None, sink=None):
         """Gather imgur hashes & extensions from the url passed
 
         :param imgur_url: url of imgur gallery, album, single img, or direct
@@ -58,6 +63,10 @@ class ImgurDownloader:
         :param delete_dne: prevent downloading of Imgur Does Not Exist image
             if encountered
         :param debug: prints several variables throughout the class
+        :param size_filter: imagesize.SizeFilter; images it rejects are
+            skipped after reading just their header
+        :param sink: storage sink the images are written to (default: the
+            process-wide one)
 
         :rtype: None
         """
@@ -68,6 +77,10 @@ class ImgurDownloader:
 
         self.delete_dne = delete_dne
         self.debug = debug
+        self.size_filter = size_filter
+        self.sink = sink or storage.get_sink()
+        # (url, path, size, sha1) of the images saved
+        self.saved = []
 
         # Callback members:
         self.image_callbacks = []
@@ -99,7 +112,7 @@ class ImgurDownloader:
             return
 
         try:
-            self.response = urllib.request.urlopen(url=imgur_url)
+            self.response = urlopen(imgur_url)
             response_code = self.response.getcode()
         except Exception as e:
             self.response = False
@@ -188,10 +201,6 @@ class ImgurDownloader:
         If no foldername is given, it'll use the cwd and the album key.
         And if the folder doesn't exist, it'll try and create it.
         """
-        # open imgur dne image to compare to downloaded image later
-        dne_path = os.path.join(self.dir_root, 'imgur-dne.png')
-        self.dne_file = open(dne_path, 'rb')
-
         # Try and create the album folder:
         albumFolder = ''
         if len(self.imageIDs) > 1:
@@ -204,8 +213,7 @@ class ImgurDownloader:
 
         downloaded = skipped = 0
 
-        if not os.path.exists(dir_save):
-            os.makedirs(dir_save)
+        self.sink.makedirs(dir_save)
 
         # return original content url & ext of .gifv link
         # gifv_regex = re.compile('<meta property="og:url" *content="([\w.:/?&]*?)"')
@@ -214,7 +222,7 @@ class ImgurDownloader:
             """Return original url & extension"""
             if url.endswith('.gifv'):
                 url = 'http://imgur.com/'+key
-            req = urllib.request.urlopen(url)
+            req = urlopen(url)
             html = req.read().decode('utf-8')
             search = re.search(ext_regex, html)
             # either url wasn't a .gifv or regex search failed
@@ -251,13 +259,12 @@ class ImgurDownloader:
 
             dl, skp = self.direct_download(image_url, path)
             downloaded += dl
-            skipped += skipped
+            skipped += skp
 
         # Run the complete callbacks:
         for fn in self.complete_callbacks:
             fn()
 
-        self.dne_file.close()
         return downloaded, skipped
 
 
@@ -265,43 +272,82 @@ class ImgurDownloader:
         """download data from url and save to path
             & optionally check if img downloaded is imgur dne file
         """
-        def are_files_equal(file1, file2):
-            """ given two file objects, checks to see if their bytes are equal """
-            return True if bytearray(file1.read()) == bytearray(file2.read()) else False
-
         dl, skp = 0, 0
-        if os.path.isfile(path):
+        if self.sink.exists(path):
             skp = 1
             raise FileExistsException('%s already exists.' % os.path.basename(path))
         else:
             try:
-                # check if image is imgur dne image before we download anything
-                if self.delete_dne:
-                    req = urllib.request.urlopen(image_url)
-                    if are_files_equal(req, self.dne_file):
+                req = urllib.request.urlopen(image_url)
+
+                # read just enough to know the dimensions before committing
+                # to the whole image
+                head = b''
+                if self.size_filter is not None:
+                    head, size = read_head(req)
+                    reason = self.size_filter.check(size)
+                    if reason:
+                        req.close()
                         if self.debug:
-                            print ('[ImgurDownloader] DNE: %s' % path.split('/')[-1])
+                            print ('[ImgurDownloader] SIZE: %s is %s' % (path.split('/')[-1], reason))
                         return 0, 1
 
-                # proceed with downloading if image is not dne or we're not checking for dne images
-                urllib.request.urlretrieve(image_url, path)
+                # large mp4s go over several connections
+                size = segmented.should_segment(req.info())
+                if size:
+                    req.close()
+                    temp_path = self.sink.temp_path(path)
+                    try:
+                        segmented.download(req.geturl(), temp_path, size, head=head,
+                                           validator=segmented.validator(req.info()))
+                    except segmented.SegmentError as exc:
+                        # stream it over one connection instead, from the start
+                        if self.debug:
+                            print ('[ImgurDownloader] SEGMENTS: %s, streaming' % exc)
+                        req, head = urllib.request.urlopen(req.geturl()), b''
+                    else:
+                        size, sha1 = self.sink.put_file(path, temp_path)
+                        self.saved.append((image_url, path, size, sha1))
+                        dl = 1
+                        return dl, skp
+
+                # stream into the sink, comparing to the imgur dne image
+                # (small) on the way
+                dne = self.imgur_dne_data() if self.delete_dne else None
+                with self.sink.open_write(path) as f:
+                    f.write(head)
+                    start = head
+                    for chunk in iter(lambda: req.read(64 * 1024), b''):
+                        if dne is not None and len(start) <= len(dne):
+                            start += chunk
+                        f.write(chunk)
+                    if dne is not None and start == dne:
+                        f.discard()
+                        if self.debug:
+                            print ('[ImgurDownloader] DNE: %s' % path.split('/')[-1])
+                        return 0, 1
+                self.saved.append((image_url, path, f.size, f.sha1.hexdigest()))
                 dl = 1
             except Exception as e:
                 # print('[ImgurDownloader] %s' % e)
-                os.remove(path)
                 skp = 1
                 raise ImgurException(e)
         return dl, skp
 
+    _dne_data = None
+
+    def imgur_dne_data(self):
+        """bytes of the imgur does not exist image"""
+        if ImgurDownloader._dne_data is None:
+            with open(os.path.join(self.dir_root, 'imgur-dne.png'), 'rb') as f:
+                ImgurDownloader._dne_data = f.read()
+        return ImgurDownloader._dne_data
+
 
     def is_imgur_dne_image(self, img_path):
         """takes full image path & checks if bytes are equal to that of imgur does not exist image"""
         dne_img = os.path.join(self.dir_root, 'imgur-dne.png') # edit location if needed
-        with open(dne_img, 'rb') as f:
-            dne_data = bytearray(f.read())
-        with open(img_path, 'rb') as f:
-            data = bytearray(f.read())
-        return True if data == dne_data else False
+        return cpupool.run(cpupool.task_files_equal, dne_img, img_path)
 
 
 
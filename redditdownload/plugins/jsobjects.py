@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf8
+""" Linear-time extraction of JSON / javascript objects embedded in HTML.
+
+A single regex-driven pass finds every brace-balanced `{...}` span while
+skipping braces inside string literals; spans are then decoded outermost
+first with the (C-accelerated) json decoder, falling back to lenient YAML
+for javascript-ish literals such as `{a: 1}`.
+"""
+
+import re
+import json
+import logging
+
+
+_log = logging.getLogger(__name__)
+
+# Spans larger than this are not retried with the (slow) lenient parser.
+LENIENT_MAX_LEN = 64 * 1024
+
+_significant_re = re.compile(r'[{}"\'\\\n]')
+_json_decoder = json.JSONDecoder()
+
+
+def iter_object_spans(text):
+    """ Yield (start, end) of every brace-balanced span in `text` such that
+    `text[start:end]` begins with '{' and ends with the matching '}'.
+
+    Braces inside '...' and "..." strings are ignored; a string is also
+    terminated by a newline (neither JSON nor JS allow raw newlines in
+    strings) so that stray apostrophes in prose don't swallow the page.
+
+    Spans are yielded in the order they close, i.e. inner objects first.
+
+    >>> st = 'var x = {"a": "}", "b": {"c": 1}};'
+    >>> [st[a:b] for a, b in iter_object_spans(st)]
+    ['{"c": 1}', '{"a": "}", "b": {"c": 1}}']
+    """
+    stack = []
+    quote = None
+    skip_to = -1
+    for match in _significant_re.finditer(text):
+        pos = match.start()
+        if pos < skip_to:
+            continue
+        char = match.group()
+        if quote is not None:
+            if char == '\\':
+                skip_to = pos + 2
+            elif char == quote or char == '\n':
+                quote = None
+            continue
+        if char == '{':
+            stack.append(pos)
+        elif char == '}':
+            if stack:
+                yield stack.pop(), pos + 1
+        elif char in '"\'' and stack:
+            # Only track strings inside objects: quotes in markup / prose
+            # around the objects are irrelevant.
+            quote = char
+
+
+def parse_object(chunk, lenient=True):
+    """ Decode a single `{...}` chunk; returns a dict or None. """
+    try:
+        res = _json_decoder.decode(chunk)
+    except ValueError:
+        res = None
+        if lenient and len(chunk) <= LENIENT_MAX_LEN:
+            res = try_yaml_load(chunk)
+    return res if isinstance(res, dict) else None
+
+
+def try_yaml_load(some_str, **kwa):
+    try:
+        import yaml
+    except ImportError:
+        return None
+    try:
+        return yaml.safe_load(some_str, **kwa)
+    except Exception:
+        return None
+
+
+def get_all_objects(text, lenient=True):
+    """ Zealous obtainer of mappings from a text, e.g. in javascript
+    or JSON or whatever. Anything between '{' and the matching '}'.
+
+    Objects are yielded in document order; once an object is decoded,
+    the objects nested inside it are not yielded separately.
+
+    `lenient` enables the pyyaml fallback for non-JSON literals.
+
+    >>> st = 'a str with var stuff = {a: [{"v": 12}]} and such'
+    >>> next(get_all_objects(st))
+    {'a': [{'v': 12}]}
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    spans = sorted(iter_object_spans(text))
+    covered_to = -1
+    for start, end in spans:
+        if start < covered_to:
+            continue  # nested in an already-decoded object
+        res = parse_object(text[start:end], lenient=lenient)
+        if res is not None:
+            covered_to = end
+            yield res
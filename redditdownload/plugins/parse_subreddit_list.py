@@ -34,6 +34,7 @@ parse_subreddit_list('/MyPath/subreddits.txt', '/MyPath/') = [
 
 import re
 import os
+import zlib
 from os import getcwd, mkdir
 
 def parse_subreddit_list(file_path, base_path=getcwd()):
@@ -90,3 +91,68 @@ def parse_subreddit_list(file_path, base_path=getcwd()):
         output.append((subreddit, final_path))
 
     return output
+
+
+# Listing urls are kept well below the ~2k chars proxies and reddit accept.
+MAX_COMBINED_LENGTH = 1800
+MAX_COMBINED_COUNT = 100
+
+
+def _bucket_count(names, max_length, max_count):
+    """Power of two number of buckets for `names` to fit the limits; it only
+    changes when the list about doubles or halves"""
+    needed = max(-(-len(names) // max_count),
+                 -(-sum(len(name) + 1 for name in names) // max_length), 1)
+    count = 1
+    while count < needed:
+        count *= 2
+    return count
+
+
+def group_subreddits(entries, max_length=MAX_COMBINED_LENGTH,
+                     max_count=MAX_COMBINED_COUNT, key=None):
+    """Group subreddit list entries into combined ``a+b+c`` listings
+
+    A subreddit occurs at most once per group (each returned item must route
+    to exactly one folder) and only entries with the same `key(entry)` are
+    grouped together.
+
+    The groups (and so their names, which key their history) don't depend
+    on the order of the list: subreddits go to a bucket by a hash of their
+    name, so adding or removing one only renames the group it is in.
+
+    :param entries: list of (subreddit, folder) tuples, as returned by
+        parse_subreddit_list
+    :param max_length: max length of the joined subreddit names
+    :param max_count: max number of subreddits per group
+    :param key: function of an entry, entries with different keys (i.e.
+        incompatible options) are never combined
+
+    :return: list of (combined_name, {subreddit.lower(): entry})
+    :rtype: list
+    """
+    by_key = {}  # key -> entries, in order of appearance of the keys
+    for entry in entries:
+        by_key.setdefault(key(entry) if key is not None else None, []).append(entry)
+    output = []
+    for group_entries in by_key.values():
+        count = _bucket_count([entry[0] for entry in group_entries], max_length, max_count)
+        buckets = [[] for _ in range(count)]
+        for entry in group_entries:
+            buckets[zlib.crc32(entry[0].lower().encode('utf-8')) % count].append(entry)
+        for bucket in buckets:
+            groups = []
+            for entry in sorted(bucket, key=lambda entry: (entry[0].lower(), entry[0])):
+                name = entry[0]
+                for names, routes in groups:
+                    length = sum(len(n) + 1 for n in names) + len(name)
+                    if (name.lower() not in routes and len(names) < max_count and
+                            length <= max_length):
+                        break
+                else:
+                    names, routes = [], {}
+                    groups.append((names, routes))
+                names.append(name)
+                routes[name.lower()] = entry
+            output.extend(groups)
+    return [('+'.join(names), routes) for names, routes in output]
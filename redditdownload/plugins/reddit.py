@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 """Return list of items from a sub-reddit of reddit.com."""
 
-import sys
-from urllib.request import urlopen, Request
+from urllib.request import Request
 from urllib.error import HTTPError
 from json import JSONDecoder
 
+from ..httpcache import urlopen
+from ..Exceptions import RedditAPIException
+
 
 def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
     """Return list of items from a subreddit.
@@ -15,6 +17,8 @@ def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
     :param previd: previous post id, to get more post
     :param reddit_sort: type of sorting post
     :returns: list -- list of post url
+    :raises RedditAPIException: when the listing can't be fetched or decoded
+    :raises ValueError: when `multireddit` doesn't match the name given
 
     :Example:
 
@@ -33,16 +37,14 @@ def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
         if '/m/' not in subreddit:
             warning = ('That doesn\'t look like a multireddit. Are you sure'
                        'you need that multireddit flag?')
-            print(warning)
-            sys.exit(1)
+            raise ValueError(warning)
         url = 'http://www.reddit.com/user/%s.json' % subreddit
     if not multireddit:
         if '/m/' in subreddit:
             warning = ('It looks like you are trying to fetch a multireddit. \n'
                        'Check the multireddit flag. '
                        'Call --help for more info')
-            print (warning)
-            sys.exit(1)
+            raise ValueError(warning)
         # no sorting needed
         if reddit_sort is None:
             url = 'http://www.reddit.com/r/{}.json'.format(subreddit)
@@ -99,14 +101,10 @@ def getitems(subreddit, multireddit=False, previd='', reddit_sort=None):
         items = [x['data'] for x in data['data']['children']]
     except HTTPError as ERROR:
         error_message = '\tHTTP ERROR: Code %s for %s' % (ERROR.code, url)
-        sys.exit(error_message)
-    except ValueError as ERROR:
-        if ERROR.args[0] == 'No JSON object could be decoded':
-            error_message = 'ERROR: subreddit "%s" does not exist' % (subreddit)
-            sys.exit(error_message)
-        raise ERROR
-    except KeyboardInterrupt as ERROR:
-        error_message = '\tKeyboardInterrupt: url:{}.'.format(url)
-        sys.exit(error_message)
+        raise RedditAPIException(error_message) from ERROR
+    except (ValueError, KeyError, TypeError) as ERROR:
+        # not a listing, e.g. the search page of a subreddit that does not exist
+        error_message = 'ERROR: subreddit "%s" does not exist' % (subreddit)
+        raise RedditAPIException(error_message) from ERROR
 
     return items
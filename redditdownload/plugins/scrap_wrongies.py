@@ -15,6 +15,10 @@ _OUTDATA_LOGFILE = '.wtp_out.jsl'
 _DIRDATA_LOGFILE = '.wrp_meta.jsl'
 # Subdirectory to make in the target directory
 _DIRSUBDIR = 'wextras'
+# Compact index of already-processed base URLs (one url hash per line).
+_INDEX_FILE = '.wtp_done.idx'
+# Amount of wrongies processed in parallel.
+_WORKERS = 4
 
 
 import os
@@ -26,9 +30,10 @@ import functools
 import logging
 import mimetypes
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from atomicfile import AtomicFile
-import magic
 
 from . import img_scrap_stuff
 from .img_scrap_stuff import GetError
@@ -43,14 +48,35 @@ def _hash(val):
     return hashlib.md5(val).hexdigest()
 
 
+_signature_mimes = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+
+
+def guess_mime(imgdata, resp=None):
+    """ mime type from the response headers, the file signature or,
+    as a last resort, libmagic """
+    if resp is not None:
+        mime = resp.headers.get('content-type', '').split(';')[0].strip().lower()
+        if mime and mime != 'application/octet-stream':
+            return mime
+    for signature, mime in _signature_mimes:
+        if imgdata.startswith(signature):
+            return mime
+    if imgdata[:4] == b'RIFF' and imgdata[8:12] == b'WEBP':
+        return 'image/webp'
+    import magic  # python-magic
+    return magic.from_buffer(imgdata, mime=True)
+
+
 def make_filename(url, imgdata, resp=None):
-    mime_type = magic.from_buffer(imgdata, mime=True)
+    mime_type = guess_mime(imgdata, resp=resp)
     # ... last extension in the list tends to be better (and longer)
-    mime_ext = mimetypes.guess_all_extensions(mime_type)[-1]
-    # # TODO: filename from `resp`
-    # if resp is not None: ...
-    datahash = _hash(imgdata)
-    urlhash = _hash(url)
+    mime_ext = (mimetypes.guess_all_extensions(mime_type) or [''])[-1]
     urlv = url.rstrip('/').rsplit('/', 1)[1]
     return '%s%s' % (urlv, mime_ext)  # NOTE: cannot check for existing here.
 
@@ -60,13 +86,26 @@ def unjsl_g(fn):
     objects """
     log = _log.getChild('unjsl(%r)' % (fn,))
     with open(fn) as f:
-        for l in f.readlines():
+        for l in f:
             try:
                 yield json.loads(l)
             except ValueError:
                 log.error("JSON fail: %r", l)
 
 
+def wrongies_g(records):
+    """ The wrong type pages of a journal (``--journal``); records of the
+    older wrong-data log (no 'event') are passed as they are """
+    for record in records:
+        if 'event' in record:
+            if record.get('error') != 'WrongFileTypeException' or not record.get('path'):
+                continue
+            path = record['path']
+            record = dict(record, target_dir=os.path.dirname(path),
+                          _filename=os.path.splitext(os.path.basename(path))[0])
+        yield record
+
+
 def unjsl(fn):
     """ unjsl: non-generator version  """
     return list(unjsl_g(fn))
@@ -99,22 +138,87 @@ def mkdirs(d):
         return
 
 
-def consecutive_filename(filename):
-    """ Find first non-existing filename.  (NOTE: Not atomic.)  """
-    if not os.path.exists(filename):
-        return filename
-    fileparts = filename.rsplit('.', 1)
-    if len(fileparts) == 1:
-        filebase, fileext = fileparts[0], None
-    else:
-        filebase, fileext = fileparts
-    for i in range(1, 9000):
-        filetry = '%s__%02d' % (filebase, i)
-        if fileext is not None:
-            filetry = '%s.%s' % (filetry, fileext)
-            if not os.path.exists(filetry):
-                return filetry
-    raise Exception("Either I'm insane or there's already over 9000 such files.")
+class FilenameAllocator(object):
+    """ First non-taken filename (`name__01.ext`, `name__02.ext`, ...)
+    without stat loops: each directory is listed once, then names are
+    handed out from memory (thread-safe; assumes nothing else writes into
+    the directories). """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._taken = {}  # dirname -> set of names
+        self._counters = {}  # (dirname, filebase) -> last used number
+
+    def __call__(self, filename):
+        dirname, name = os.path.split(filename)
+        with self._lock:
+            taken = self._taken.get(dirname)
+            if taken is None:
+                try:
+                    taken = set(os.listdir(dirname or '.'))
+                except OSError:
+                    taken = set()
+                self._taken[dirname] = taken
+            if name not in taken:
+                taken.add(name)
+                return filename
+            fileparts = name.rsplit('.', 1)
+            filebase = fileparts[0]
+            fileext = '.' + fileparts[1] if len(fileparts) > 1 else ''
+            i = self._counters.get((dirname, filebase), 0)
+            while True:
+                i += 1
+                nametry = '%s__%02d%s' % (filebase, i, fileext)
+                if nametry not in taken:
+                    break
+            self._counters[(dirname, filebase)] = i
+            taken.add(nametry)
+            return os.path.join(dirname, nametry)
+
+
+class ProcessedIndex(object):
+    """ On-disk set of processed URLs: one url hash per line, appended as
+    the URLs get done. The URLs being processed are `claim`ed (by hash as
+    well) until they are `release`d. """
+
+    def __init__(self, filename, debug_out=None):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._done = set()
+        self._claimed = set()
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self._done.update(line.strip() for line in f)
+        elif debug_out is not None and os.path.exists(debug_out):
+            # One-time migration from the full debug output.
+            for item in unjsl_g(debug_out):
+                self.add(item['url'])
+
+    def __contains__(self, url):
+        return _hash(url.encode('utf-8')) in self._done
+
+    def add(self, url):
+        key = _hash(url.encode('utf-8'))
+        with self._lock:
+            if key in self._done:
+                return
+            self._done.add(key)
+            with open(self.filename, 'a') as f:
+                f.write(key + '\n')
+
+    def claim(self, url):
+        """ Take `url` for processing; False if it is done or taken """
+        key = _hash(url.encode('utf-8'))
+        with self._lock:
+            if key in self._done or key in self._claimed:
+                return False
+            self._claimed.add(key)
+            return True
+
+    def release(self, url):
+        """ Give back a `claim` (done or not) """
+        with self._lock:
+            self._claimed.discard(_hash(url.encode('utf-8')))
 
 
 def str2hash(s, hlen=8):
@@ -128,16 +232,17 @@ def str2hash(s, hlen=8):
 def do_scrap_wrongies(
         data_in=_WRONGDATA_LOGFILE,
         debug_out=_OUTDATA_LOGFILE, dirmeta=_DIRDATA_LOGFILE,
-        dirsubdir=_DIRSUBDIR):
+        dirsubdir=_DIRSUBDIR, index_file=_INDEX_FILE, workers=_WORKERS):
     # ###  Per wrongdata-logfile (with dl-continuing support)  ###
     log = _log.getChild("do_scrap_wrongies")
-    # Assuming the files are not too giant (reasonably enough):
-    in_data = unjsl(data_in)
-    debug_data_base = unjsl_or_empty(debug_out)
-    debug_data = {d['url']: d for d in debug_data_base}
+    # Streamed; only the compact index of processed URLs is kept in memory.
+    in_data = wrongies_g(unjsl_g(data_in))
+    processed = ProcessedIndex(index_file, debug_out=debug_out)
     to_debug = functools.partial(onjsl, debug_out)  # lambda data: onjsl(debug_out, data)
     all_checked_urls = {}
-    # to_meta = lambda target_dir, data: onjsl(os.path.join(target_dir, dirmeta), data)
+    allocate_filename = FilenameAllocator()
+    # Serializes the shared state and the metadata files.
+    lock = threading.Lock()
     # ...
     existing_cache = {}  # meta_file -> {url -> rmeta}
 
@@ -150,23 +255,20 @@ def do_scrap_wrongies(
             cache[meta_file] = meta_existing
             return meta_existing
 
-    # ...
-    for wrongie in in_data:
+    def process_wrongie(wrongie):
         # ###  Per reddit link (basically) with possibly several images there  ###
         # Example `wrongie`: {"url": "http://500px.com/photo/29700163",
         #   "target_dir": "/home/hell/files/wp//reddit_earthporn",
         #   "_downloaded": 8, "_filecount": 0, "_filename": "1m90ui"}
         url = wrongie['url']
-        if url in debug_data:
-            log.log(15, "Already processed wrongie: %r", url)
-            continue  # Already processed, presumably.
         log.log(13, "Processing wrongie %r  (%r)", url, wrongie)
         # ...
         target_dir = os.path.join(wrongie['target_dir'], dirsubdir)
         mkdirs(target_dir)
         # ...
         meta_file = os.path.join(target_dir, dirmeta)
-        meta_existing = get_meta_existing(meta_file)  # url -> rmeta
+        with lock:
+            meta_existing = get_meta_existing(meta_file)  # url -> rmeta
         dmeta = dict(wrongie)  # debug-out data
         # ...
         # NOTE: long request-y process.
@@ -174,11 +276,13 @@ def do_scrap_wrongies(
             stuff = img_scrap_stuff.do_horrible_things(url, urls_to_skip=all_checked_urls)
         except GetError:
             log.error("Skipping wrongie %r", wrongie)
-            continue
-        # stuff = ([checked_url, ...], [(image_url, image_data, {'resp': ..., ...}), ...])
+            return
+        # stuff = ([checked_url, ...], iter([(image_url, image_data, {'resp': ..., ...}), ...]))
+        # (each image is downloaded as it is taken: write & release it first)
         checked_urls, found_images = stuff
-        all_checked_urls.update({u: 1 for u in checked_urls})
-        dd_processed = debug_data.setdefault('processed', [])
+        with lock:
+            all_checked_urls.update({u: 1 for u in checked_urls})
+        dd_processed = []
         for imgurl, imgdata, extras in found_images:
             # ###  Per image file (known to be large)  ###
             if imgurl in meta_existing:
@@ -195,21 +299,47 @@ def do_scrap_wrongies(
             filename = '%s__%s' % (filename_group, filename_img)
             filename_full = os.path.join(target_dir, filename)
             # For uniqueness (non-overwriting), assuming we don't try to re-download stuff.
-            filename_target = consecutive_filename(filename_full)
-            _exdata = dict(filename_base=filename, filename=filename_target, url=imgurl)
+            filename_target = allocate_filename(filename_full)
+            _exdata = dict(filename_base=filename, filename=filename_target, url=imgurl,
+                           sha1=hashlib.sha1(imgdata).hexdigest())
             rmeta.update(_exdata)
             with AtomicFile(filename_target) as f:
                 f.write(imgdata)
+            # written: off the memory budget (dropped ones are released too)
+            if extras.get('held') is not None:
+                extras['held'].release()
             # ...
-            onjsl(meta_file, rmeta)
-            meta_existing[imgurl] = rmeta  # make sure we don't try it again
+            with lock:
+                onjsl(meta_file, rmeta)
+                meta_existing[imgurl] = rmeta  # make sure we don't try it again
             # Note: might be lost (as rmeta is written already but dmeta isn't yet)
             dd_processed.append(dict(_exdata))
         # Per reddit link again (after downloading all images is done)
         # Write it down so we don't pester it again
         dmeta.update(processed=dd_processed)
-        debug_data[url] = dmeta
-        to_debug(dmeta)
+        with lock:
+            to_debug(dmeta)
+        processed.add(url)
+
+    def _safe_process(wrongie):
+        try:
+            process_wrongie(wrongie)
+        except Exception:
+            log.exception("Failed wrongie %r", wrongie)
+        finally:
+            processed.release(wrongie['url'])
+            slots.release()
+
+    # Bounded amount of in-flight wrongies, so the input stays streamed.
+    slots = threading.BoundedSemaphore(max(1, workers) * 2)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for wrongie in in_data:
+            url = wrongie['url']
+            if not processed.claim(url):
+                log.log(15, "Already processed wrongie: %r", url)
+                continue  # Already processed (or in progress), presumably.
+            slots.acquire()
+            pool.submit(_safe_process, wrongie)
     # Per wrongdata-logfile again. Nothing to do here after all that.
     log.info("Done, apparently")
     return locals()  # In case some post-debug is desired.
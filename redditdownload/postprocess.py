@@ -0,0 +1,231 @@
+"""Post-download transcoding (``--downscale``, ``--recompress``, ``--gif-to-mp4``).
+
+Downloaded files are shrunk after the fact:
+
+* images larger than ``--downscale WxH`` are resized to fit in it,
+* JPEG / WebP files are re-encoded at ``--recompress`` quality (kept only
+  when that makes them smaller),
+* GIFs become MP4 (``--gif-to-mp4``) when ffmpeg is installed.
+
+The work is started with :func:`cpupool.submit` (the process pool, or a
+background thread without ``--cpu-workers``) so the downloads carry on
+meanwhile. The decoded size of an image is reserved from the memory budget
+(``--memory-budget``) by the submitting process until the job is done, as
+the worker processes don't share it. Every change is recorded, with the sizes and the ratio, in
+``._postprocess.jsl`` in the file's folder; that record is also how a GIF
+that became an MP4 is known to be downloaded already.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+import time
+from concurrent.futures import wait
+
+from . import cpupool
+from . import memory
+from .imagesize import read_head
+
+
+_log = logging.getLogger(__name__)
+
+RECORD_FILE = '._postprocess.jsl'
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+FFMPEG_TIMEOUT = 600
+
+
+def _sha1(path, chunk_size=256 * 1024):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _gif_to_mp4(path, ffmpeg):
+    new_path = os.path.splitext(path)[0] + '.mp4'
+    tmp = new_path + '.tmp.mp4'
+    try:
+        subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-i', path,
+             '-movflags', 'faststart', '-pix_fmt', 'yuv420p',
+             # yuv420p needs even dimensions
+             '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', tmp],
+            check=True, stdin=subprocess.DEVNULL, timeout=FFMPEG_TIMEOUT)
+        if os.path.getsize(tmp) >= os.path.getsize(path):
+            return None
+        os.replace(tmp, new_path)
+        os.remove(path)
+        return new_path
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _transcode_image(path, max_size, quality):
+    """Resize / re-encode in place; returns the actions done"""
+    from PIL import Image
+    with Image.open(path) as img:
+        fmt = img.format
+        if getattr(img, 'is_animated', False):
+            return []  # would lose the frames
+        resize = bool(max_size) and (img.width > max_size[0] or img.height > max_size[1])
+        recompress = bool(quality) and fmt in ('JPEG', 'WEBP')
+        if not resize and not recompress:
+            return []
+        actions = []
+        options = {}
+        if fmt in ('JPEG', 'WEBP'):
+            options['quality'] = quality or 90
+            if img.info.get('exif'):
+                options['exif'] = img.info['exif']
+        if img.info.get('icc_profile'):
+            options['icc_profile'] = img.info['icc_profile']  # wide-gamut colours
+        if fmt in ('JPEG', 'PNG'):
+            options['optimize'] = True
+        if resize:
+            img.thumbnail(max_size, Image.LANCZOS)
+            actions.append('resize %dx%d' % img.size)
+        if recompress:
+            actions.append('quality %d' % quality)
+        tmp = path + '.tmp'
+        try:
+            img.save(tmp, format=fmt, **options)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    # a re-encode that doesn't save anything isn't kept
+    if not resize and os.path.getsize(tmp) >= os.path.getsize(path):
+        os.remove(tmp)
+        return []
+    os.replace(tmp, path)
+    return actions
+
+
+def task_postprocess(path, max_size=None, quality=None, ffmpeg=None):
+    """Transcode the file at `path` -> dict(path, new_path, size, new_size,
+    actions, sha1, error); runs in the worker processes"""
+    record = dict(path=path, new_path=path, size=None, new_size=None, actions=[],
+                  sha1=None, error=None)
+    try:
+        record['size'] = record['new_size'] = os.path.getsize(path)
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.gif' and ffmpeg:
+            new_path = _gif_to_mp4(path, ffmpeg)
+            if new_path:
+                record.update(new_path=new_path, actions=['mp4'])
+        elif ext in IMAGE_EXTS and (max_size or quality):
+            record['actions'] = _transcode_image(path, max_size, quality)
+        if record['actions']:
+            record['new_size'] = os.path.getsize(record['new_path'])
+            record['sha1'] = _sha1(record['new_path'])
+    except Exception as exc:
+        record['error'] = '%s: %s' % (type(exc).__name__, exc)
+    return record
+
+
+def decoded_size(path):
+    """Bytes an image at `path` takes decoded (4 per pixel), 0 when its
+    dimensions can't be read"""
+    try:
+        with open(path, 'rb') as f:
+            size = read_head(f)[1]
+    except (IOError, OSError):
+        return 0
+    return size[0] * size[1] * 4 if size else 0
+
+
+def ratio(record):
+    """New size / old size of a record"""
+    return round(float(record['new_size']) / record['size'], 3) if record['size'] else 1.0
+
+
+class Postprocessor(object):
+    """Transcodes downloaded files in the background
+
+    :param max_size: (width, height) to downscale images to, or None
+    :param quality: JPEG / WebP quality to re-encode at, or None
+    :param gif_to_mp4: convert GIFs if ffmpeg is found
+    """
+
+    def __init__(self, max_size=None, quality=None, gif_to_mp4=False):
+        self.max_size = max_size
+        self.quality = quality
+        self.ffmpeg = shutil.which('ffmpeg') if gif_to_mp4 else None
+        if gif_to_mp4 and not self.ffmpeg:
+            _log.warning("ffmpeg not found, GIFs are kept as they are")
+        self._pending = []  # (future, context)
+        self._converted = {}  # folder -> {original name: new name}
+
+    def submit(self, path, **context):
+        """Start on the file at `path`; `context` (e.g. the submission id)
+        is added to its record"""
+        reserved = 0
+        if (self.max_size or self.quality) and os.path.splitext(path)[1].lower() in IMAGE_EXTS:
+            reserved = decoded_size(path)
+            memory.acquire(reserved)
+        try:
+            future = cpupool.submit(task_postprocess, path, self.max_size, self.quality,
+                                    self.ffmpeg)
+        except BaseException:
+            memory.release(reserved)
+            raise
+        future.add_done_callback(lambda _: memory.release(reserved))
+        self._pending.append((future, context))
+
+    def done(self, wait_all=False):
+        """Records of the jobs that finished (all of them with `wait_all`);
+        the changed files are written to the folders' records"""
+        if wait_all:
+            wait([future for future, _ in self._pending])
+        finished, pending = [], []
+        for entry in self._pending:
+            (finished if entry[0].done() else pending).append(entry)
+        self._pending = pending
+        records = []
+        for future, context in finished:
+            try:
+                record = future.result()
+            except Exception as exc:  # e.g. a worker that died
+                record = dict(path=None, actions=[], error='%s: %s' % (type(exc).__name__, exc))
+            record.update(context)
+            if record['actions']:
+                record.update(ratio=ratio(record), time=round(time.time(), 3))
+                self._record(record)
+            records.append(record)
+        return records
+
+    def _record(self, record):
+        folder, name = os.path.split(record['path'])
+        with open(os.path.join(folder, RECORD_FILE), 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        if record['new_path'] != record['path']:
+            self._folder(folder)[name] = os.path.basename(record['new_path'])
+
+    def _folder(self, folder):
+        if folder not in self._converted:
+            converted = {}
+            try:
+                with open(os.path.join(folder, RECORD_FILE)) as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if record.get('new_path') != record.get('path'):
+                            converted[os.path.basename(record['path'])] = os.path.basename(
+                                record['new_path'])
+            except (IOError, OSError):
+                pass
+            self._converted[folder] = converted
+        return self._converted[folder]
+
+    def converted(self, path):
+        """Path the file at `path` was converted to (it's gone), else None"""
+        folder, name = os.path.split(path)
+        new_name = self._folder(folder).get(name)
+        return new_name and os.path.join(folder, new_name)
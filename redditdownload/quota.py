@@ -0,0 +1,215 @@
+"""Disk quota of a download folder (``--max-dir-size``, ``--max-files``).
+
+Keeps a rotating wallpaper folder at a fixed size without cron jobs
+rescanning it: every folder has an incremental size index,
+``._quota.idx`` (JSON lines), appended to as files are downloaded and
+evicted. When a download takes the folder over its quota, files are
+evicted down to :data:`LOW_WATER` of it (so evictions come in batches),
+the oldest downloads first or, with ``--evict lru``, the least recently
+viewed ones (by atime). The submission ids of evicted files stay in the
+index so they are not downloaded again.
+
+The folder is scanned once, when it has no index yet; only media files
+(see :func:`fanout.is_download`) count.
+"""
+
+import os
+import json
+import heapq
+import logging
+import tempfile
+import time
+
+from .fanout import is_download, iter_files
+
+
+_log = logging.getLogger(__name__)
+
+QUOTA_FILE = '._quota.idx'
+POLICIES = ('oldest', 'lru')
+# Evict down to this fraction of the quota.
+LOW_WATER = 0.9
+# How much earlier than its index time a file may have been last written
+# (seconds): it is written, then added.
+ADD_SLACK = 60
+
+
+class Quota(object):
+    """Quota of the files in `root` (and its fan-out levels)
+
+    :param max_bytes: None for no size limit
+    :param max_files: None for no file count limit
+    :param policy: 'oldest' (by download time) or 'lru' (by atime)
+    """
+
+    def __init__(self, root, max_bytes=None, max_files=None, policy='oldest',
+                 low_water=LOW_WATER):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.policy = policy
+        self.low_water = low_water
+        self.files = {}  # path relative to root -> (size, time added, submission id)
+        self.evicted = set()  # submission ids
+        self.size = 0
+        self._lines = 0
+        self._fo = None
+        self._load()
+
+    @property
+    def index_file(self):
+        return os.path.join(self.root, QUOTA_FILE)
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            self._scan()
+            return
+        with open(self.index_file) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line
+                self._lines += 1
+                self._apply(entry)
+
+    def _apply(self, entry):
+        name = entry.get('path')
+        if name in self.files:
+            self.size -= self.files.pop(name)[0]
+        if entry.get('evicted'):
+            if entry.get('id'):
+                self.evicted.add(entry['id'])
+        elif name is not None and not entry.get('removed'):
+            self.files[name] = (entry['size'], entry['time'], entry.get('id'))
+            self.size += entry['size']
+
+    def _scan(self):
+        """Index the files already in the folder (once)"""
+        root = os.path.normpath(self.root)
+        for base, path in iter_files(root):
+            # (not another folder below this one, nor lists, shards, databases)
+            if base != root or not is_download(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            self._apply(dict(path=os.path.relpath(path, root), size=stat.st_size,
+                             time=stat.st_mtime))
+        self._compact()
+
+    def _write(self, entry):
+        if self._fo is None:
+            self._fo = open(self.index_file, 'a')
+        self._fo.write(json.dumps(entry) + '\n')
+        self._fo.flush()
+        self._lines += 1
+
+    def _compact(self):
+        """Rewrite the index without the entries of evicted files"""
+        self.close()
+        entries = [dict(path=name, size=size, time=added, id=item_id)
+                   for name, (size, added, item_id) in self.files.items()]
+        entries += [dict(evicted=True, id=item_id) for item_id in sorted(self.evicted)]
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(tmp, self.index_file)
+        self._lines = len(entries)
+
+    def over(self, factor=1.0):
+        """Whether the folder is over (`factor` times) its quota"""
+        return ((self.max_bytes is not None and self.size > self.max_bytes * factor) or
+                (self.max_files is not None and len(self.files) > self.max_files * factor))
+
+    def add(self, path, size, item_id=None):
+        """Record a downloaded file; returns the (path, submission id) of
+        the files evicted to make room"""
+        entry = dict(path=os.path.relpath(path, self.root), size=size or 0,
+                     time=round(time.time(), 3), id=item_id)
+        self._apply(entry)
+        self._write(entry)
+        if not self.over():
+            return []
+        return self.evict(keep=entry['path'])
+
+    def update(self, path, new_path, size):
+        """A file was rewritten (e.g. transcoded), possibly under a new name"""
+        name = os.path.relpath(path, self.root)
+        if name not in self.files:
+            return
+        _, added, item_id = self.files[name]
+        new_name = os.path.relpath(new_path, self.root)
+        if new_name != name:
+            self._write(dict(path=name, removed=True))
+            self._apply(dict(path=name, removed=True))
+        entry = dict(path=new_name, size=size, time=added, id=item_id)
+        self._apply(entry)
+        self._write(entry)
+
+    def was_evicted(self, item_id):
+        return item_id in self.evicted
+
+    def _last_used(self, name):
+        try:
+            stat = os.stat(os.path.join(self.root, name))
+        except OSError:
+            return 0  # gone already
+        return max(stat.st_atime, stat.st_mtime)
+
+    def _order(self):
+        """Indexed files, first to evict first
+
+        With 'lru' the files are stat-ed lazily, oldest download first: a
+        file isn't used before it is downloaded, so one whose last use is
+        older than the next download goes before all the files not stat-ed
+        yet, and an eviction batch only stats the files downloaded before
+        the last use of the ones it evicts.
+        """
+        by_added = sorted(self.files, key=lambda name: self.files[name][1])
+        if self.policy != 'lru':
+            return by_added
+        return self._lru_order(by_added)
+
+    def _lru_order(self, by_added):
+        heap = []
+        for name in by_added:
+            added = self.files[name][1]
+            while heap and heap[0][0] < added - ADD_SLACK:
+                yield heapq.heappop(heap)[1]
+            heapq.heappush(heap, (self._last_used(name), name))
+        while heap:
+            yield heapq.heappop(heap)[1]
+
+    def evict(self, keep=None):
+        """Delete files (never `keep`) until the folder is down to the low
+        water mark; returns their (path, submission id)"""
+        evicted = []
+        for name in self._order():
+            if not self.over(self.low_water):
+                break
+            if name == keep:
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                os.remove(path)
+            except OSError as exc:
+                if os.path.exists(path):
+                    _log.warning("Can't evict %s: %r", path, exc)
+                    continue
+            item_id = self.files[name][2]
+            entry = dict(path=name, evicted=True, id=item_id)
+            self._apply(entry)
+            self._write(entry)
+            evicted.append((path, item_id))
+        if self._lines > 2 * (len(self.files) + len(self.evicted)) + 100:
+            self._compact()
+        return evicted
+
+    def close(self):
+        if self._fo is not None:
+            self._fo.close()
+            self._fo = None
@@ -7,28 +7,53 @@ import re
 import io
 import sys
 import json
+import asyncio
 import logging
+import argparse
+import threading
+from collections import Counter, namedtuple
 from urllib.request import urlopen
 from urllib.error import HTTPError, URLError
-from http.client import InvalidURL
+from urllib.parse import urlparse
 from argparse import ArgumentParser
 from os.path import (
     exists as pathexists, join as pathjoin, basename as pathbasename,
     splitext as pathsplitext)
 from os import mkdir, getcwd
 import time
+import shutil
 
 from .Exceptions import (
     WrongFileTypeException,
     FileExistsException,
     URLDNEException,
-    WrongDataException
+    WrongDataException,
+    ImageSizeException,
+    RedditAPIException
 )
 from .plugins.gfycat import gfycat
 from .plugins.reddit import getitems
-from .plugins.imgur_downloader.imgurdownloader import ImgurDownloader, ImgurException
-from .plugins.parse_subreddit_list import parse_subreddit_list
+from .plugins.imgur_downloader.imgurdownloader import ImgurDownloader
+from .plugins.parse_subreddit_list import parse_subreddit_list, group_subreddits
 from .deviantart import process_deviant_url
+from .resolution import parse_resolution, pick_rendition, preview_source_size
+from .imagesize import SizeFilter, parse_aspect, read_head
+from . import httpcache
+from . import htmlparse
+from . import cpupool
+from . import watermark
+from . import watch
+from . import backfill
+from . import segmented
+from . import storage
+from . import catalog
+from . import journal
+from . import budget
+from . import quota
+from . import postprocess
+from . import jobspec
+from . import trace
+from . import memory
 
 
 _log = logging.getLogger('redditdownload')
@@ -51,19 +76,11 @@ def request(url, *ar, **kwa):
     return res
 
 
-# '.wrong_type_pages.jsl'
+# '.wrong_type_pages.jsl'; the default --journal (the wrong type pages are
+# the events with error 'WrongFileTypeException', see scrap_wrongies.py)
 _WRONGDATA_LOGFILE = os.environ.get('WRONGDATA_LOGFILE')
 
 
-def _log_wrongtype(_logfile=_WRONGDATA_LOGFILE, **kwa):
-    if not _logfile:
-        return
-
-    data = json.dumps(kwa) + "\n"
-    with open(_logfile, 'a', 1) as f:
-        f.write(data)
-
-
 def extract_imgur_album_urls(album_url):
     """
     Given an imgur album URL, attempt to extract the images within that
@@ -72,14 +89,14 @@ def extract_imgur_album_urls(album_url):
     Returns:
         List of qualified imgur URLs
     """
-    response = request(album_url)
+    response = httpcache.urlopen(album_url)
     info = response.info()
 
     # Rudimentary check to ensure the URL actually specifies an HTML file
     if 'content-type' in info and not info['content-type'].startswith('text/html'):
         return []
 
-    filedata = response.read()
+    filedata = response.read().decode('utf-8', 'replace')
 
     match = re.compile(r'\"hash\":\"(.[^\"]*)\"')
 
@@ -107,10 +124,24 @@ def extract_imgur_album_urls(album_url):
     return urls
 
 
-def download_from_url(url, dest_file):
+def download_from_url(url, dest_file, size_filter=None, sink=None):
     """
     Attempt to download file specified by url to 'dest_file'
 
+    If `size_filter` (an imagesize.SizeFilter) is given, only the first few
+    KB are read to find the dimensions and the download is aborted when
+    they don't qualify.
+
+    Large files of servers supporting ranges are fetched over several
+    connections, see segmented.configure.
+
+    The file is written through `sink` (a storage sink, default: the
+    process-wide one, see storage.configure).
+
+    Returns:
+
+        (size, sha1 hexdigest) of the file
+
     Raises:
 
         WrongFileTypeException
@@ -118,6 +149,10 @@ def download_from_url(url, dest_file):
             when content-type is not in the supported types or cannot
             be derived from the URL
 
+        ImageSizeException
+
+            when the dimensions are rejected by `size_filter`
+
         FileExceptionsException
 
             If the filename (derived from the URL) already exists in
@@ -127,8 +162,10 @@ def download_from_url(url, dest_file):
 
             ...
     """
+    sink = sink or storage.get_sink()
+
     # Don't download files multiple times!
-    if pathexists(dest_file):
+    if sink.exists(dest_file):
         raise FileExistsException('%s already downloaded.' % dest_file.split('/')[-1])
 
     response = request(url)
@@ -157,10 +194,35 @@ def download_from_url(url, dest_file):
     if filetype not in ['image/jpeg', 'image/png', 'image/gif', 'video/webm', 'video/mp4']:
         raise WrongFileTypeException('WRONG FILE TYPE: %s has type: %s!' % (url, filetype))
 
-    filedata = response.read()
-    filehandle = open(dest_file, 'wb')
-    filehandle.write(filedata)
-    filehandle.close()
+    head = b''
+    if size_filter is not None:
+        head, size = read_head(response)
+        reason = size_filter.check(size)
+        if reason:
+            response.close()
+            raise ImageSizeException('%s is %s' % (url, reason))
+
+    size = segmented.should_segment(info)
+    if size:
+        response.close()
+        temp_file = sink.temp_path(dest_file)
+        try:
+            segmented.download(actual_url, temp_file, size, head=head,
+                               validator=segmented.validator(info))
+            return sink.put_file(dest_file, temp_file)
+        except segmented.SegmentError as exc:
+            _log.info('Segmented download failed (%s), streaming %s instead', exc, actual_url)
+            response, head = request(actual_url), b''
+
+    with memory.reserve(len(head) + shutil.COPY_BUFSIZE):
+        with sink.open_write(dest_file) as filehandle:
+            filehandle.write(head)
+            shutil.copyfileobj(response, filehandle)
+    return filehandle.size, filehandle.sha1.hexdigest()
+
+
+# Direct imgur media links: not pages to look for a video in.
+IMGUR_MEDIA_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.mp4', '.webm')
 
 
 def process_imgur_url(url):
@@ -174,22 +236,23 @@ def process_imgur_url(url):
     if 'imgur.com/a/' in url or 'imgur.com/gallery/' in url:
         return extract_imgur_album_urls(url)
 
-    # use beautifulsoup4 to find real link
-    # find vid url only
-    try:
-        from bs4 import BeautifulSoup
-        html = urlopen(url).read()
-        soup = BeautifulSoup(html, 'lxml')
-        vid = soup.find('div', {'class': 'video-container'})
-        vid_type = 'video/webm'  # or 'video/mp4'
-        vid_url = vid.find('source', {'type': vid_type}).get('src')
-        if vid_url.startswith('//'):
-            vid_url = 'http:' + vid_url
-        return vid_url
-
-    except Exception:
-        # do nothing for awhile
-        pass
+    # find vid url only, on html pages (.gifv ones are): direct media links
+    # aren't fetched here, nor cached
+    parts = urlparse(url)
+    ext = pathsplitext(pathbasename(parts.path))[1].lower()
+    if ext not in IMGUR_MEDIA_EXTS and (ext == '.gifv' or not parts.netloc.startswith('i.')):
+        try:
+            html = httpcache.urlopen(url).read()
+            page = htmlparse.extract(html, want=('source',))
+            vid_type = 'video/webm'  # or 'video/mp4'
+            vid_url = [src for type_, src in page.sources if type_ == vid_type][0]
+            if vid_url.startswith('//'):
+                vid_url = 'http:' + vid_url
+            return [vid_url]
+
+        except Exception:
+            # do nothing for awhile
+            pass
     # Change .png to .jpg for imgur urls.
     if url.endswith('.png'):
         url = url.replace('.png', '.jpg')
@@ -269,6 +332,9 @@ def history_log(wdir=os.getcwd(), log_file='log_file.txt', mode='read', write_da
         'append': 'a'
     }
     if mode in mode_dict:
+        # folders are created by the first write into them
+        if mode != 'read' and wdir and not os.path.isdir(wdir):
+            os.makedirs(wdir)
         with open(os.path.join(wdir, log_file), mode_dict[mode]) as f:
             if mode == 'read':
                 return json.loads(f.read())
@@ -323,17 +389,19 @@ def process_subreddit_last_id(subreddit, sort_type, dir, log_file, verbose=False
                 }
             }
         }
-        history_log(dir, log_file, 'write', log_data)
-        if verbose:
-            print ('%s not found in %s, created new %s'
-                % (log_file, dir, log_file))
+        # (written with the first position saved when the folder is new)
+        if os.path.isdir(dir):
+            history_log(dir, log_file, 'write', log_data)
+            if verbose:
+                print ('%s not found in %s, created new %s'
+                    % (log_file, dir, log_file))
 
     except WrongDataException as e:
         if verbose:
-            print('log_data:\n%s\n%s' % (e.data, e.message))
+            _log.info('log_data:\n%s\n%s', e.data, e.message)
 
     except:
-        print('-------WHAT HAPPENED IN %s PROCESSING-------?' % log_file)
+        _log.exception('-------WHAT HAPPENED IN %s PROCESSING-------?', log_file)
 
     if no_history:
         last_id = ''
@@ -342,11 +410,49 @@ def process_subreddit_last_id(subreddit, sort_type, dir, log_file, verbose=False
     return log_data, last_id
 
 
-def parse_args(args):
+def save_last_id(subreddit, sort_type, last_id, dir, log_file, cache):
+    """Record last_id of subreddit in the log_file of dir
+
+    Used for items of combined (a+b+c) listings, each of which belongs to the
+    history of its own subreddit.
+
+    :param cache: dict of dir -> log_data, to read each log_file only once
+    """
+    save_routed(subreddit, sort_type, dir, log_file, cache, **{'last-id': last_id})
+
+
+def _routed_history(subreddit, sort_type, dir, log_file, cache):
+    """log_data of dir (see save_last_id), history of subreddit & sort_type"""
+    log_data = cache.get(dir)
+    if log_data is None:
+        log_data, _ = process_subreddit_last_id(subreddit, sort_type, dir, log_file)
+        cache[dir] = log_data
+    return log_data, log_data.setdefault(subreddit, {}).setdefault(sort_type, {})
+
+
+def save_routed(subreddit, sort_type, dir, log_file, cache, **values):
+    """Record `values` (last-id, watermark) in the history of subreddit in
+    the log_file of dir; see save_last_id"""
+    log_data, history = _routed_history(subreddit, sort_type, dir, log_file, cache)
+    history.update(values)
+    history_log(dir, log_file, mode='write', write_data=log_data)
+
+
+def members_watermark(routes, sort_type, log_file, cache):
+    """Watermark of a combined listing from the histories of its
+    subreddits, which keep theirs when the listing is renamed (its group
+    changed, see group_subreddits)"""
+    return watermark.oldest(
+        _routed_history(route[0], sort_type, route[1], log_file, cache)[1].get('watermark')
+        for route in routes.values())
+
+
+def make_parser():
     PARSER = ArgumentParser(description='Downloads files with specified extension'
                             'from the specified subreddit.')
     PARSER.add_argument('subreddit', metavar='<subreddit>',
-                        help='Subreddit or subreddit list file name.')
+                        help='Subreddit, subreddit list file name or job spec file '
+                        '(%s, see jobspec.py).' % ', '.join(jobspec.SPEC_EXTS))
     PARSER.add_argument('dir', metavar='<dest_file>', nargs='?',
                         default=getcwd(), help='Dir to put downloaded files in.')
     PARSER.add_argument('--multireddit', default=False, action='store_true',
@@ -376,6 +482,8 @@ def parse_args(args):
                         help='Use Python regex to filter based on title.')
     PARSER.add_argument('--verbose', default=False, action='store_true',
                         required=False, help='Enable verbose output.')
+    PARSER.add_argument('--quiet', default=False, action='store_true', required=False,
+                        help='Only print the errors: no progress messages or summary.')
     PARSER.add_argument('--skipAlbums', default=False, action='store_true',
                         required=False, help='Skip all albums')
     PARSER.add_argument('--mirror-gfycat', default=False, action='store_true', required=False,
@@ -383,23 +491,203 @@ def parse_args(args):
     PARSER.add_argument('--sort-type', default='hot', help='Sort the subreddit.')
     PARSER.add_argument('--restart', default=False, required=False, action='store_true',
                         help='Begin downloading from beginning of subreddit.')
+    PARSER.add_argument('--max-resolution', metavar='WxH', default=None,
+                        type=parse_resolution, required=False,
+                        help='Download the smallest rendition (reddit preview or '
+                        'imgur thumbnail) that still covers WxH, e.g. 1920x1080. '
+                        'The original is used when nothing big enough exists.')
+    PARSER.add_argument('--min-width', metavar='px', default=0, type=int, required=False,
+                        help='Skip images narrower than this.')
+    PARSER.add_argument('--min-height', metavar='px', default=0, type=int, required=False,
+                        help='Skip images lower than this.')
+    PARSER.add_argument('--aspect', metavar='W:H', default=None, type=parse_aspect,
+                        required=False,
+                        help='Minimum width/height ratio, e.g. 16:9 or 1.0 to skip '
+                        'portrait images.')
+    PARSER.add_argument('--cache-dir', metavar='DIR', default=None, required=False,
+                        help='Cache page and API responses (reddit listings, imgur, '
+                        'deviantart, gfycat) in DIR, honouring HTTP caching headers.')
+    PARSER.add_argument('--cache-size', metavar='MiB', default=256, type=int, required=False,
+                        help='Maximum size of --cache-dir, least recently used '
+                        'entries are evicted first.')
+    PARSER.add_argument('--html-parser', default=None, choices=htmlparse.BACKENDS,
+                        required=False,
+                        help='Preferred HTML parser for the page resolvers '
+                        '(default: lxml if installed, else stdlib; bs4 is the fallback).')
+    PARSER.add_argument('--batch-subreddits', default=False, action='store_true',
+                        required=False,
+                        help='With a subreddit list: fetch the subreddits as combined '
+                        'r/a+b+c listings (one paced request for many subreddits) and '
+                        'route each post to its own folder & history. --num and --update '
+                        'then count per combined listing.')
+    PARSER.add_argument('--incremental', default=False, action='store_true', required=False,
+                        help='Only look at posts newer than the previous run: keeps a '
+                        'high-water mark per subreddit & sort and stops paginating '
+                        'at the first already-seen post (best with --sort-type new).')
+    PARSER.add_argument('--watch', default=False, action='store_true', required=False,
+                        help='Keep running and poll each subreddit at an interval that '
+                        'follows its post rate; reloads the subreddit list file when it '
+                        'changes. Implies --incremental. Stop with Ctrl-C / SIGTERM.')
+    PARSER.add_argument('--watch-min', metavar='seconds', default=watch.MIN_INTERVAL,
+                        type=int, required=False,
+                        help='Shortest poll interval in --watch mode (default %(default)s).')
+    PARSER.add_argument('--watch-max', metavar='seconds', default=watch.MAX_INTERVAL,
+                        type=int, required=False,
+                        help='Longest poll interval in --watch mode (default %(default)s).')
+    PARSER.add_argument('--backfill', metavar='FROM..TO', default=None,
+                        type=backfill.parse_range, required=False,
+                        help='Download the posts made between FROM and TO (YYYY-MM-DD, '
+                        'YYYY-MM-DDTHH:MM or epoch seconds, UTC; TO defaults to now) from '
+                        'an archive API, past the ~1000 posts a listing goes back.')
+    PARSER.add_argument('--backfill-api', metavar='URL', default=backfill.DEFAULT_API,
+                        required=False,
+                        help='Pushshift-compatible submission search endpoint '
+                        '(default %(default)s).')
+    PARSER.add_argument('--backfill-rate', metavar='req/s', default=backfill.DEFAULT_RATE,
+                        type=float, required=False,
+                        help='Archive requests per second over all backfill workers '
+                        '(default %(default)s).')
+    PARSER.add_argument('--segments', metavar='n', default=segmented.SEGMENTS, type=int,
+                        required=False,
+                        help='Connections per large file download when the server '
+                        'supports ranges (default %(default)s, 1 disables).')
+    PARSER.add_argument('--segment-min-size', metavar='MiB', default=32, type=int,
+                        required=False,
+                        help='Only files of at least this size are segmented '
+                        '(default %(default)s).')
+    PARSER.add_argument('--sink', default='dir', choices=storage.SINKS, required=False,
+                        help='Where files go: "dir" writes one file each (default), '
+                        '"tar" appends them to rolling tar shards in <dest_file> with an '
+                        'index of member offsets.')
+    PARSER.add_argument('--shard-size', metavar='MiB', default=1024, type=int,
+                        required=False,
+                        help='Size at which --sink tar starts a new shard (default %(default)s).')
+    PARSER.add_argument('--fanout', metavar='N', default=0, type=int, required=False,
+                        help='Put files N levels of hashed subfolders deep (e.g. ab/cd/<id>.jpg '
+                        'for 2) to keep folders small. Convert existing folders with '
+                        '"python -m redditdownload.fanout <dir> N".')
+    PARSER.add_argument('--catalog', metavar='PATH', default=None, required=False,
+                        help='Record the downloaded submissions and files in this SQLite '
+                        'catalog; search it with "redditdl.py query".')
+    PARSER.add_argument('--downscale', metavar='WxH', default=None, type=parse_resolution,
+                        required=False,
+                        help='After download, resize images larger than WxH to fit in it.')
+    PARSER.add_argument('--recompress', metavar='quality', default=None, type=int,
+                        required=False,
+                        help='After download, re-encode JPEG / WebP images at this quality '
+                        '(1-95) when that makes them smaller.')
+    PARSER.add_argument('--gif-to-mp4', default=False, action='store_true', required=False,
+                        help='After download, convert GIFs to MP4 (needs ffmpeg). The '
+                        'post-processing runs in the --cpu-workers pool (or a background '
+                        'thread) and is recorded in %s.' % postprocess.RECORD_FILE)
+    PARSER.add_argument('--max-dir-size', metavar='MiB', default=None, type=float,
+                        required=False,
+                        help='Quota of each download folder: evict files as new ones arrive '
+                        '(see --evict); their submissions are not downloaded again.')
+    PARSER.add_argument('--max-files', metavar='n', default=None, type=int, required=False,
+                        help='Quota of files in each download folder, like --max-dir-size.')
+    PARSER.add_argument('--evict', default='oldest', choices=quota.POLICIES, required=False,
+                        help='Evict the oldest downloads (default) or the least recently '
+                        'viewed files (by atime) first.')
+    PARSER.add_argument('--byte-budget', metavar='MiB', default=None, type=float,
+                        required=False,
+                        help='Download at most this much; the submissions of each listing page '
+                        'are ranked (see --budget-rank) and the best ones taken first.')
+    PARSER.add_argument('--deadline', metavar='HH:MM|45m', default=None,
+                        type=budget.parse_deadline, required=False,
+                        help='Stop at this local time (or after this long: 90s, 45m, 2h); ranks '
+                        'the submissions like --byte-budget.')
+    PARSER.add_argument('--budget-rank', default='score', choices=budget.RANKS,
+                        required=False,
+                        help='Order of the submissions under a budget: by score, or by score '
+                        'per MiB (density). Passed over submissions are kept in '
+                        '%s and go first next time.' % budget.DEFERRED_FILE)
+    PARSER.add_argument('--journal', metavar='PATH', default=_WRONGDATA_LOGFILE,
+                        required=False,
+                        help='Append every result (saved, skipped with the reason, failed with '
+                        'the error class, timing) to this JSON lines file, written in the '
+                        'background (default $WRONGDATA_LOGFILE).')
+    PARSER.add_argument('--console-rate', metavar='lines/s', default=journal.CONSOLE_RATE,
+                        type=int, required=False,
+                        help='Print at most this many result lines a second, the rest are '
+                        'summarized (default %(default)s, 0: no limit).')
+    PARSER.add_argument('--record-trace', metavar='DIR', default=None, required=False,
+                        help='Record every HTTP request and response (headers, bodies, '
+                        'timing) in DIR, to replay the run with --replay-trace.')
+    PARSER.add_argument('--replay-trace', metavar='DIR', default=None, required=False,
+                        help='Serve the requests from a trace recorded with --record-trace '
+                        'instead of the network.')
+    PARSER.add_argument('--replay-latency', choices=trace.LATENCIES, default='original',
+                        required=False,
+                        help='Replay with the recorded latencies (default) or none.')
+    PARSER.add_argument('--trace-bodies', choices=trace.BODY_MODES, default='full',
+                        required=False,
+                        help='Record the response bodies (default) or their sha1 only; '
+                        'hashed bodies are replayed as zero bytes.')
+    PARSER.add_argument('--memory-budget', metavar='MiB', default=None, type=float,
+                        required=False,
+                        help='Keep the buffers in flight (read-ahead, download chunks, pages '
+                        'being read, image probes) within this much memory; producers wait '
+                        'while it is used up. The RSS and reserved peak are reported.')
+    PARSER.add_argument('--cpu-workers', metavar='n', default=0, type=int, required=False,
+                        help='Worker processes for CPU-heavy work (HTML parsing, '
+                        'image decoding). 0 runs it inline.')
 
     # TODO fix if regex, title contain activated
 
-    parsed_argument = PARSER.parse_args(args)
+    return PARSER
 
+
+def normalize_options(parsed_argument):
+    """Resolve the interplay of options in place (raises ValueError on
+    conflicts); used for both the command line and RedditImageGrab"""
     if parsed_argument.sfw is True and parsed_argument.nsfw is True:
         # negate both argument if both argument exist
         parsed_argument.sfw = parsed_argument.nsfw = False
 
+    if isinstance(parsed_argument.subreddit_list, list):  # nargs=1
+        parsed_argument.subreddit_list = parsed_argument.subreddit_list[0]
+
     # set restart = True if update == True
     if parsed_argument.update:
         parsed_argument.restart = True
 
+    if parsed_argument.backfill:
+        if parsed_argument.watch or parsed_argument.multireddit:
+            raise ValueError('--backfill works on subreddits, without --watch')
+        # a time range, not a listing: no watermark to stop at
+        parsed_argument.incremental = False
+
+    if parsed_argument.max_dir_size is not None or parsed_argument.max_files is not None:
+        if parsed_argument.sink != 'dir':
+            raise ValueError('--max-dir-size / --max-files need --sink dir')
+
+    if parsed_argument.recompress is not None and not 1 <= parsed_argument.recompress <= 95:
+        raise ValueError('--recompress quality must be 1-95')
+    if (parsed_argument.downscale or parsed_argument.recompress or
+            parsed_argument.gif_to_mp4) and parsed_argument.sink != 'dir':
+        raise ValueError('--downscale / --recompress / --gif-to-mp4 need --sink dir')
+
+    if parsed_argument.record_trace and parsed_argument.replay_trace:
+        raise ValueError('--record-trace and --replay-trace are exclusive')
+
+    # each poll only looks at what's newer than the previous one
+    if parsed_argument.watch:
+        parsed_argument.incremental = True
 
     return parsed_argument
 
 
+def parse_args(args):
+    PARSER = make_parser()
+    parsed_argument = PARSER.parse_args(args)
+    try:
+        normalize_options(parsed_argument)
+    except ValueError as exc:
+        PARSER.error(str(exc))
+    return parsed_argument
+
+
 def parse_reddit_argument(reddit_args):
     if '+' not in reddit_args:
         return 'Downloading images from "%s" subreddit' % (reddit_args)
@@ -411,174 +699,497 @@ def parse_reddit_argument(reddit_args):
         return 'Downloading images from "%s" subreddit' % (', '.join(reddit_args.split('+')))
 
 
-def main(args=None):
-    ARGS = parse_args(args if len(args)>0 else sys.argv[1:])
+# compile reddit comment url to check if url is one of them
+reddit_comment_regex = re.compile(r'.*reddit\.com\/r\/(.*?)\/comments')
 
-    logging.basicConfig(level=logging.INFO)
 
-    # value at first index is of current subreddit, second index is total
-    TOTAL, DOWNLOADED, ERRORS, SKIPPED, FAILED =  [0,0], [0,0], [0,0], [0,0], [0,0]
-    PROG_REPORT = [TOTAL, DOWNLOADED, ERRORS, SKIPPED, FAILED]
+class Section(namedtuple('Section', 'subreddit dir routes overrides weight priority',
+                         defaults=(None, None, 1.0, 0))):
+    """A listing to download from
 
-    # Create the specified directory if it doesn't already exist.
-    if not pathexists(ARGS.dir):
-        mkdir(ARGS.dir)
+    :param routes: for combined (a+b+c) listings, {subreddit.lower(): entry}
+        of the folders the items go to
+    :param overrides: options of a job spec entry, sorted (option, value) tuple
+    :param weight: share of the polls in --watch
+    :param priority: higher ones run first
+    """
+    __slots__ = ()
 
-    # If a regex has been specified, compile the rule (once)
-    RE_RULE = None
-    if ARGS.regex:
-        RE_RULE = re.compile(ARGS.regex)
 
-    # compile reddit comment url to check if url is one of them
-    reddit_comment_regex = re.compile(r'.*reddit\.com\/r\/(.*?)\/comments')
+class DownloadResult(namedtuple('DownloadResult',
+                                'status subreddit item_id url path reason error elapsed',
+                                defaults=(None, None))):
+    """Outcome for one media url (or a whole submission when it's skipped)
+    as streamed by RedditImageGrab
 
-    LAST = ARGS.last
+    :param status: one of the status constants below
+    :param reason: human readable reason of a skip / error, else None
+    :param error: class name of the exception behind a skip / error
+    :param elapsed: seconds spent on the url (or submission)
+    """
+    __slots__ = ()
 
-    start_time = None
-    ITEM = None
+    DOWNLOADED = 'downloaded'
+    EXISTS = 'exists'    # already downloaded
+    SKIPPED = 'skipped'  # filtered out
+    ERROR = 'error'      # the download failed
+    FAILED = 'failed'    # the url could not be resolved / fetched
+    EVICTED = 'evicted'  # deleted to stay within the folder's quota
+    TRANSCODED = 'transcoded'  # shrunk after the download
 
-    sort_type = ARGS.sort_type
-    if sort_type:
-        sort_type = sort_type.lower()
 
-    # check to see if ARGS.subreddit is subreddit or subreddit-list
-    if os.path.isfile(ARGS.subreddit) and os.path.splitext(ARGS.subreddit)[1] != '':
-        ARGS.subreddit_list = ARGS.subreddit
+class RedditImageGrab(object):
+    """Downloads the media of subreddit submissions
 
-    if ARGS.subreddit_list:
-        # ARGS.subreddit_list = ARGS.subreddit_list[0] # can't remember why I did this -jtara1
-        subreddit_file = ARGS.subreddit_list
-        subreddit_list = parse_subreddit_list(subreddit_file, ARGS.dir)
-        if ARGS.verbose:
-            print('subreddit_list = %s' % subreddit_list)
-    elif not ARGS.subreddit_list:
-        subreddit_list = [(ARGS.subreddit, ARGS.dir)]
+    The importable version of the command line tool. Options are the long
+    command line options as keyword arguments (with parsed values, e.g.
+    ``max_resolution=(1920, 1080)``); results are streamed::
 
-    # file used to store last reddit id
-    log_file = '._history.txt'
+        grab = RedditImageGrab('wallpapers', 'walls', score=50, num=20)
+        for result in grab.run():
+            print(result.status, result.url)
 
-    # iterate through subreddit(s)
-    for index, section in enumerate(subreddit_list):
-        (ARGS.subreddit, ARGS.dir) = section
-        FINISHED = False
+    Errors that stop a whole listing (RedditAPIException) are raised, never
+    exit the process. The HTTP cache, HTML parser, cpu pool and segmented
+    downloads are process-wide (see httpcache.configure & co) so all
+    instances share the same transport and cache.
+    """
 
-        if ARGS.verbose:
-            print ('index: %s, %s, %s' % (index, ARGS.subreddit, ARGS.dir))
+    # file used to store last reddit id
+    LOG_FILE = '._history.txt'
+
+    def __init__(self, subreddit, dir='.', **options):
+        opts = make_parser().parse_args([subreddit, dir])
+        for name, value in options.items():
+            if not hasattr(opts, name) or name in ('subreddit', 'dir'):
+                raise TypeError('unexpected option %r' % name)
+            setattr(opts, name, value)
+        normalize_options(opts)
+        # check to see if subreddit is subreddit or subreddit-list
+        if os.path.isfile(subreddit) and os.path.splitext(subreddit)[1] != '':
+            opts.subreddit_list = subreddit
+        self.options = opts
+        self.subreddit = subreddit
+        self.dir = dir
+
+        # If a regex has been specified, compile the rule (once)
+        self.re_rule = re.compile(opts.regex) if opts.regex else None
+        # dimension filter, checked against preview metadata & the file header
+        self.size_filter = SizeFilter.from_args(opts)
+
+        # where the files go (--sink)
+        self.sink = storage.make_sink(opts.sink, dir, opts.shard_size * httpcache.MiB,
+                                      opts.fanout)
+        # metadata database (--catalog)
+        self.catalog = catalog.Catalog(opts.catalog) if opts.catalog else None
+        # --byte-budget / --deadline, for all the sections of the run
+        self.budget = None
+        if opts.byte_budget is not None or opts.deadline is not None:
+            self.budget = budget.Budget(
+                None if opts.byte_budget is None else int(opts.byte_budget * httpcache.MiB),
+                opts.deadline)
+        # --max-dir-size / --max-files, by folder
+        self.quota_enabled = opts.max_dir_size is not None or opts.max_files is not None
+        self._quotas = {}
+        # --downscale / --recompress / --gif-to-mp4
+        self.postprocessor = None
+        if opts.downscale or opts.recompress or opts.gif_to_mp4:
+            self.postprocessor = postprocess.Postprocessor(
+                opts.downscale, opts.recompress, opts.gif_to_mp4)
+        # every result, written in the background (--journal)
+        self.journal = journal.Journal(opts.journal) if opts.journal else None
+        # totals per DownloadResult status, plus 'processed' submissions
+        self.stats = Counter()
+        self._started = time.time()
+        self._stop = threading.Event()
+        self._last_request = None
+        # (options, regex, size filter) by job spec overrides
+        self._settings = {(): (opts, self.re_rule, self.size_filter)}
+        # history of each section kept in memory (poll_forever)
+        self._log_cache = None
+        self._routed_logs = {}
+
+    def stop(self):
+        """Stop at the next submission (may be called from another thread)"""
+        self._stop.set()
+
+    def load_sections(self):
+        """Sections to process, highest priority first; re-run by
+        poll_forever when the subreddit list file changes"""
+        opts = self.options
+        # Create the specified directory if it doesn't already exist.
+        if not pathexists(self.dir):
+            mkdir(self.dir)
+
+        if opts.subreddit_list and jobspec.is_job_spec(opts.subreddit_list):
+            # (the folders are made by the first write)
+            jobs = list(jobspec.iter_jobs(opts.subreddit_list, self.dir))
+            for job in jobs:
+                self._section_settings(job.overrides)  # fail early on bad values
+            if opts.verbose:
+                _log.info('jobs = %s', [(job.subreddit, job.dir) for job in jobs])
+        elif opts.subreddit_list:
+            subreddit_list = parse_subreddit_list(opts.subreddit_list, self.dir)
+            if opts.verbose:
+                _log.info('subreddit_list = %s', subreddit_list)
+            jobs = [jobspec.Job(subreddit, folder, (), 1.0, 0)
+                    for subreddit, folder in subreddit_list]
+        else:
+            jobs = [jobspec.Job(self.subreddit, self.dir, (), 1.0, 0)]
+
+        # combine the list into r/a+b+c listings; items are routed back to their
+        # subreddit's folder by their 'subreddit' field. Only jobs with the
+        # same options share a listing.
+        if opts.batch_subreddits and not opts.multireddit and len(jobs) > 1:
+            sections = []
+            for name, routes in group_subreddits(jobs, key=lambda job: job.overrides):
+                members = list(routes.values())
+                sections.append(Section(name, self.dir, routes, members[0].overrides,
+                                        max(job.weight for job in members),
+                                        max(job.priority for job in members)))
+            if opts.verbose:
+                _log.info('combined listings = %s', [section[0] for section in sections])
+        else:
+            sections = [Section(job.subreddit, job.dir, None, job.overrides, job.weight,
+                                job.priority) for job in jobs]
+        sections.sort(key=lambda section: -section.priority)
+        return sections
+
+    def _section_settings(self, overrides):
+        """(options, regex, size filter) of a section: the run's, with the
+        job spec entry's options on top"""
+        overrides = overrides or ()
+        if overrides not in self._settings:
+            opts = argparse.Namespace(**vars(self.options))
+            actions = {action.dest: action for action in make_parser()._actions}
+            for name, value in overrides:
+                action = actions[name]
+                # given as on the command line
+                if isinstance(value, str) and callable(action.type):
+                    value = action.type(value)
+                setattr(opts, name, value)
+            normalize_options(opts)
+            self._settings[overrides] = (
+                opts, re.compile(opts.regex) if opts.regex else None,
+                SizeFilter.from_args(opts))
+        return self._settings[overrides]
+
+    def run(self):
+        """Process every section once; generator of DownloadResult"""
+        try:
+            for index, section in enumerate(self.load_sections()):
+                yield from self.iter_section(section, index)
+            yield from self._postprocessed(wait_all=True)
+        finally:
+            self._close()
+
+    async def arun(self):
+        """Async iterator version of run; the blocking work happens in the
+        event loop's default executor"""
+        loop = asyncio.get_running_loop()
+        results = self.run()
+        done = object()
+        while True:
+            result = await loop.run_in_executor(None, next, results, done)
+            if result is done:
+                break
+            yield result
 
-        # load last_id or create new entry for last_id in log_data
-        log_data, last_id = process_subreddit_last_id(ARGS.subreddit, ARGS.sort_type,
-                                                ARGS.dir, log_file, ARGS.dir)
+    def poll_forever(self, on_result=None):
+        """Keep polling the sections (--watch) until stop(), SIGINT or SIGTERM
 
-        if ARGS.restart:
-            last_id = ''
+        :param on_result: callable(DownloadResult)
+        """
+        opts = self.options
+        self._log_cache = {}
 
-        TOTAL[0], DOWNLOADED[0], ERRORS[0], SKIPPED[0], FAILED[0], FILECOUNT = 0, 0, 0, 0, 0, 0
+        def poll(section):
+            results = self.iter_section(section, 'watch')
+            while True:
+                try:
+                    result = next(results)
+                except StopIteration as done:
+                    self._journal_memory()
+                    return done.value
+                if on_result is not None:
+                    on_result(result)
 
-        # ITEMS loop - begin the loop to get reddit submissions & download media from them
-        while not FINISHED:
-            if ARGS.verbose:
-                print()
+        try:
+            watch.Watcher(
+                self.load_sections, poll,
+                watch_file=opts.subreddit_list or None,
+                state_file=pathjoin(self.dir, watch.STATE_FILE),
+                min_interval=opts.watch_min, max_interval=opts.watch_max,
+                stop=self._stop, weight=lambda section: section.weight).run()
+        finally:
+            for result in self._postprocessed(wait_all=True):
+                if on_result is not None:
+                    on_result(result)
+            self._close()
+
+    def _close(self):
+        self.sink.close()
+        if self.catalog is not None:
+            self.catalog.close()
+        for folder_quota in self._quotas.values():
+            folder_quota.close()
+        self._journal_memory()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _journal_memory(self):
+        """Journal the memory gauge (--memory-budget)"""
+        if self.journal is not None and memory.get_budget() is not None:
+            self.journal.write(dict(memory.report(), time=round(time.time(), 3),
+                                    event='memory'))
+
+    def _result(self, status, item, url=None, path=None, reason=None, error=None):
+        """DownloadResult of the submission / url started last; journaled"""
+        self.stats[status] += 1
+        result = DownloadResult(status, item.get('subreddit'), item.get('id'),
+                                url or item.get('url'), path, reason,
+                                error and type(error).__name__,
+                                round(time.time() - self._started, 3))
+        if self.journal is not None:
+            self.journal.record(result)
+        return result
+
+    def _quota(self, folder):
+        """Quota of a download folder"""
+        key = os.path.abspath(folder)
+        if key not in self._quotas:
+            opts = self.options
+            self._quotas[key] = quota.Quota(
+                folder,
+                None if opts.max_dir_size is None else int(opts.max_dir_size * httpcache.MiB),
+                opts.max_files, opts.evict)
+        return self._quotas[key]
+
+    def _check_budget(self):
+        """Stop the run once the budget is used up"""
+        if self.budget is not None and not self._stop.is_set():
+            reason = self.budget.exhausted()
+            if reason:
+                _log.info('    %s, stopping.', reason.capitalize())
+                self.stop()
+
+    def _throttle(self):
+        # measure time and set the program to wait 4 second between request
+        # as per reddit api guidelines (not when replaying a trace)
+        if self._last_request is not None and not trace.replaying():
+            elapsed_time = time.time() - self._last_request
+
+            if elapsed_time <= 4:  # throttling
+                time.sleep(4 - elapsed_time)
+
+        self._last_request = time.time()
+
+    def _load_history(self, subreddit, target_dir, opts):
+        """log_data, last_id of a section"""
+        key = (subreddit, target_dir)
+        if self._log_cache is not None and key in self._log_cache:
+            log_data = self._log_cache[key]
+            history = log_data.setdefault(subreddit, {}).setdefault(opts.sort_type, {})
+            return log_data, history.get('last-id', '')
+        # load last_id or create new entry for last_id in log_data
+        log_data, last_id = process_subreddit_last_id(subreddit, opts.sort_type,
+                                                      target_dir, self.LOG_FILE,
+                                                      opts.verbose)
+        if self._log_cache is not None:
+            self._log_cache[key] = log_data
+        return log_data, last_id
+
+    def _save_position(self, log_data, subreddit, target_dir, last_id, route, opts):
+        """Keep track of the last submission handled, in the section's
+        history and, for combined listings, in that of its subreddit"""
+        log_data[subreddit][opts.sort_type]['last-id'] = last_id
+        history_log(target_dir, self.LOG_FILE, mode='write', write_data=log_data)
+        if route:
+            save_last_id(route[0], opts.sort_type, last_id, route[1],
+                         self.LOG_FILE, self._routed_logs)
+
+    def iter_section(self, section, index=0):
+        """Download the submissions of one section (a Section or a
+        (subreddit, dir, routes) tuple)
+
+        Generator of DownloadResult; its return value is the created_utc of
+        the submissions that were new to it.
+        """
+        subreddit, target_dir, routes = section[:3]
+        opts, re_rule, size_filter = self._section_settings(
+            section[3] if len(section) > 3 else None)
+        sort_type = opts.sort_type.lower() if opts.sort_type else opts.sort_type
+        self._routed_logs = {}
+        finished = False
+
+        if opts.verbose:
+            print ('index: %s, %s, %s' % (index, subreddit, target_dir))
+
+        log_data, last_id = self._load_history(subreddit, target_dir, opts)
+
+        if opts.restart:
+            last_id = ''
 
-            ITEMS = getitems(
-                ARGS.subreddit, multireddit=ARGS.multireddit, previd=last_id,
-                reddit_sort=sort_type)
+        # incremental: walk from the top down to the previous run's mark
+        mark = newest = None
+        mark_complete = True  # whether the run got down to the mark
+        if opts.incremental:
+            mark = log_data[subreddit][opts.sort_type].get('watermark')
+            if not mark and routes:
+                mark = members_watermark(routes, opts.sort_type, self.LOG_FILE,
+                                         self._routed_logs)
+            last_id = ''
 
-            # debug ITEMS variable value
-            # if ARGS.verbose:
-            #    history_log(os.getcwd(), 'ITEMS.txt', 'write', ITEMS)
+        downloaded, filecount = 0, 0
+        new_times = []
 
-            # measure time and set the program to wait 4 second between request
-            # as per reddit api guidelines
-            end_time = time.clock()
+        # backfill: the pages come from time windows of the archive, which
+        # has its own rate budget
+        pages = None
+        if opts.backfill:
+            pages = backfill.backfill(subreddit, *opts.backfill,
+                                      api=opts.backfill_api, rate=opts.backfill_rate)
 
-            if start_time is not None:
-                elapsed_time = end_time - start_time
+        # budget: every page is ranked, what's passed over is checkpointed
+        # and goes first next time
+        scheduled = self.budget is not None
+        pending = budget.load_deferred(target_dir, subreddit) if scheduled else []
+        deferred = []
 
-                if elapsed_time <= 4:  # throttling
-                    time.sleep(4 - elapsed_time)
+        # ITEMS loop - begin the loop to get reddit submissions & download media from them
+        while not finished:
+            self._check_budget()
+            if self._stop.is_set():
+                mark_complete = False
+                break
 
-            start_time = time.clock()
+            if pages is not None:
+                try:
+                    ITEMS = next(pages, [])
+                except backfill.BackfillError as exc:
+                    _log.error('%s: %s', subreddit, exc)
+                    mark_complete = False
+                    ITEMS = []
+            else:
+                ITEMS = getitems(
+                    subreddit, multireddit=opts.multireddit, previd=last_id,
+                    reddit_sort=sort_type)
+                self._throttle()
 
             # No more items to process
-            if not ITEMS:
-                if ARGS.verbose:
-                    print('No more ITEMS for %s %s' %
-                            (ARGS.subreddit, ARGS.sort_type))
+            if not ITEMS and not pending:
+                if opts.verbose:
+                    _log.info('No more ITEMS for %s %s', subreddit, opts.sort_type)
                 break
 
+            first, sizes, page_last = (), {}, None
+            if scheduled:
+                # the page is the look-ahead window, best submissions first
+                page_last = ITEMS[-1] if ITEMS else None
+                first = {item['id'] for item in pending}
+                window = pending + [item for item in ITEMS if item['id'] not in first]
+                pending = []
+                if opts.byte_budget is not None or opts.budget_rank == 'density':
+                    sizes = budget.estimate_sizes(window)
+                ITEMS = budget.rank(window, sizes, opts.budget_rank, first)
+            handled = set()
+            reached_mark = False
+
+            page_new = 0
             for ITEM in ITEMS:
-                TOTAL[0] += 1
-
-                # not downloading if url is reddit comment
-                if ('reddit.com/r/' + ARGS.subreddit + '/comments/' in ITEM['url'] or
-                        re.match(reddit_comment_regex, ITEM['url']) is not None):
-                    # hotfix for when last item is comment submission which caused infinite looping
-                    last_id = ITEM['id'] if ITEM is not None else None
-                    if last_id:
-                        log_data[ARGS.subreddit][ARGS.sort_type]['last-id'] = last_id
-                        history_log(ARGS.dir, log_file, mode='write', write_data=log_data)
-                    continue
-
-                # don't download if url is reddit metrics url
-                if 'redditmetrics.com' in ITEM['url']:
-                    if ARGS.verbose:
-                        print('\t%s was skipped.' % ITEM['url'])
-
-                    SKIPPED[0] += 1
-                    continue
-
-                if ITEM['score'] < ARGS.score:
-                    if ARGS.verbose:
-                        print('    SCORE: {} has score of {}'.format(ITEM['id'], ITEM['score']))
-                        'which is lower than required score of {}.'.format(ARGS.score)
-
-                    SKIPPED[0] += 1
-                    continue
-                elif ARGS.sfw and ITEM['over_18']:
-                    if ARGS.verbose:
-                        print('    NSFW: %s is marked as NSFW.' % (ITEM['id']))
-
-                    SKIPPED[0] += 1
-                    continue
-                elif ARGS.nsfw and not ITEM['over_18']:
-                    if ARGS.verbose:
-                        print('    Not NSFW, skipping %s' % (ITEM['id']))
-
-                    SKIPPED[0] += 1
-                    continue
-                elif ARGS.regex and not re.match(RE_RULE, ITEM['title']):
-                    if ARGS.verbose:
-                        print('    Regex match failed')
-
-                    SKIPPED[0] += 1
+                self._check_budget()
+                if self._stop.is_set():
+                    finished = True
+                    mark_complete = False
+                    break
+                handled.add(ITEM['id'])
+                self.stats['processed'] += 1
+                self._started = time.time()
+
+                # combined listing: the item goes to its own subreddit's folder
+                item_dir, route = target_dir, None
+                if routes:
+                    route = routes.get((ITEM.get('subreddit') or '').lower())
+                    if route:
+                        item_dir = route[1]
+
+                if opts.incremental:
+                    newest = watermark.newer(newest, watermark.item_mark(ITEM))
+                    if watermark.is_seen(ITEM, mark) and ITEM['id'] not in first:
+                        if watermark.is_time_ordered(sort_type):
+                            # everything from here on is older
+                            if opts.verbose:
+                                _log.info('    Reached watermark at %s', ITEM['id'])
+                            if not scheduled:
+                                finished = True
+                                break
+                            # (ranked: the rest of the page may be newer)
+                            reached_mark = True
+                        last_id = ITEM['id']
+                        yield self._result(DownloadResult.SKIPPED, ITEM,
+                                           reason='seen by a previous run')
+                        continue
+                    page_new += 1
+                new_times.append(float(ITEM.get('created_utc') or 0))
+
+                reason = self._skip_reason(ITEM, subreddit, opts, re_rule)
+                if reason is not None:
+                    if not reason:
+                        # reddit comment: hotfix for when last item is comment
+                        # submission which caused infinite looping
+                        last_id = ITEM['id']
+                        # (backfill posts are not a listing position to resume from)
+                        if pages is None and not scheduled:
+                            self._save_position(log_data, subreddit, target_dir,
+                                                last_id, route, opts)
+                        continue
+                    yield self._result(DownloadResult.SKIPPED, ITEM, reason=reason)
                     continue
-                elif ARGS.skipAlbums and 'imgur.com/a/' in ITEM['url']:
-                    if ARGS.verbose:
-                        print('    Album found, skipping %s' % (ITEM['id']))
 
-                    SKIPPED[0] += 1
+                if self.quota_enabled and self._quota(item_dir).was_evicted(ITEM['id']):
+                    yield self._result(DownloadResult.SKIPPED, ITEM,
+                                       reason='QUOTA: %s was evicted before' % ITEM['id'])
                     continue
 
-                if ARGS.title_contain and ARGS.title_contain.lower() not in ITEM['title'].lower():
-                    if ARGS.verbose:
-                        print('    Title not contain "{}",'.format(ARGS.title_contain))
-                        'skipping {}'.format(ITEM['id'])
-
-                    SKIPPED[0] += 1
+                # doesn't fit in what's left: maybe a smaller one does
+                if scheduled and not self.budget.fits(sizes.get(ITEM['id'])):
+                    deferred.append(ITEM)
+                    yield self._result(DownloadResult.SKIPPED, ITEM,
+                                       reason='BUDGET: %s deferred (~%i bytes, %i left)' % (
+                                           ITEM['id'], sizes[ITEM['id']],
+                                           self.budget.bytes_left))
                     continue
 
                 try:
                     URLS = extract_urls(ITEM['url'])
                 except URLError as e:
-                    print('URLError %s' % e)
+                    yield self._result(DownloadResult.FAILED, ITEM,
+                                       reason='URLError %s' % e, error=e)
                     continue
                 except Exception as e:
                     _log.exception("%s", e)
+                    yield self._result(DownloadResult.FAILED, ITEM, reason=repr(e), error=e)
                     continue
+
+                # the preview describes the linked image, reject it without
+                # fetching a single byte of it
+                if size_filter and isinstance(URLS, list) and len(URLS) == 1:
+                    reason = size_filter.check(preview_source_size(ITEM))
+                    if reason:
+                        yield self._result(DownloadResult.SKIPPED, ITEM,
+                                           reason='SIZE: %s' % reason)
+                        continue
+
+                # prefer a smaller rendition that still covers the target size
+                if opts.max_resolution and isinstance(URLS, list) and len(URLS) == 1:
+                    URLS = [pick_rendition(URLS[0], ITEM, opts.max_resolution)]
+
                 for URL in URLS:
+                    FILEPATH = None
+                    self._started = time.time()
                     try:
                         # Find gfycat if requested
-                        if URL.endswith('gif') and ARGS.mirror_gfycat:
+                        if URL.endswith('gif') and opts.mirror_gfycat:
                             check = gfycat().check(URL)
                             if check.get("urlKnown"):
                                 URL = check.get('webmUrl')
@@ -589,12 +1200,12 @@ def main(args=None):
                             FILEEXT = FILEEXT[:FILEEXT.index('?')]
 
                         # Only append numbers if more than one file
-                        FILENUM = ('_%d' % FILECOUNT if len(URLS) > 1 else '')
+                        FILENUM = ('_%d' % filecount if len(URLS) > 1 else '')
 
                         # create filename based on given input from user
-                        if ARGS.filename_format == 'url':
+                        if opts.filename_format == 'url':
                             FILENAME = '%s%s%s' % (pathsplitext(pathbasename(URL))[0], '', FILEEXT)
-                        elif ARGS.filename_format == 'title':
+                        elif opts.filename_format == 'title':
                             FILENAME = '%s%s%s' % (slugify(ITEM['title']), FILENUM, FILEEXT)
 
                             if len(FILENAME) >= 256:
@@ -604,7 +1215,7 @@ def main(args=None):
                             FILENAME = '%s%s%s' % (ITEM['id'], FILENUM, FILEEXT)
 
                         # join file with directory
-                        FILEPATH = pathjoin(ARGS.dir, FILENAME)
+                        FILEPATH = pathjoin(item_dir, FILENAME)
 
                         # Improve debuggability list URL before download too.
                         # url may be wrong so skip that
@@ -613,77 +1224,261 @@ def main(args=None):
 
                         # Download the image
                         try:
-                            dl = skp = 0
+                            skp = 0
+                            if self.postprocessor is not None:
+                                converted = self.postprocessor.converted(
+                                    self.sink.locate(FILEPATH))
+                                if converted:
+                                    raise FileExistsException('%s already downloaded as %s.' % (
+                                        FILENAME, pathbasename(converted)))
                             if 'imgur.com' in URL:
                                 fname = os.path.splitext(FILENAME)[0]
-                                save_path=os.path.join(os.getcwd(), ARGS.dir)
-                                downloader=ImgurDownloader(URL,
-                                                            save_path,
-                                                            fname,
-                                                            delete_dne=True,
-                                                            debug=False)
-                                (dl, skp) = downloader.save_images()
+                                save_path = os.path.join(os.getcwd(), item_dir)
+                                downloader = ImgurDownloader(URL,
+                                                             save_path,
+                                                             fname,
+                                                             delete_dne=True,
+                                                             debug=False,
+                                                             size_filter=size_filter,
+                                                             sink=self.sink)
+                                (_, skp) = downloader.save_images()
+                                saved = downloader.saved
                             else:
-                                download_from_url(URL, FILEPATH)
-                                dl = 1
+                                size, sha1 = download_from_url(
+                                    URL, FILEPATH, size_filter=size_filter, sink=self.sink)
+                                saved = [(URL, FILEPATH, size, sha1)]
                             # Image downloaded successfully!
-                            if ARGS.verbose:
-                                print('Saved %s as %s' % (URL, FILENAME))
-                            DOWNLOADED[0] += 1
-                            SKIPPED[0] += skp
-                            FILECOUNT += 1
-
-                        except FileExistsException as ERROR:
-                            ERRORS[0] += 1
-                            if ARGS.verbose:
-                                print(ERROR.message)
-                            if ARGS.update:
-                                print('    Update complete, exiting.')
-                                FINISHED = True
+                            downloaded += 1
+                            filecount += 1
+                            # images of an album that were skipped
+                            self.stats[DownloadResult.SKIPPED] += skp
+                            if self.budget is not None:
+                                self.budget.spend(sum(size or 0 for _, _, size, _ in saved))
+                            if self.catalog is not None:
+                                self.catalog.add_submission(ITEM)
+                                for file_url, file_path, size, sha1 in saved:
+                                    self.catalog.add_file(ITEM['id'], file_url,
+                                                          self.sink.locate(file_path),
+                                                          size, sha1)
+                            yield self._result(DownloadResult.DOWNLOADED, ITEM, URL,
+                                               self.sink.locate(FILEPATH))
+                            if self.quota_enabled:
+                                yield from self._enforce_quota(item_dir, ITEM, saved)
+                            if self.postprocessor is not None:
+                                for file_url, file_path, _, _ in saved:
+                                    self.postprocessor.submit(
+                                        self.sink.locate(file_path), id=ITEM['id'],
+                                        subreddit=ITEM.get('subreddit'), url=file_url,
+                                        folder=item_dir)
+
+                        except FileExistsException as exc:
+                            yield self._result(DownloadResult.EXISTS, ITEM, URL, FILEPATH,
+                                               exc.message)
+                            if opts.update:
+                                _log.info('    Update complete, exiting.')
+                                finished = True
                                 break
-                        except ImgurException as e:
-                            ERRORS[0] += 1
-                        except Exception as e:
-                            print (e)
-                            ERRORS[0] += 1
-
-                        if ARGS.num and (DOWNLOADED[0]) >= ARGS.num:
-                            print('    Download num limit reached, exiting.')
-                            FINISHED = True
+                        except ImageSizeException as exc:
+                            yield self._result(DownloadResult.SKIPPED, ITEM, URL,
+                                               reason='SIZE: %s' % exc, error=exc)
+                        except Exception as exc:  # ImgurException & co
+                            yield self._result(DownloadResult.ERROR, ITEM, URL, FILEPATH,
+                                               str(exc), error=exc)
+
+                        if opts.num and downloaded >= opts.num:
+                            _log.info('    Download num limit reached, exiting.')
+                            finished = True
+                            # older new posts are left unseen: keep the old mark
+                            mark_complete = False
                             break
 
-                    except WrongFileTypeException as ERROR:
-                        _log_wrongtype(url=URL, target_dir=ARGS.dir,
-                                       filecount=FILECOUNT, _downloaded=DOWNLOADED[0],
-                                       filename=FILENAME)
-                        SKIPPED[0] += 1
-                    except HTTPError as ERROR:
-                        FAILED[0] += 1
-                    except URLError as ERROR:
-                        FAILED[0] += 1
-                    except InvalidURL as ERROR:
-                        FAILED[0] += 1
-                    except Exception as exc:
-                        FAILED[0] += 1
+                    except WrongFileTypeException as exc:
+                        # the path tells scrap_wrongies where the page belongs
+                        yield self._result(DownloadResult.SKIPPED, ITEM, URL, FILEPATH,
+                                           reason=str(exc), error=exc)
+                    except Exception as exc:  # HTTPError, URLError, InvalidURL...
+                        yield self._result(DownloadResult.FAILED, ITEM, URL,
+                                           reason=repr(exc), error=exc)
+
+                if self.postprocessor is not None:
+                    yield from self._postprocessed()
 
                 # keep track of last_id id downloaded
-                last_id = ITEM['id'] if ITEM is not None else None
-                if last_id:
-                    log_data[ARGS.subreddit][ARGS.sort_type]['last-id'] = last_id
-                    history_log(ARGS.dir, log_file, mode='write', write_data=log_data)
+                last_id = ITEM['id']
+                if pages is None and not scheduled:
+                    self._save_position(log_data, subreddit, target_dir, last_id, route, opts)
 
                 # break out of URL loop to end of ITEMS loop
-                if FINISHED:
+                if finished:
                     break
 
-            # update variables in PROG_REPORT in SUBREDDIT loop
-            for var in PROG_REPORT:
-                var[1] += var[0]
+            if scheduled:
+                # checkpoint what wasn't handled, then move past the page
+                deferred.extend(item for item in ITEMS if item['id'] not in handled)
+                budget.save_deferred(target_dir, subreddit, deferred)
+                if reached_mark:
+                    finished = True
+                if page_last is not None:
+                    last_id = page_last['id']
+                    if pages is None:
+                        route = None
+                        if routes:
+                            route = routes.get((page_last.get('subreddit') or '').lower())
+                        self._save_position(log_data, subreddit, target_dir, last_id, route, opts)
+
+            # not time-ordered (hot, top...): a page with nothing new means
+            # the rest is old as well
+            if opts.incremental and mark and not page_new:
+                finished = True
+
+        # advance the watermark only once everything above it was handled
+        if opts.incremental and mark_complete and newest:
+            mark = watermark.newer(mark, newest)
+            log_data[subreddit][opts.sort_type]['watermark'] = mark
+            history_log(target_dir, self.LOG_FILE, mode='write', write_data=log_data)
+            # (all of the listing above it was handled, so for each of its subreddits)
+            for route in (routes or {}).values():
+                save_routed(route[0], opts.sort_type, route[1], self.LOG_FILE,
+                            self._routed_logs, watermark=mark)
+
+        if self.catalog is not None:
+            self.catalog.flush()
+        return new_times
+
+    def _enforce_quota(self, folder, item, saved):
+        """Add the files just saved to the folder's quota; DownloadResult
+        of the files evicted to make room"""
+        folder_quota = self._quota(folder)
+        for _, path, size, _ in saved:
+            evicted = folder_quota.add(self.sink.locate(path), size, item['id'])
+            if evicted and self.catalog is not None:
+                self.catalog.remove_files([evicted_path for evicted_path, _ in evicted])
+            for evicted_path, evicted_id in evicted:
+                yield self._result(DownloadResult.EVICTED,
+                                   dict(subreddit=item.get('subreddit'), id=evicted_id),
+                                   path=evicted_path)
+
+    def _postprocessed(self, wait_all=False):
+        """DownloadResult of the files done post-processing (all of them
+        with `wait_all`); the quota and catalog follow the new files"""
+        if self.postprocessor is None:
+            return
+        for record in self.postprocessor.done(wait_all):
+            if record['error']:
+                _log.warning('Post-processing %s failed: %s', record['path'], record['error'])
+                continue
+            if not record['actions']:
+                continue
+            if self.quota_enabled:
+                self._quota(record['folder']).update(record['path'], record['new_path'],
+                                                     record['new_size'])
+            if self.catalog is not None:
+                self.catalog.remove_files([record['path']])
+                self.catalog.add_file(record['id'], record['url'], record['new_path'],
+                                      record['new_size'], record['sha1'])
+            yield self._result(
+                DownloadResult.TRANSCODED, record, record['url'], record['new_path'],
+                '%s: %i -> %i bytes (%i%%)' % (', '.join(record['actions']), record['size'],
+                                               record['new_size'], record['ratio'] * 100))
+
+    def _skip_reason(self, ITEM, subreddit, opts, re_rule):
+        """Why the submission is filtered out; '' for reddit comment links
+        (skipped silently), None if it should be downloaded"""
+
+        # not downloading if url is reddit comment
+        if ('reddit.com/r/' + subreddit + '/comments/' in ITEM['url'] or
+                re.match(reddit_comment_regex, ITEM['url']) is not None):
+            return ''
+
+        # don't download if url is reddit metrics url
+        if 'redditmetrics.com' in ITEM['url']:
+            return '%s was skipped.' % ITEM['url']
+
+        if ITEM['score'] < opts.score:
+            return ('SCORE: {} has score of {} which is lower than required score of {}.'
+                    .format(ITEM['id'], ITEM['score'], opts.score))
+        elif opts.sfw and ITEM['over_18']:
+            return 'NSFW: %s is marked as NSFW.' % (ITEM['id'])
+        elif opts.nsfw and not ITEM['over_18']:
+            return 'Not NSFW, skipping %s' % (ITEM['id'])
+        elif opts.regex and not re.match(re_rule, ITEM['title']):
+            return 'Regex match failed'
+        elif opts.skipAlbums and 'imgur.com/a/' in ITEM['url']:
+            return 'Album found, skipping %s' % (ITEM['id'])
+
+        if opts.title_contain and opts.title_contain.lower() not in ITEM['title'].lower():
+            return 'Title not contain "{}", skipping {}'.format(opts.title_contain, ITEM['id'])
+        return None
+
+
+def format_result(result, verbose=False):
+    """Console line of a DownloadResult, None if it isn't shown"""
+    if result.status == DownloadResult.DOWNLOADED:
+        if verbose:
+            return 'Saved %s as %s' % (result.url, pathbasename(result.path))
+    elif result.status == DownloadResult.EVICTED:
+        if verbose:
+            return '    Evicted %s' % pathbasename(result.path)
+    elif result.status == DownloadResult.TRANSCODED:
+        if verbose:
+            return '    Transcoded %s, %s' % (pathbasename(result.path), result.reason)
+    elif result.status == DownloadResult.ERROR:
+        return result.reason
+    elif verbose and result.reason:
+        return '    %s' % result.reason
+    return None
 
-    print('Downloaded from %i reddit submissions' % (DOWNLOADED[1]))
-    print('(Processed %i, Skipped %i, Errors %i)' % (TOTAL[1], SKIPPED[1], ERRORS[1]))
 
-    return DOWNLOADED[1]
+def main(args=None):
+    args = args if len(args)>0 else sys.argv[1:]
+    if args[:1] == ['query']:
+        return catalog.main(args[1:])
+    ARGS = parse_args(args)
+
+    logging.basicConfig(level=logging.WARNING if ARGS.quiet else logging.INFO)
+
+    if ARGS.cache_dir:
+        httpcache.configure(ARGS.cache_dir, ARGS.cache_size * httpcache.MiB)
+    if ARGS.html_parser:
+        htmlparse.set_backend(ARGS.html_parser)
+    cpupool.configure(ARGS.cpu_workers)
+    segmented.configure(ARGS.segment_min_size * httpcache.MiB, ARGS.segments)
+    if ARGS.memory_budget is not None:
+        memory.configure(int(ARGS.memory_budget * httpcache.MiB))
+    if ARGS.record_trace or ARGS.replay_trace:
+        trace.configure(ARGS.record_trace, ARGS.replay_trace, ARGS.replay_latency,
+                        ARGS.trace_bodies)
+
+    options = {name: value for name, value in vars(ARGS).items()
+               if name not in ('subreddit', 'dir')}
+    GRAB = RedditImageGrab(ARGS.subreddit, ARGS.dir, **options)
+
+    console = journal.Console(lambda result: format_result(result, ARGS.verbose),
+                              rate=ARGS.console_rate)
+    try:
+        if ARGS.watch:
+            GRAB.poll_forever(console)
+        else:
+            for result in GRAB.run():
+                console(result)
+    except (RedditAPIException, ValueError) as exc:
+        # API errors, misused options (e.g. --multireddit), bad job specs
+        sys.exit(str(exc))
+    finally:
+        console.summarize()
+        trace.close()
+
+    STATS = GRAB.stats
+    if ARGS.quiet:
+        return STATS[DownloadResult.DOWNLOADED]
+    print('Downloaded from %i reddit submissions' % (STATS[DownloadResult.DOWNLOADED]))
+    print('(Processed %i, Skipped %i, Errors %i)' % (
+        STATS['processed'], STATS[DownloadResult.SKIPPED],
+        STATS[DownloadResult.ERROR] + STATS[DownloadResult.EXISTS]))
+    if ARGS.memory_budget is not None:
+        print(memory.format_report(memory.report()))
+
+    return STATS[DownloadResult.DOWNLOADED]
 
 
 if __name__ == "__main__":
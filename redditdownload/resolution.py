@@ -0,0 +1,129 @@
+"""Pick the smallest image rendition that still covers a target resolution.
+
+Reddit listings carry downscaled copies of the linked image in
+``preview.images[].resolutions`` and imgur serves size-suffixed thumbnails
+(``<hash>h.jpg`` and friends), so for wallpaper-sized targets there is usually
+no need to fetch a multi-megabyte original.
+"""
+
+import re
+from html import unescape
+
+
+# imgur thumbnail suffixes with the bounding box (in px) they fit into.
+IMGUR_SIZE_SUFFIXES = (('m', 320), ('l', 640), ('h', 1024))
+
+_imgur_direct_re = re.compile(
+    r'^(?P<base>https?://i\.imgur\.com/)(?P<hash>[a-zA-Z0-9]{5,7})'
+    r'\.(?P<ext>jpe?g|png)(?:\?.*)?$')
+_animated_exts = ('.gif', '.gifv', '.mp4', '.webm')
+_image_exts = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def parse_resolution(value):
+    """Parse a ``WxH`` string (e.g. ``1920x1080``) into a (width, height) tuple
+
+    :raises ValueError: on malformed input
+    """
+    match = re.match(r'^\s*(\d+)\s*[xX*]\s*(\d+)\s*$', value or '')
+    if not match:
+        raise ValueError('resolution must look like WIDTHxHEIGHT, got %r' % value)
+    width, height = int(match.group(1)), int(match.group(2))
+    if not width or not height:
+        raise ValueError('resolution must be non-zero, got %r' % value)
+    return width, height
+
+
+def covers(size, target):
+    """True if an image of `size` is at least as large as `target` on both axes"""
+    return size[0] >= target[0] and size[1] >= target[1]
+
+
+def preview_source_size(item):
+    """Return (width, height) of the original image according to the
+    reddit listing preview, or None when the item has no usable preview.
+    """
+    try:
+        source = item['preview']['images'][0]['source']
+        return int(source['width']), int(source['height'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def preview_candidates(item):
+    """Yield (width, height, url) for every downscaled preview rendition"""
+    try:
+        resolutions = item['preview']['images'][0]['resolutions']
+    except (KeyError, IndexError, TypeError):
+        return
+    for res in resolutions or ():
+        try:
+            yield int(res['width']), int(res['height']), unescape(res['url'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+def imgur_candidates(url, source_size):
+    """Yield (width, height, url) for the size-suffixed imgur renditions of
+    a direct i.imgur.com image link.
+
+    The thumbnails keep the aspect ratio and fit into a square box, so their
+    dimensions can be derived from the size of the original.
+    """
+    match = _imgur_direct_re.match(url)
+    if not match or not source_size:
+        return
+    width, height = source_size
+    for suffix, bound in IMGUR_SIZE_SUFFIXES:
+        scale = min(1.0, float(bound) / width, float(bound) / height)
+        if scale >= 1.0:
+            # imgur does not upscale; the original is as good as it gets
+            break
+        yield (int(round(width * scale)), int(round(height * scale)),
+               '%s%s%s.jpg' % (match.group('base'), match.group('hash'), suffix))
+
+
+def is_animated(url, item=None):
+    """Previews of gifs and videos are still frames, never use them"""
+    path = url.split('?', 1)[0].lower()
+    if path.endswith(_animated_exts):
+        return True
+    if item is not None and item.get('is_video'):
+        return True
+    return False
+
+
+def is_image(url, item=None):
+    """Whether `url` is a still image the previews are renditions of: a
+    direct image link or an item reddit hints as one (not a video page,
+    an article with a thumbnail...)"""
+    path = url.split('?', 1)[0].lower()
+    if path.endswith(_image_exts):
+        return True
+    return item is not None and item.get('post_hint') == 'image'
+
+
+def pick_rendition(url, item, target):
+    """Return the url of the smallest rendition of `url` that covers `target`
+
+    Falls back to `url` itself when it isn't a still image, when the
+    original size is unknown, when the original is not larger than the
+    target or when no rendition is big enough.
+
+    :param url: url of the original image
+    :param item: reddit listing item the url was extracted from
+    :param target: (width, height) tuple, e.g. from :func:`parse_resolution`
+    """
+    if not target or is_animated(url, item) or not is_image(url, item):
+        return url
+    source_size = preview_source_size(item)
+    if source_size is None or not covers(source_size, target):
+        return url
+
+    candidates = [
+        cand for cand in list(preview_candidates(item)) +
+        list(imgur_candidates(url, source_size))
+        if covers(cand, target) and cand[:2] != source_size]
+    if not candidates:
+        return url
+    return min(candidates, key=lambda cand: cand[0] * cand[1])[2]
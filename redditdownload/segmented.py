@@ -0,0 +1,200 @@
+"""Segmented (multi-connection) downloads of large files.
+
+A single CDN connection often caps throughput well below the link speed,
+so for files of at least :data:`MIN_SIZE` bytes whose server advertises
+``Accept-Ranges: bytes`` the transfer is split into N range requests run
+concurrently. Each segment is written at its offset of a preallocated
+``.part`` file with ``os.pwrite``, is retried (resuming where it stopped,
+after a growing pause) on its own, and the result is checked against
+Content-Length before being renamed into place.
+
+Every range request carries ``If-Range`` with the ETag (or Last-Modified)
+of the first response, so pieces of different versions of a file that
+changed meanwhile are never stitched together: the server answers with
+the whole new file instead, which is a :class:`FileChanged`. Files without
+either validator aren't segmented.
+
+A :class:`SegmentError` (e.g. a server that advertises ranges but answers
+them with the whole file) stops the other segments; callers then fall
+back to a plain streaming download.
+"""
+
+import os
+import time
+import logging
+import threading
+from urllib.request import urlopen, Request
+from concurrent.futures import ThreadPoolExecutor
+
+from .httpcache import MiB
+from . import memory
+
+
+_log = logging.getLogger(__name__)
+
+MIN_SIZE = 32 * MiB
+SEGMENTS = 4
+RETRIES = 4
+# Pause before the second try of a segment (seconds), doubled for each next one.
+BACKOFF = 0.5
+CHUNK_SIZE = 256 * 1024
+
+_min_size = MIN_SIZE
+_segments = SEGMENTS
+
+
+class SegmentError(IOError):
+    pass
+
+
+class RangeIgnored(SegmentError):
+    """The server answered a range request with something else than 206"""
+
+
+class FileChanged(SegmentError):
+    """The file isn't the one the first response was about anymore"""
+
+
+def configure(min_size=MIN_SIZE, segments=SEGMENTS):
+    """Segment files of at least `min_size` bytes into `segments` parts;
+    1 segment disables it"""
+    global _min_size, _segments
+    _min_size = min_size
+    _segments = max(1, int(segments))
+
+
+def should_segment(headers):
+    """Content-Length if `headers` (a response's info()) allow a segmented
+    download of a large enough file, else None"""
+    if _segments < 2:
+        return None
+    if 'bytes' not in (headers.get('accept-ranges') or '').lower():
+        return None
+    if validator(headers) is None:
+        return None  # a change couldn't be told
+    try:
+        size = int(headers.get('content-length'))
+    except (TypeError, ValueError):
+        return None
+    return size if size >= _min_size else None
+
+
+def validator(headers):
+    """If-Range value of a response's headers: its strong ETag, else its
+    Last-Modified, else None
+
+    >>> validator({'etag': 'W/"weak"', 'last-modified': 'Mon, 19 Oct 2026 09:00:00 GMT'})
+    'Mon, 19 Oct 2026 09:00:00 GMT'
+    """
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):  # (If-Range takes strong ones only)
+        return etag
+    return headers.get('last-modified') or None
+
+
+def split(start, size, parts):
+    """[start, size) into `parts` (first, last) inclusive byte ranges
+
+    >>> split(0, 10, 3)
+    [(0, 2), (3, 5), (6, 9)]
+    """
+    length = size - start
+    parts = max(1, min(parts, length))
+    step = length // parts
+    edges = [start + step * i for i in range(parts)] + [size]
+    return [(a, b - 1) for a, b in zip(edges[:-1], edges[1:])]
+
+
+if hasattr(os, 'pwrite'):
+    def _pwrite(fd, data, offset, lock):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data, offset = data[written:], offset + written
+else:  # windows
+    def _pwrite(fd, data, offset, lock):
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+def _fetch_segment(url, fd, first, last, headers, lock, abort, retries=RETRIES,
+                   backoff=BACKOFF):
+    """Write bytes first..last of `url` at their offsets; returns the count
+
+    :param headers: request headers, with If-Range if the file is validated
+    :param abort: threading.Event set when another segment failed
+    """
+    offset = first
+    for attempt in range(retries):
+        if attempt and abort.wait(backoff * 2 ** (attempt - 1)):
+            break
+        if abort.is_set():
+            break
+        req = Request(url, headers=dict(headers, Range='bytes=%d-%d' % (offset, last)))
+        try:
+            with urlopen(req) as response:
+                if response.getcode() != 206:
+                    if response.getcode() == 200 and 'If-Range' in headers:
+                        raise FileChanged('%s: changed during the download' % url)
+                    raise RangeIgnored('%s: no partial content (HTTP %s)'
+                                       % (url, response.getcode()))
+                while offset <= last and not abort.is_set():
+                    with memory.reserve(CHUNK_SIZE):
+                        chunk = response.read(min(CHUNK_SIZE, last + 1 - offset))
+                        if not chunk:
+                            break
+                        _pwrite(fd, chunk, offset, lock)
+                        offset += len(chunk)
+                        del chunk
+        except SegmentError:
+            raise
+        except Exception as exc:
+            _log.debug("Segment %d-%d of %s: try %d failed at %d: %r",
+                       first, last, url, attempt, offset, exc)
+        if offset > last:
+            return offset - first
+    raise SegmentError('%s: segment %d-%d failed at %d' % (url, first, last, offset))
+
+
+def download(url, dest_file, size, head=b'', segments=None, headers=None,
+             validator=None):
+    """Download `url` of `size` bytes into `dest_file` in parallel segments
+
+    :param head: bytes already read from the start of the file
+    :param headers: extra request headers
+    :param validator: :func:`validator` of the first response, None when
+        the file can't be told apart from a changed one
+    """
+    segments = segments or _segments
+    headers = dict(headers or {})
+    if validator:
+        headers['If-Range'] = validator
+    part_file = dest_file + '.part'
+    lock = threading.Lock()
+    abort = threading.Event()
+    fd = os.open(part_file, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        if head:
+            _pwrite(fd, head, 0, lock)
+        ranges = split(len(head), size, segments)
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(_fetch_segment, url, fd, first, last, headers, lock, abort)
+                       for first, last in ranges]
+            try:
+                received = len(head) + sum(future.result() for future in futures)
+            except BaseException:
+                abort.set()
+                raise
+        if received != size or os.fstat(fd).st_size != size:
+            raise SegmentError('%s: got %d of %d bytes' % (url, received, size))
+    except BaseException:
+        os.close(fd)
+        os.remove(part_file)
+        raise
+    os.close(fd)
+    os.replace(part_file, dest_file)
+    return size
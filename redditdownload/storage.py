@@ -0,0 +1,377 @@
+"""Storage sinks: where downloaded files are written.
+
+* :class:`DirectorySink` -- one file per download (the default)
+* :class:`TarShardSink` -- files are appended to rolling tar shards
+  (``shard-000000.tar``, ``shard-000001.tar``, ... of about `shard_size`
+  bytes each, WebDataset style), which keeps the inode count and backup
+  time of huge collections down. Every shard has a sidecar index
+  (``shard-000000.tar.idx``, JSON lines) of its members' data offsets, so
+  existence checks (``--update``) and reads are O(1) without scanning the
+  archives; a lost index is rebuilt from the tar headers.
+
+Writers stream: the tar header is written with a placeholder size and
+fixed up when the member is complete, so nothing is buffered in memory.
+
+Usage::
+
+    storage.configure('tar', '/archive/pics')
+    sink = storage.get_sink()
+    with sink.open_write('/archive/pics/wallpapers/abc123.jpg') as f:
+        shutil.copyfileobj(response, f)
+"""
+
+import io
+import os
+import json
+import glob
+import hashlib
+import shutil
+import tarfile
+import threading
+import time
+
+from .httpcache import MiB
+from .fanout import fanout_path
+
+
+SHARD_SIZE = 1024 * MiB
+_BLOCK = tarfile.BLOCKSIZE
+
+_default_sink = None
+
+
+class _Writer(object):
+    """File-like object of a write in progress; `discard()` drops it
+    instead of keeping it when the `with` block ends. Keeps the size and
+    sha1 of what was written."""
+
+    def __init__(self, fileobj):
+        self._fo = fileobj
+        self.size = 0
+        self.sha1 = hashlib.sha1()
+        self.discarded = False
+
+    def write(self, data):
+        self._fo.write(data)
+        self.size += len(data)
+        self.sha1.update(data)
+        return len(data)
+
+    def discard(self):
+        self.discarded = True
+
+
+class DirectorySink(object):
+    """Plain files at their destination paths, or `fanout` levels of hashed
+    subdirectories below them (see fanout.py)"""
+
+    def __init__(self, fanout=0):
+        self.fanout = fanout
+        self._made = set()  # folders known to exist
+
+    def locate(self, path):
+        """Actual location of destination `path`"""
+        return fanout_path(path, self.fanout)
+
+    def exists(self, path):
+        # the flat path too: folders that weren't migrated (yet)
+        return (os.path.exists(self.locate(path)) or
+                bool(self.fanout) and os.path.exists(path))
+
+    def makedirs(self, path):
+        if path and path not in self._made:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._made.add(path)
+
+    def _prepare(self, path):
+        # folders are made by their first file
+        path = self.locate(path)
+        self.makedirs(os.path.dirname(path))
+        return path
+
+    def open_write(self, path):
+        return _DirectoryWrite(self._prepare(path))
+
+    def put_file(self, path, src_path):
+        """Store the complete file `src_path` (which is consumed) as `path`;
+        returns its (size, sha1 hexdigest)"""
+        digest = _file_digest(src_path)
+        os.replace(src_path, self._prepare(path))
+        return digest
+
+    def temp_path(self, path):
+        """Where to assemble a download of `path` before put_file"""
+        self.makedirs(os.path.dirname(path))
+        return path + '.tmp'
+
+    def open_read(self, path):
+        return open(self.locate(path), 'rb')
+
+    def close(self):
+        pass
+
+
+class _DirectoryWrite(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._fo = open(self.path, 'wb')
+        self.writer = _Writer(self._fo)
+        return self.writer
+
+    def __exit__(self, exc_type, *ar):
+        self._fo.close()
+        if exc_type is not None or self.writer.discarded:
+            os.remove(self.path)
+
+
+class TarShardSink(object):
+    """Members are named by their path relative to `root`; shards and
+    indexes live in `root`
+
+    Only one member is written at a time (writes are serialized).
+    """
+
+    def __init__(self, root, shard_size=SHARD_SIZE):
+        self.root = os.path.abspath(root)
+        self.shard_size = shard_size
+        self._lock = threading.RLock()
+        self._index = {}  # member name -> (shard path, data offset, size)
+        self._shard = None  # path of the shard being appended to
+        self._fo = None
+        self._idx_fo = None
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        shards = sorted(glob.glob(os.path.join(self.root, 'shard-*.tar')))
+        for shard in shards:
+            self._load_index(shard)
+        self._end = 0
+        if shards:
+            self._open_shard(shards[-1])
+
+    def _load_index(self, shard):
+        """Index the members of `shard`; returns the end of the last one.
+        A missing (or empty) index of a shard with data is rebuilt from the
+        tar headers; an unreadable one is an error, never data to drop"""
+        end = 0
+        entries = 0
+        try:
+            with open(shard + '.idx') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    self._index[entry['name']] = (shard, entry['offset'], entry['size'])
+                    end = max(end, entry['offset'] + _padded(entry['size']))
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        if not entries and os.path.exists(shard) and os.path.getsize(shard):
+            return self._rebuild_index(shard)
+        return end
+
+    def _rebuild_index(self, shard):
+        """Walk the tar headers of `shard` into a new index (up to a torn
+        member); returns the end of the last member"""
+        end = 0
+        entries = []
+        shard_size = os.path.getsize(shard)
+        try:
+            with tarfile.open(shard, 'r:') as tar:
+                for info in tar:
+                    if info.offset_data + info.size > shard_size:
+                        break  # torn
+                    entries.append(dict(name=info.name, offset=info.offset_data, size=info.size))
+                    end = info.offset_data + _padded(info.size)
+        except tarfile.ReadError:
+            pass
+        # what follows is a torn member (its header placeholder is zeros)
+        # or the end-of-archive blocks; anything else isn't ours to truncate
+        with open(shard, 'rb') as f:
+            f.seek(end)
+            if f.read(_BLOCK).strip(b'\0'):
+                raise IOError('%s: no tar header at %d, not appending to it' % (shard, end))
+        tmp = shard + '.idx.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(tmp, shard + '.idx')
+        for entry in entries:
+            self._index[entry['name']] = (shard, entry['offset'], entry['size'])
+        return end
+
+    def _open_shard(self, shard):
+        """Append to `shard`, after its last indexed member (which drops
+        a member torn by a crash and the end-of-archive blocks)"""
+        self._close_shard()
+        end = self._load_index(shard)
+        self._fo = open(shard, 'r+b' if os.path.exists(shard) else 'w+b')
+        self._fo.truncate(end)
+        self._fo.seek(end)
+        self._idx_fo = open(shard + '.idx', 'a')
+        self._shard = shard
+        self._end = end
+
+    def _close_shard(self):
+        if self._fo is not None:
+            # end-of-archive marker; overwritten by the next append
+            self._fo.write(b'\0' * _BLOCK * 2)
+            self._fo.close()
+            self._idx_fo.close()
+            self._fo = self._idx_fo = None
+
+    def _next_shard(self):
+        number = 0
+        if self._shard is not None:
+            number = int(os.path.basename(self._shard)[len('shard-'):-len('.tar')]) + 1
+        return os.path.join(self.root, 'shard-%06d.tar' % number)
+
+    def name(self, path):
+        """Member name of a destination path"""
+        return os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def exists(self, path):
+        return self.name(path) in self._index
+
+    def makedirs(self, path):
+        pass
+
+    def locate(self, path):
+        return path
+
+    def lookup(self, path):
+        """(shard, data offset, size) of a stored member or None"""
+        return self._index.get(self.name(path))
+
+    def open_read(self, path):
+        """Read-only file object of a stored member"""
+        shard, offset, size = self._index[self.name(path)]
+        with open(shard, 'rb') as f:
+            f.seek(offset)
+            return io.BytesIO(f.read(size))
+
+    def open_write(self, path):
+        return _TarWrite(self, self.name(path))
+
+    def put_file(self, path, src_path):
+        with open(src_path, 'rb') as src, self.open_write(path) as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(src_path)
+        return dst.size, dst.sha1.hexdigest()
+
+    def temp_path(self, path):
+        return os.path.join(self.root, '.%s.tmp' % os.path.basename(path))
+
+    def _begin(self, name):
+        self._lock.acquire()
+        try:
+            if self._end >= self.shard_size or self._shard is None:
+                self._open_shard(self._next_shard())
+            elif self._fo is None:  # closed
+                self._open_shard(self._shard)
+            start = self._end
+            self._fo.seek(start)
+            # header placeholder; its length depends on the name only (long
+            # names take extra blocks), so the real one fits exactly
+            self._fo.write(b'\0' * len(_header(name, 0)))
+        except BaseException:
+            self._lock.release()
+            raise
+        return start
+
+    def _commit(self, name, start, size):
+        try:
+            header = _header(name, size)
+            self._fo.seek(start)
+            self._fo.write(header)
+            offset = start + len(header)
+            self._fo.seek(offset + size)
+            self._fo.write(b'\0' * (_padded(size) - size))
+            self._fo.flush()
+            self._end = offset + _padded(size)
+            self._idx_fo.write(json.dumps(dict(name=name, offset=offset, size=size)) + '\n')
+            self._idx_fo.flush()
+            self._index[name] = (self._shard, offset, size)
+        finally:
+            self._lock.release()
+
+    def _rollback(self, start):
+        try:
+            self._fo.truncate(start)
+            self._fo.seek(start)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        with self._lock:
+            self._close_shard()
+
+
+class _TarWrite(object):
+
+    def __init__(self, sink, name):
+        self.sink = sink
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.sink._begin(self.name)
+        self.writer = _Writer(self.sink._fo)
+        return self.writer
+
+    def __exit__(self, exc_type, *ar):
+        if exc_type is not None or self.writer.discarded:
+            self.sink._rollback(self.start)
+        else:
+            self.sink._commit(self.name, self.start, self.writer.size)
+
+
+def _file_digest(path, chunk_size=256 * 1024):
+    sha1, size = hashlib.sha1(), 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+            size += len(chunk)
+    return size, sha1.hexdigest()
+
+
+def _header(name, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.GNU_FORMAT)
+
+
+def _padded(size):
+    return -(-size // _BLOCK) * _BLOCK
+
+
+SINKS = ('dir', 'tar')
+
+
+def make_sink(kind='dir', root=None, shard_size=SHARD_SIZE, fanout=0):
+    """'dir' (with `fanout` levels) or 'tar' (shards in `root`) sink"""
+    if kind == 'tar':
+        return TarShardSink(root, shard_size)
+    elif kind == 'dir':
+        return DirectorySink(fanout)
+    raise ValueError('unknown sink %r, expected one of %r' % (kind, SINKS))
+
+
+def configure(kind='dir', root=None, shard_size=SHARD_SIZE, fanout=0):
+    """Set the process-wide sink used when none is passed"""
+    global _default_sink
+    if _default_sink is not None:
+        _default_sink.close()
+    _default_sink = make_sink(kind, root, shard_size, fanout)
+    return _default_sink
+
+
+def get_sink():
+    global _default_sink
+    if _default_sink is None:
+        _default_sink = DirectorySink()
+    return _default_sink
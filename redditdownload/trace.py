@@ -0,0 +1,350 @@
+"""HTTP trace record & replay (``--record-trace``, ``--replay-trace``).
+
+Listings, imgur pages and CDN behaviour change within minutes, so a slow
+run can't be reproduced by running it again. With ``--record-trace DIR``
+every request made through ``urllib`` (pages and API calls via httpcache,
+media downloads, segments, HEAD requests) is captured in ``DIR``:
+
+* ``trace.jsonl`` -- one line per exchange: method, url, request headers,
+  status, response headers, final url, body sha1 and size, time to the
+  headers (``ttfb``) and to the last byte (``elapsed``), in seconds;
+* ``bodies/<sha1>`` -- the response bodies, stored once each (not with
+  ``--trace-bodies hash``, where only their sha1 and size are kept).
+
+``--replay-trace DIR`` serves those exchanges back instead of the network,
+with the recorded latencies (``--replay-latency original``) or none
+(``zero``), so pipeline, parser and cache changes can be profiled against
+identical input. Requests are matched by method, url and Range header;
+a request made more often than recorded gets the last response again, one
+that wasn't recorded fails with a URLError. Bodies recorded as hashes only
+are replayed as zero bytes of the original length.
+
+The ``requests`` based plugins (img_scrap_stuff, gfycat uploads) are not
+traced.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import weakref
+import threading
+import http.client
+import urllib.request
+from collections import defaultdict
+from urllib.error import HTTPError, URLError
+
+
+_log = logging.getLogger(__name__)
+
+TRACE_FILE = 'trace.jsonl'
+BODIES_DIR = 'bodies'
+LATENCIES = ('original', 'zero')
+BODY_MODES = ('full', 'hash')
+# Request headers not written to the trace.
+PRIVATE_HEADERS = ('authorization', 'cookie', 'proxy-authorization')
+
+_opener = None
+
+
+def _headers(message):
+    return [[name, value] for name, value in message.items()]
+
+
+def _message(pairs):
+    message = http.client.HTTPMessage()
+    for name, value in pairs:
+        message[name] = value
+    return message
+
+
+def _request_key(method, url, headers):
+    headers = {name.lower(): value for name, value in headers}
+    return '%s %s %s' % (method, url, headers.get('range', ''))
+
+
+class Recorder(object):
+    """Writes exchanges to a trace directory
+
+    :param bodies: 'full' to store the bodies, 'hash' for their sha1 only
+    """
+
+    def __init__(self, trace_dir, bodies='full'):
+        self.trace_dir = trace_dir
+        self.bodies = bodies
+        self._lock = threading.Lock()
+        self._origin = time.time()
+        # responses not read to the end yet, recorded as partial on close
+        self.pending = weakref.WeakSet()
+        bodies_dir = os.path.join(trace_dir, BODIES_DIR)
+        if not os.path.isdir(bodies_dir):
+            os.makedirs(bodies_dir)
+        self._fo = open(os.path.join(trace_dir, TRACE_FILE), 'a')
+
+    def body_file(self):
+        """Temporary file to spool a body into, None in 'hash' mode"""
+        if self.bodies != 'full':
+            return None
+        return tempfile.NamedTemporaryFile(dir=os.path.join(self.trace_dir, BODIES_DIR),
+                                           suffix='.tmp', delete=False)
+
+    def write(self, entry, spool=None):
+        """Record an exchange; `spool` (from :meth:`body_file`) is its body"""
+        if spool is not None:
+            spool.close()
+            path = os.path.join(self.trace_dir, BODIES_DIR, entry['sha1'])
+            if os.path.exists(path):
+                os.remove(spool.name)  # same body recorded before
+            else:
+                os.replace(spool.name, path)
+        entry['start'] = round(entry['start'] - self._origin, 4)
+        with self._lock:
+            if self._fo is not None:
+                self._fo.write(json.dumps(entry) + '\n')
+                self._fo.flush()
+
+    def close(self):
+        for response in list(self.pending):
+            response.close()
+        with self._lock:
+            if self._fo is not None:
+                self._fo.close()
+                self._fo = None
+
+
+class _RecordingResponse(object):
+    """Wraps a urllib response; the exchange is recorded once the body is
+    read to the end or the response is closed"""
+
+    def __init__(self, response, recorder, entry):
+        self._response = response
+        self._recorder = recorder
+        self._entry = entry
+        self._sha1 = hashlib.sha1()
+        self._size = 0
+        self._spool = recorder.body_file()
+        self._done = False
+        recorder.pending.add(self)
+
+    def __getattr__(self, name):
+        # url, status, code, headers, info, getcode, geturl...
+        return getattr(self._response, name)
+
+    def _feed(self, data):
+        if data:
+            self._sha1.update(data)
+            self._size += len(data)
+            if self._spool is not None:
+                self._spool.write(data)
+
+    def read(self, *ar):
+        data = self._response.read(*ar)
+        self._feed(data)
+        if not data or not ar or ar[0] is None or ar[0] < 0:
+            self._finish()
+        return data
+
+    def readinto(self, buf):
+        count = self._response.readinto(buf)
+        self._feed(bytes(buf[:count]))
+        if not count:
+            self._finish()
+        return count
+
+    def _finish(self, partial=False):
+        if self._done:
+            return
+        self._done = True
+        self._entry.update(sha1=self._sha1.hexdigest(), size=self._size,
+                           elapsed=round(time.time() - self._entry['start'], 4))
+        if partial and self._entry['method'] != 'HEAD':
+            headers = dict((name.lower(), value) for name, value in self._entry['headers'])
+            if headers.get('content-length') != str(self._size):
+                # closed before the end: what was read is all there is
+                self._entry['partial'] = True
+        self._recorder.write(self._entry, self._spool)
+
+    def close(self):
+        self._finish(partial=True)
+        self._response.close()
+
+    def __del__(self):
+        # dropped without close (e.g. a wrong file type)
+        try:
+            self._finish(partial=True)
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ar):
+        self.close()
+
+
+class RecordingOpener(object):
+    """Stand-in for the urllib opener recording every exchange"""
+
+    def __init__(self, recorder, opener=None):
+        self.recorder = recorder
+        self.opener = opener or urllib.request.build_opener()
+
+    def open(self, url, data=None, timeout=None, **kwa):
+        req = url if isinstance(url, urllib.request.Request) else urllib.request.Request(url, data)
+        headers = [[name, value] for name, value in req.header_items()
+                   if name.lower() not in PRIVATE_HEADERS]
+        entry = dict(method=req.get_method(), url=req.full_url, request_headers=headers,
+                     start=time.time())
+        args = (req, data) if timeout is None else (req, data, timeout)
+        try:
+            response = self.opener.open(*args, **kwa)
+        except HTTPError as exc:
+            body = exc.read()
+            entry.update(status=exc.code, reason=exc.msg, headers=_headers(exc.headers),
+                         final_url=exc.geturl() or req.full_url,
+                         ttfb=round(time.time() - entry['start'], 4))
+            _RecordingResponse(io.BytesIO(body), self.recorder, entry).read()
+            # the caller may still read the error body
+            raise HTTPError(exc.url, exc.code, exc.msg, exc.headers, io.BytesIO(body))
+        entry.update(status=response.getcode(), reason=getattr(response, 'reason', ''),
+                     headers=_headers(response.info()), final_url=response.geturl(),
+                     ttfb=round(time.time() - entry['start'], 4))
+        return _RecordingResponse(response, self.recorder, entry)
+
+
+class Trace(object):
+    """The recorded exchanges of a trace directory"""
+
+    def __init__(self, trace_dir):
+        self.trace_dir = trace_dir
+        self._exchanges = defaultdict(list)  # request key -> entries
+        self._served = defaultdict(int)
+        self._lock = threading.Lock()
+        with open(os.path.join(trace_dir, TRACE_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line
+                key = _request_key(entry['method'], entry['url'], entry['request_headers'])
+                self._exchanges[key].append(entry)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._exchanges.values())
+
+    def lookup(self, method, url, headers):
+        """Next recorded exchange of a request, None if there is none"""
+        key = _request_key(method, url, headers)
+        with self._lock:
+            entries = self._exchanges.get(key)
+            if not entries:
+                return None
+            index = min(self._served[key], len(entries) - 1)
+            self._served[key] += 1
+        return entries[index]
+
+    def open_body(self, entry):
+        path = os.path.join(self.trace_dir, BODIES_DIR, entry['sha1'])
+        if os.path.exists(path):
+            return open(path, 'rb')
+        return io.BytesIO(b'\0' * entry['size'])  # recorded as a hash only
+
+
+class ReplayResponse(object):
+    """A recorded response, read at the recorded pace unless `latency` is
+    'zero'"""
+
+    def __init__(self, entry, body, latency='original'):
+        self.url = entry['final_url']
+        self.status = self.code = entry['status']
+        self.reason = entry.get('reason', '')
+        self.headers = self.msg = _message(entry['headers'])
+        self._body = body
+        self._size = entry['size']
+        self._read = 0
+        self._pace = latency == 'original'
+        self._started = time.time()
+        self._ttfb = entry.get('ttfb') or 0
+        self._transfer = max(0, (entry.get('elapsed') or 0) - self._ttfb)
+        if self._pace and self._ttfb:
+            time.sleep(self._ttfb)
+
+    def read(self, *ar):
+        data = self._body.read(*ar)
+        self._read += len(data)
+        if self._pace and self._size:
+            # reached at the recorded time for this many bytes
+            due = self._ttfb + self._transfer * self._read / float(self._size)
+            wait = due - (time.time() - self._started)
+            if wait > 0:
+                time.sleep(wait)
+        return data
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        self._body.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *ar):
+        self.close()
+
+
+class ReplayOpener(object):
+    """Stand-in for the urllib opener serving a trace"""
+
+    def __init__(self, trace, latency='original'):
+        self.trace = trace
+        self.latency = latency
+
+    def open(self, url, data=None, timeout=None, **kwa):
+        req = url if isinstance(url, urllib.request.Request) else urllib.request.Request(url, data)
+        entry = self.trace.lookup(req.get_method(), req.full_url, req.header_items())
+        if entry is None:
+            raise URLError('%s %s is not in the trace' % (req.get_method(), req.full_url))
+        response = ReplayResponse(entry, self.trace.open_body(entry), self.latency)
+        if entry['status'] >= 300 and entry['status'] != 206:
+            raise HTTPError(response.url, response.status, response.reason,
+                            response.headers, response)
+        return response
+
+
+def configure(record=None, replay=None, latency='original', bodies='full'):
+    """Record (or replay) the urllib requests of the process to (from) a
+    trace directory; neither stops tracing"""
+    global _opener
+    close()
+    if record:
+        _opener = RecordingOpener(Recorder(record, bodies))
+    elif replay:
+        trace = Trace(replay)
+        _log.info("Replaying %d recorded requests from %s", len(trace), replay)
+        _opener = ReplayOpener(trace, latency)
+    urllib.request.install_opener(_opener)
+    return _opener
+
+
+def replaying():
+    """Whether requests are served from a trace"""
+    return isinstance(_opener, ReplayOpener)
+
+
+def close():
+    """Finish the trace being recorded"""
+    global _opener
+    if isinstance(_opener, RecordingOpener):
+        _opener.recorder.close()
+    _opener = None
+    urllib.request.install_opener(None)
@@ -0,0 +1,219 @@
+"""Long-running ``--watch`` mode.
+
+Instead of a cron job starting the whole tool (and re-reading every
+history file) for every subreddit at a fixed rate, one process keeps its
+caches and state in memory and polls each subreddit when it's due. Due
+times live in a priority queue; the poll interval of a subreddit follows
+its observed post rate, so busy subreddits are polled often and quiet ones
+rarely::
+
+    interval = TARGET_NEW_POSTS / posts_per_second, clamped to
+               [min_interval, max_interval]
+
+The subreddit list file is re-read when its mtime changes. SIGINT / SIGTERM
+stop the watcher after the current post; the per-subreddit rates and due
+times are checkpointed to a small JSON state file so a restart carries on
+where it stopped.
+"""
+
+import os
+import json
+import heapq
+import signal
+import logging
+import tempfile
+import threading
+import time
+
+
+_log = logging.getLogger(__name__)
+
+STATE_FILE = '._watch_state.json'
+# Aim for polls that find about this many new posts.
+TARGET_NEW_POSTS = 5
+MIN_INTERVAL = 60
+MAX_INTERVAL = 6 * 3600
+# Weight of the latest observation in the post rate average.
+RATE_ALPHA = 0.3
+
+
+def update_rate(rate, new_posts, elapsed, alpha=RATE_ALPHA):
+    """Exponential moving average of the post rate (posts / second)
+
+    :param rate: previous estimate, None if there is none yet
+    :param elapsed: seconds covered by the observation
+    """
+    if elapsed <= 0:
+        return rate
+    observed = new_posts / float(elapsed)
+    if rate is None:
+        return observed
+    return alpha * observed + (1 - alpha) * rate
+
+
+def next_interval(rate, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                  target=TARGET_NEW_POSTS):
+    """Seconds until the next poll for a subreddit posting at `rate`
+
+    >>> next_interval(None), next_interval(0), next_interval(0.5)
+    (60, 21600, 60)
+    >>> next_interval(1 / 600.0)
+    3000.0
+    """
+    if rate is None:
+        return min_interval
+    if rate <= 0:
+        return max_interval
+    return min(max_interval, max(min_interval, target / rate))
+
+
+def section_key(section):
+    """``(subreddit, dir)`` identifying a section across list reloads"""
+    return '%s\t%s' % (section[0], section[1])
+
+
+class Watcher(object):
+    """Polls sections (``(subreddit, dir, routes)`` tuples) as they come due
+
+    :param load_sections: callable returning the current list of sections
+    :param poll: callable(section) returning the ``created_utc`` of the
+        posts that were new in it
+    :param watch_file: subreddit list file to reload on change
+    :param state_file: JSON checkpoint of rates and due times
+    :param weight: callable(section) returning its share of the polls
+        (weight 2: polled twice as often), None for equal shares
+    """
+
+    def __init__(self, load_sections, poll, watch_file=None, state_file=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 stop=None, clock=time.time, weight=None):
+        self.load_sections = load_sections
+        self.poll = poll
+        self.watch_file = watch_file
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stop = stop or threading.Event()
+        self.clock = clock
+        self.weight = weight
+        self.sections = {}
+        self.state = {}  # key -> dict(rate, last_poll, due)
+        self._queue = []  # (due, key); stale entries are skipped on pop
+        self._list_mtime = None
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_file:
+            return
+        try:
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.state = {}
+
+    def checkpoint(self):
+        """Write the schedule to the state file (atomically)"""
+        if not self.state_file:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.state_file)
+
+    def _mtime(self):
+        try:
+            return os.stat(self.watch_file).st_mtime
+        except (OSError, TypeError):
+            return None
+
+    def reload(self):
+        """(Re)load the sections: new ones are due now, removed ones are
+        dropped from the schedule"""
+        self._list_mtime = self._mtime()
+        sections = {section_key(section): section for section in self.load_sections()}
+        now = self.clock()
+        for key in sections:
+            if key not in self.sections:
+                entry = self.state.setdefault(key, {})
+                entry.setdefault('rate', None)
+                entry.setdefault('last_poll', None)
+                entry['due'] = min(entry.get('due') or now, now + self.max_interval)
+                heapq.heappush(self._queue, (entry['due'], key))
+        for key in set(self.state) - set(sections):
+            del self.state[key]
+        self.sections = sections
+        _log.info("Watching %d section(s)", len(sections))
+
+    def _maybe_reload(self):
+        if self.watch_file and self._mtime() != self._list_mtime:
+            _log.info("%s changed, reloading", self.watch_file)
+            try:
+                self.reload()
+            except Exception as exc:
+                # keep going with the old list, e.g. half-written file
+                _log.warning("Reloading %s failed: %r", self.watch_file, exc)
+
+    def _pop_due(self):
+        """Next (due, key) that is still scheduled, or None"""
+        while self._queue:
+            due, key = self._queue[0]
+            if key not in self.sections or self.state[key]['due'] != due:
+                heapq.heappop(self._queue)  # stale
+                continue
+            return due, key
+        return None
+
+    def poll_one(self, key):
+        started = self.clock()
+        entry = self.state[key]
+        try:
+            new_times = self.poll(self.sections[key]) or []
+        except Exception as exc:
+            _log.exception("Polling %s failed: %r", key, exc)
+            new_times = None
+        now = self.clock()
+        if new_times is not None and not self.stop.is_set():
+            if entry['last_poll'] is not None:
+                elapsed = started - entry['last_poll']
+            else:
+                # first poll: estimate from the age of what it found
+                elapsed = started - min(new_times) if new_times else 0
+            entry['rate'] = update_rate(entry['rate'], len(new_times), elapsed)
+            entry['last_poll'] = started
+        interval = next_interval(entry['rate'], self.min_interval, self.max_interval)
+        if self.weight is not None:
+            interval = max(self.min_interval, interval / self.weight(self.sections[key]))
+        entry['due'] = now + interval
+        heapq.heappush(self._queue, (entry['due'], key))
+        self.checkpoint()
+
+    def run(self):
+        """Poll until stopped (SIGINT / SIGTERM or `stop` being set)"""
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(
+                    signum, lambda *ar: self.stop.set())
+        try:
+            self.reload()
+            while not self.stop.is_set():
+                self._maybe_reload()
+                nxt = self._pop_due()
+                if nxt is None:
+                    # empty list: wait for it to change
+                    self.stop.wait(self.min_interval)
+                    continue
+                due, key = nxt
+                wait = due - self.clock()
+                if wait > 0:
+                    # wake up now and then to notice list changes
+                    self.stop.wait(min(wait, self.min_interval))
+                    continue
+                heapq.heappop(self._queue)
+                self.poll_one(key)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self.checkpoint()
+            _log.info("Watcher stopped")
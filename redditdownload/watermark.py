@@ -0,0 +1,61 @@
+"""High-water marks for incremental (``--incremental``) syncs.
+
+A mark is the newest ``created_utc`` and id seen for a subreddit & sort,
+kept in ``._history.txt`` next to ``last-id``::
+
+    {"wallpapers": {"new": {"last-id": "8x0abc",
+                            "watermark": {"created_utc": 1520000000.0,
+                                          "id": "8x0abc"}}}}
+
+On the next run the listing is walked from the top and pagination stops at
+the first item at or below the mark, so a run with nothing new costs a
+single listing request.
+"""
+
+
+# Listings ordered newest-first, where the first old item means that
+# everything after it is old too.
+TIME_ORDERED_SORTS = ('new',)
+
+
+def item_mark(item):
+    """Watermark of a listing item"""
+    return {'created_utc': float(item.get('created_utc') or 0), 'id': item['id']}
+
+
+def _key(mark):
+    # reddit ids are base36 and increase over time: tie-breaker for
+    # posts created in the same second
+    try:
+        id_num = int(mark['id'], 36)
+    except (TypeError, ValueError):
+        id_num = 0
+    return float(mark.get('created_utc') or 0), id_num
+
+
+def newer(mark_a, mark_b):
+    """The newer of two marks (either may be None)"""
+    if mark_a is None:
+        return mark_b
+    if mark_b is None:
+        return mark_a
+    return mark_a if _key(mark_a) >= _key(mark_b) else mark_b
+
+
+def oldest(marks):
+    """The oldest of `marks`, None if any of them is None (or there are none)"""
+    marks = list(marks)
+    if not marks or not all(marks):
+        return None
+    return min(marks, key=_key)
+
+
+def is_seen(item, mark):
+    """True if `item` is at or below the mark, i.e. handled by a previous run"""
+    if not mark:
+        return False
+    return _key(item_mark(item)) <= _key(mark)
+
+
+def is_time_ordered(sort_type):
+    return (sort_type or '').lower() in TIME_ORDERED_SORTS
@@ -0,0 +1,120 @@
+import json
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from redditdownload import backfill, memory
+
+
+# 300 posts in a busy burst and a quiet tail
+POSTS = ([dict(id='b%03d' % i, created_utc=1000 + i // 3, subreddit='pics') for i in range(240)] +
+         [dict(id='q%03d' % i, created_utc=5000 + i * 100, subreddit='pics') for i in range(60)])
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Stand-in for a Pushshift-compatible search endpoint"""
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        self.server.queries.append(query)
+        window = (int(query['after']) + 1, int(query['before']))
+        tries = self.server.failing.get(window)
+        if tries:
+            # a flaky (or dead, with a big count) window
+            self.server.failing[window] = tries - 1
+            self.send_error(502)
+            return
+        items = [p for p in POSTS
+                 if int(query['after']) < p['created_utc'] < int(query['before'])]
+        items.sort(key=lambda p: p['created_utc'])
+        body = json.dumps({'data': items[:int(query['size'])]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *ar):
+        pass
+
+
+@pytest.fixture
+def archive():
+    server = HTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    server.queries, server.failing = [], {}
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_range():
+    assert backfill.parse_range('2017-01-01..2017-01-01T01:00') == (1483228800, 1483232400)
+    for value in ('2017-01-01', '2017-01-02..2017-01-01', 'x..y'):
+        with pytest.raises(ValueError):
+            backfill.parse_range(value)
+
+
+def test_backfill_refines_capped_windows(archive):
+    api = 'http://127.0.0.1:%d/reddit/search/submission/' % archive.server_port
+    pages = list(backfill.backfill('pics', 0, 20000, api=api, workers=3, rate=0, size=25))
+    ids = [item['id'] for page in pages for item in page]
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(p['id'] for p in POSTS)
+    for page in pages:
+        times = [item['created_utc'] for item in page]
+        assert times == sorted(times, reverse=True)
+    # the burst was split further, the quiet part was not
+    assert len(archive.queries) > 6 + len(POSTS) // 25
+    assert all(q['subreddit'] == 'pics' and q['sort'] == 'asc' for q in archive.queries)
+
+
+def test_backfill_within_memory_budget(archive, monkeypatch):
+    api = 'http://127.0.0.1:%d/reddit/search/submission/' % archive.server_port
+    # room for two windows in flight
+    budget = memory.MemoryBudget(2 * 25 * backfill.ITEM_BYTES + 1, rss=lambda: None)
+    monkeypatch.setattr(memory, '_budget', budget)
+    pages = backfill.backfill('pics', 0, 20000, api=api, workers=3, rate=0, size=25)
+    ids = [item['id'] for page in pages for item in page]
+    assert sorted(ids) == sorted(p['id'] for p in POSTS)
+    # never a third window (the pages being read are reserved on top)
+    assert budget.peak < 3 * 25 * backfill.ITEM_BYTES and budget.used == 0
+
+    # stopping early gives the reservations back
+    pages = backfill.backfill('pics', 0, 20000, api=api, workers=3, rate=0, size=25)
+    next(pages)
+    pages.close()
+    assert budget.used == 0
+
+
+def test_backfill_retries_failed_windows(archive):
+    api = 'http://127.0.0.1:%d/reddit/search/submission/' % archive.server_port
+    # windows of split_range(0, 20000, 4): one fails once, one every time
+    archive.failing.update({(0, 5000): 1, (15000, 20000): 100})
+    pages = backfill.backfill('pics', 0, 20000, api=api, workers=2, rate=0, size=1000,
+                              retries=2, backoff=0)
+    ids = []
+    with pytest.raises(backfill.BackfillError) as info:
+        for page in pages:
+            ids.extend(item['id'] for item in page)
+    # the flaky window made it the second time, the dead one is reported
+    assert sorted(ids) == sorted(p['id'] for p in POSTS if p['created_utc'] < 15000)
+    assert info.value.windows == [(15000, 20000)]
+    assert archive.failing == {(0, 5000): 0, (15000, 20000): 97}
+
+
+def test_rate_limiter_spaces_calls():
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+
+    limiter = backfill.RateLimiter(2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(3):
+        limiter.acquire()
+    assert slept == [0.5, 1.0]
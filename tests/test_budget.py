@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from redditdownload import budget
+from redditdownload.httpcache import MiB
+
+
+def test_parse_deadline():
+    now = time.mktime((2020, 5, 1, 22, 0, 0, 0, 0, -1))
+    assert budget.parse_deadline('2h', now=now) == now + 7200
+    # later today, or tomorrow once past
+    assert budget.parse_deadline('23:30', now=now) == now + 5400
+    assert budget.parse_deadline('06:00', now=now) == time.mktime(
+        (2020, 5, 2, 6, 0, 0, 0, 0, -1))
+    with pytest.raises(ValueError):
+        budget.parse_deadline('soon')
+
+
+def test_budget():
+    now = [0]
+    left = budget.Budget(bytes=100, deadline=10, clock=lambda: now[0])
+    assert left.fits(100) and left.fits(None) and not left.fits(101)
+    assert left.exhausted() is None
+    left.spend(60)
+    assert not left.fits(50)
+    left.spend(40)
+    assert left.exhausted() == 'byte budget used up'
+    timed = budget.Budget(deadline=10, clock=lambda: now[0])
+    assert timed.fits(10 ** 12)
+    now[0] = 10
+    assert timed.exhausted() == 'deadline reached'
+
+
+def test_estimate_sizes():
+    items = [
+        dict(id='a', url='https://i.redd.it/a.jpg'),
+        dict(id='b', url='https://imgur.com/a/album',
+             preview=dict(images=[dict(source=dict(width=1000, height=800))])),
+        dict(id='c', url='https://example.com/page'),
+        dict(id='d', url='https://i.redd.it/d.png?x=1'),
+    ]
+    heads = []
+
+    def head(url):
+        heads.append(url)
+        return 5 * MiB if url.endswith('a.jpg') else None
+
+    sizes = budget.estimate_sizes(items, head=head)
+    assert sizes == dict(a=5 * MiB, b=400000, c=None, d=None)
+    assert sorted(heads) == ['https://i.redd.it/a.jpg', 'https://i.redd.it/d.png?x=1']
+
+
+def test_deferred_checkpoint(tmpdir):
+    target = str(tmpdir)
+    assert budget.load_deferred(target, 'pics') == []
+    budget.save_deferred(target, 'pics', [])
+    assert not tmpdir.join(budget.DEFERRED_FILE).exists()
+    budget.save_deferred(target, 'pics', [dict(id='a')])
+    budget.save_deferred(target, 'aww', [dict(id='b')])
+    assert budget.load_deferred(target, 'pics') == [dict(id='a')]
+    budget.save_deferred(target, 'pics', [])
+    assert budget.load_deferred(target, 'pics') == []
+    assert budget.load_deferred(target, 'aww') == [dict(id='b')]
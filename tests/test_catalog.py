@@ -0,0 +1,100 @@
+import os
+import sqlite3
+
+import pytest
+
+from redditdownload import catalog
+
+
+def item(id, subreddit, title, score=1):
+    return dict(id=id, subreddit=subreddit, title=title, author='someone', score=score,
+                over_18=False, created_utc=1500000000.0 + len(id),
+                url='https://i.imgur.com/%s.jpg' % id, permalink='/r/%s/%s' % (subreddit, id))
+
+
+def fill(path, batch_size=3):
+    cat = catalog.Catalog(path, batch_size=batch_size)
+    cat.add_submission(item('a1', 'EarthPorn', 'Mountain lake at dawn', 10))
+    cat.add_file('a1', 'https://i.imgur.com/a1.jpg', '/walls/a1.jpg', 1000, 'f' * 40)
+    cat.add_submission(item('a2', 'EarthPorn', 'Desert road'))
+    cat.add_file('a2', 'https://i.imgur.com/a2.jpg', '/walls/a2.jpg', 2000, 'e' * 40)
+    cat.add_submission(item('b1', 'CityPorn', 'Lake front skyline', 5))
+    cat.add_file('b1', 'https://i.imgur.com/b1.jpg', '/city/b1.jpg', 3000, 'd' * 40)
+    return cat
+
+
+def count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_batched_writes(tmpdir):
+    path = str(tmpdir.join('cat.sqlite'))
+    cat = fill(path, batch_size=3)
+    # two full batches written, nothing left pending
+    assert count(path, 'submissions') == 3
+    assert count(path, 'files') == 3
+    cat.add_submission(item('c1', 'pics', 'Pending'))
+    assert count(path, 'submissions') == 3
+    cat.close()
+    assert count(path, 'submissions') == 4
+
+
+def test_upsert_keeps_one_row(tmpdir):
+    path = str(tmpdir.join('cat.sqlite'))
+    cat = fill(path)
+    cat.add_submission(item('a2', 'EarthPorn', 'Desert road at night', 99))
+    cat.flush()
+    assert count(path, 'submissions') == 3
+    assert [row[2:4] for row in cat.search('night')] == [(99, 'Desert road at night')]
+    assert cat.search('road NOT night') == []
+    cat.close()
+
+
+def test_search(tmpdir):
+    cat = fill(str(tmpdir.join('cat.sqlite')))
+    cat.flush()
+    assert sorted(row[0] for row in cat.search('lake')) == ['a1', 'b1']
+    assert [row[0] for row in cat.search('lake', subreddit='earthporn')] == ['a1']
+    assert cat.search('lake', subreddit='EarthPorn')[0][4] == '/walls/a1.jpg'
+    assert len(cat.search(subreddit='EarthPorn')) == 2
+    assert len(cat.search(limit=1)) == 1
+    cat.close()
+
+
+def test_search_punctuation(tmpdir):
+    cat = catalog.Catalog(str(tmpdir.join('cat.sqlite')))
+    for n, title in enumerate(["Don't look down", 'Mt. St. Helens at dawn', 'X-ray of a fish']):
+        cat.add_submission(dict(id='p%i' % n, subreddit='pics', title=title, score=1))
+    cat.flush()
+    for text, expected in (("don't", 'p0'), ('st. helens', 'p1'), ('x-ray', 'p2'),
+                           ('"unbalanced', None)):
+        assert [row[0] for row in cat.search(text)] == ([expected] if expected else [])
+    cat.close()
+
+
+def test_stats(tmpdir):
+    cat = fill(str(tmpdir.join('cat.sqlite')))
+    cat.flush()
+    assert cat.stats() == [('EarthPorn', 2, 2, 3000), ('CityPorn', 1, 1, 3000)]
+    cat.close()
+
+
+def test_query_main(tmpdir, capsys):
+    path = str(tmpdir.join('cat.sqlite'))
+    fill(path).close()
+    assert catalog.main(['--catalog', path, 'skyline']) == 0
+    out = capsys.readouterr().out
+    assert out == 'b1\tCityPorn\t5\tLake front skyline\t/city/b1.jpg\n'
+    catalog.main(['--catalog', path, '--stats'])
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split()[:2] == ['EarthPorn', '2']
+
+    # a mistyped path isn't made into an empty catalog
+    missing = str(tmpdir.join('nope.sqlite'))
+    with pytest.raises(SystemExit):
+        catalog.main(['--catalog', missing, 'skyline'])
+    assert not os.path.exists(missing) and not os.path.exists(missing + '-wal')
@@ -0,0 +1,46 @@
+import hashlib
+
+import pytest
+
+from redditdownload import cpupool
+
+
+@pytest.fixture(params=[0, 1])
+def workers(request):
+    cpupool.configure(request.param)
+    yield request.param
+    cpupool.configure(0)
+
+
+def test_tasks(workers, tmpdir):
+    big = b'x' * (cpupool.SPILL_THRESHOLD + 1)
+    assert cpupool.run(cpupool.task_hash, big, 'md5') == hashlib.md5(big).hexdigest()
+    html = '<a href="/a">a</a>' + ' ' * cpupool.SPILL_THRESHOLD
+    imgs, links, sources = cpupool.run(cpupool.task_extract_page, html, ('a',), 'http://h/')
+    assert links == ['http://h/a']
+    a, b = tmpdir.join('a'), tmpdir.join('b')
+    a.write('same')
+    b.write('same')
+    assert cpupool.run(cpupool.task_files_equal, str(a), str(b))
+
+
+def test_extract_page_backend_reaches_the_workers(workers):
+    html = '<a href="/a">a</a>'
+    assert cpupool.run(cpupool.task_extract_page, html, ('a',), None, 'stdlib')[1] == ['/a']
+    # (raised by the worker's htmlparse.extract)
+    with pytest.raises(ValueError):
+        cpupool.run(cpupool.task_extract_page, html, ('a',), None, 'nope')
+
+
+def test_submit(workers):
+    big = b'x' * (cpupool.SPILL_THRESHOLD + 1)
+    futures = [cpupool.submit(cpupool.task_hash, big, 'md5') for _ in range(3)]
+    assert {future.result() for future in futures} == {hashlib.md5(big).hexdigest()}
+
+
+def test_file_buffer_fallback():
+    handle = cpupool.FileBuffer('text')
+    try:
+        assert cpupool.load(handle) == 'text'
+    finally:
+        handle.release()
@@ -0,0 +1,114 @@
+import os
+import json
+
+import pytest
+
+from redditdownload import catalog, fanout, quota, storage
+
+
+def make_files(root, paths):
+    for path in paths:
+        full = os.path.join(root, path)
+        if not os.path.isdir(os.path.dirname(full)):
+            os.makedirs(os.path.dirname(full))
+        with open(full, 'w') as f:
+            f.write(path)
+
+
+def listing(root):
+    return sorted(os.path.relpath(os.path.join(dirpath, name), root)
+                  for dirpath, _, names in os.walk(root) for name in names)
+
+
+def test_migrate_and_flatten(tmpdir):
+    root = str(tmpdir)
+    flat = ['pics/a.jpg', 'pics/b.png', 'de/c.jpg', 'pics/._history.txt']
+    make_files(root, flat)
+
+    assert fanout.migrate(root, 2) == 3
+    expected = sorted(['pics/._history.txt'] +
+                      [os.path.relpath(fanout.fanout_path(os.path.join(root, p), 2), root)
+                       for p in flat if not p.endswith('.txt')])
+    assert listing(root) == expected
+    # already in place
+    assert fanout.migrate(root, 2) == 0
+
+    assert fanout.migrate(root, 1) == 3
+    assert fanout.migrate(root, 0) == 3
+    assert listing(root) == sorted(flat)
+    # the emptied fan-out folders are gone, the 'de' subreddit folder is not
+    assert sorted(os.listdir(root)) == ['de', 'pics']
+    assert sorted(os.listdir(os.path.join(root, 'pics'))) == ['._history.txt', 'a.jpg', 'b.png']
+
+
+def test_directory_sink_fanout(tmpdir):
+    root = str(tmpdir)
+    sink = storage.DirectorySink(fanout=2)
+    path = os.path.join(root, 'pics', 'a.jpg')
+    with sink.open_write(path) as f:
+        f.write(b'a')
+    assert sink.locate(path) == fanout.fanout_path(path, 2)
+    assert os.path.exists(sink.locate(path)) and not os.path.exists(path)
+    assert sink.exists(path)
+    # files of a folder not migrated yet still count
+    make_files(root, ['pics/b.jpg'])
+    assert sink.exists(os.path.join(root, 'pics', 'b.jpg'))
+    assert not sink.exists(os.path.join(root, 'pics', 'c.jpg'))
+
+
+def test_migrate_moves_downloads_only(tmpdir):
+    root = str(tmpdir)
+    make_files(root, ['pics/a.jpg', 'pics/b.gif', 'pics/shard-0000.tar', 'pics/jobs.json'])
+    pics = os.path.join(root, 'pics')
+    folder = quota.Quota(pics, max_files=10)
+    folder.add(os.path.join(pics, 'a.jpg'), 10, 'a')
+    folder.close()
+    db = catalog.Catalog(os.path.join(pics, 'wall.db'))
+    db.add_submission(dict(id='a', title='a'))
+    db.add_file('a', 'http://i/a.jpg', os.path.join(pics, 'a.jpg'))
+    db.close()
+
+    assert fanout.migrate(root, 1, catalog=os.path.join(pics, 'wall.db')) == 2
+    moved = fanout.fanout_path(os.path.join(pics, 'a.jpg'), 1)
+    assert sorted(os.listdir(pics)) == sorted(
+        ['._quota.idx', 'shard-0000.tar', 'jobs.json', 'wall.db'] +
+        [os.path.basename(os.path.dirname(fanout.fanout_path(os.path.join(pics, name), 1)))
+         for name in ('a.jpg', 'b.gif')])
+    # the shards, lists and database aren't quota'd either
+    assert sorted(quota.Quota(pics).files) == sorted(
+        os.path.relpath(fanout.fanout_path(os.path.join(pics, name), 1), pics)
+        for name in ('a.jpg', 'b.gif'))
+    db = catalog.Catalog(os.path.join(pics, 'wall.db'))
+    assert [path for _, _, _, _, path in db.search()] == [moved]
+    db.close()
+
+
+def test_main_refuses_a_stale_catalog(tmpdir):
+    make_files(str(tmpdir), ['pics/a.jpg', 'pics/._catalog.sqlite'])
+    with pytest.raises(SystemExit):
+        fanout.main([str(tmpdir), '1'])
+    assert os.path.exists(str(tmpdir.join('pics', 'a.jpg')))
+
+
+def test_migrate_carries_postprocess_records(tmpdir):
+    postprocess = pytest.importorskip('redditdownload.postprocess')
+    root = str(tmpdir)
+    pics = os.path.join(root, 'pics')
+    make_files(root, ['pics/x.mp4', 'pics/y.jpg'])
+    with open(os.path.join(pics, postprocess.RECORD_FILE), 'w') as f:
+        for name, new_name in (('x.gif', 'x.mp4'), ('y.jpg', 'y.jpg')):
+            f.write(json.dumps(dict(path=os.path.join(pics, name),
+                                    new_path=os.path.join(pics, new_name))) + '\n')
+
+    for levels in (2, 0):
+        fanout.migrate(root, levels)
+        # the GIF is still known as converted, where the sink looks for it
+        assert postprocess.Postprocessor().converted(
+            fanout.fanout_path(os.path.join(pics, 'x.gif'), levels))
+        records = [json.loads(line)
+                   for dirpath, _, names in os.walk(root) if postprocess.RECORD_FILE in names
+                   for line in open(os.path.join(dirpath, postprocess.RECORD_FILE))]
+        assert sorted(os.path.basename(record['path']) for record in records) == ['x.gif', 'y.jpg']
+        assert all(os.path.exists(record['new_path']) for record in records)
+    assert sorted(os.listdir(pics)) == [postprocess.RECORD_FILE, 'x.mp4', 'y.jpg']
+    assert len(open(os.path.join(pics, postprocess.RECORD_FILE)).readlines()) == 2
@@ -0,0 +1,57 @@
+import pytest
+
+from redditdownload import htmlparse
+
+
+HTML = '''<html><body>
+<a href="/page/1">one</a> <a name="anchor">no href</a>
+<img src="//i.example.com/a.jpg"><img alt="no src">
+<video><source src="v.webm" type="video/webm"><source src="v.mp4" type="video/mp4"></video>
+<a href="http://other.example.com/2">two</a>
+</body></html>'''
+
+
+@pytest.mark.parametrize('backend', htmlparse.BACKENDS)
+def test_backends_agree(backend):
+    try:
+        htmlparse._extractors[backend]('<p></p>', frozenset(), None)
+    except ImportError:
+        pytest.skip('%s not installed' % backend)
+    page = htmlparse.extract(HTML, base_url='http://h.example.com/x/', backend=backend)
+    assert page.links == ['http://h.example.com/page/1', 'http://other.example.com/2']
+    assert page.imgs == ['http://i.example.com/a.jpg']
+    assert page.sources == [('video/webm', 'http://h.example.com/x/v.webm'),
+                            ('video/mp4', 'http://h.example.com/x/v.mp4')]
+
+
+@pytest.mark.parametrize('backend', htmlparse.BACKENDS)
+def test_xml_declaration(backend):
+    page = b'<?xml version="1.0" encoding="utf-8"?>\n' + HTML.encode('utf-8')
+    assert htmlparse.extract(page, want=('img',), backend=backend).imgs == [
+        '//i.example.com/a.jpg']
+
+
+def test_limit_and_want():
+    page = htmlparse.extract(HTML, want=('source',), limit=1, backend='stdlib')
+    assert page.sources == [('video/webm', 'v.webm')]
+    assert page.links == [] and page.imgs == []
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        htmlparse.set_backend('nope')
+
+
+def test_fallback_only_on_backend_failures(monkeypatch):
+    def rejects(html, want, limit):
+        raise htmlparse.BackendFailed('Document is empty')
+
+    def broken(html, want, limit):
+        raise TypeError('a bug')
+
+    monkeypatch.setitem(htmlparse._extractors, 'lxml', rejects)
+    page = htmlparse.extract(HTML, want=('a',), backend='lxml')
+    assert page.links == ['/page/1', 'http://other.example.com/2']
+    monkeypatch.setitem(htmlparse._extractors, 'lxml', broken)
+    with pytest.raises(TypeError):
+        htmlparse.extract(HTML, backend='lxml')
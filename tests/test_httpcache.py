@@ -0,0 +1,91 @@
+from redditdownload import memory
+from redditdownload.httpcache import HTTPCache, freshness_lifetime
+
+
+class FakeTransport(object):
+    def __init__(self, headers, body=b'body'):
+        self.headers = headers
+        self.body = body
+        self.calls = []
+
+    def __call__(self, url, headers):
+        self.calls.append(dict(headers))
+        if 'If-None-Match' in headers and headers['If-None-Match'] == self.headers.get('etag'):
+            return 304, dict(self.headers), b'', url
+        return 200, dict(self.headers), self.body, url
+
+
+def test_freshness_lifetime():
+    assert freshness_lifetime({'cache-control': 'max-age=60'}) == 60
+    assert freshness_lifetime({'cache-control': 'no-cache, max-age=60'}) == 0
+    assert freshness_lifetime({
+        'date': 'Mon, 01 Jan 2018 00:00:00 GMT',
+        'expires': 'Mon, 01 Jan 2018 00:10:00 GMT'}) == 600
+    assert freshness_lifetime({'expires': '0'}) == 0
+    assert freshness_lifetime({
+        'date': 'Mon, 11 Jan 2018 00:00:00 GMT',
+        'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}) == 86400
+
+
+def test_fresh_hit(tmpdir):
+    cache = HTTPCache(str(tmpdir))
+    transport = FakeTransport({'cache-control': 'max-age=60'})
+    assert cache.fetch('http://x/', transport=transport).read() == b'body'
+    resp = cache.fetch('http://x/', transport=transport)
+    assert resp.from_cache and resp.read() == b'body'
+    assert len(transport.calls) == 1
+
+
+def test_revalidation(tmpdir):
+    cache = HTTPCache(str(tmpdir))
+    transport = FakeTransport({'cache-control': 'no-cache', 'etag': '"v1"'})
+    cache.fetch('http://x/', transport=transport)
+    resp = cache.fetch('http://x/', transport=transport)
+    assert transport.calls[1] == {'If-None-Match': '"v1"'}
+    assert resp.from_cache and resp.read() == b'body'
+
+
+def test_no_store(tmpdir):
+    cache = HTTPCache(str(tmpdir))
+    transport = FakeTransport({'cache-control': 'no-store', 'etag': '"v1"'})
+    cache.fetch('http://x/', transport=transport)
+    cache.fetch('http://x/', transport=transport)
+    assert transport.calls == [{}, {}]
+
+
+def test_lru_eviction(tmpdir):
+    cache = HTTPCache(str(tmpdir), max_size=250)
+    transport = FakeTransport({'cache-control': 'max-age=60'}, body=b'x' * 100)
+    for name in 'abc':
+        cache.fetch('http://x/' + name, transport=transport)
+    assert cache._total <= 250
+    assert cache.lookup('http://x/a') is None
+    assert cache.lookup('http://x/c') is not None
+
+
+def test_media_is_not_stored(tmpdir):
+    cache = HTTPCache(str(tmpdir))
+    transport = FakeTransport({'cache-control': 'max-age=60', 'content-type': 'image/jpeg'})
+    for _ in range(2):
+        assert cache.fetch('http://x/a.jpg', transport=transport).read() == b'body'
+    assert len(transport.calls) == 2
+    transport = FakeTransport({'cache-control': 'max-age=60',
+                               'content-type': 'application/json; charset=UTF-8'})
+    for _ in range(2):
+        cache.fetch('http://x/a.json', transport=transport)
+    assert len(transport.calls) == 1
+
+
+def test_bodies_are_held(tmpdir, monkeypatch):
+    budget = memory.MemoryBudget(10 ** 6, rss=lambda: None)
+    monkeypatch.setattr(memory, '_budget', budget)
+    cache = HTTPCache(str(tmpdir))
+    transport = FakeTransport({'content-type': 'text/html'}, b'x' * 1000)
+    response = cache.fetch('http://x/a', transport=transport)
+    assert budget.used == 1000
+    assert response.read() == b'x' * 1000
+    response.close()
+    assert budget.used == 0
+    response = cache.fetch('http://x/b', transport=transport)
+    del response
+    assert budget.used == 0
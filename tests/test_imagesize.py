@@ -0,0 +1,57 @@
+import io
+import struct
+
+import pytest
+
+from redditdownload.imagesize import sniff_size, read_head, parse_aspect, SizeFilter
+
+
+def _png(width, height):
+    return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' +
+            struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00')
+
+
+def _jpeg(width, height):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    sof = b'\xff\xc0' + struct.pack('>HBHH', 17, 8, height, width) + b'\x00' * 10
+    return b'\xff\xd8' + app0 + sof + b'\xff\xda'
+
+
+def _mp4(width, height):
+    tkhd = (b'\x00\x00\x00\x00' + b'\x00' * 20 + b'\x00' * 8 + b'\x00' * 8 +
+            b'\x00' * 36 + struct.pack('>II', width << 16, height << 16))
+    tkhd = struct.pack('>I', len(tkhd) + 8) + b'tkhd' + tkhd
+    return b'\x00\x00\x00\x18ftypisom' + b'\x00' * 12 + b'\x00\x00\x10\x00moov' + tkhd
+
+
+def test_sniff_formats():
+    assert sniff_size(_png(1920, 1080)) == (1920, 1080)
+    assert sniff_size(_jpeg(800, 600)) == (800, 600)
+    assert sniff_size(b'GIF89a' + struct.pack('<HH', 320, 240)) == (320, 240)
+    assert sniff_size(_mp4(1280, 720)) == (1280, 720)
+    webp = b'RIFF\x00\x00\x00\x00WEBPVP8X' + b'\x00' * 8 + (639).to_bytes(3, 'little') \
+        + (479).to_bytes(3, 'little')
+    assert sniff_size(webp) == (640, 480)
+    assert sniff_size(b'<html>') is None
+    # truncated header: more data needed
+    assert sniff_size(_jpeg(800, 600)[:10]) is None
+
+
+def test_read_head_stops_early():
+    body = io.BytesIO(_png(100, 50) + b'\x00' * 100000)
+    head, size = read_head(body, chunk_size=64)
+    assert size == (100, 50)
+    assert len(head) == 64
+
+
+def test_size_filter():
+    assert parse_aspect('16:9') == 16.0 / 9
+    assert parse_aspect('1') == 1.0
+    for value in ('16:0', '-16:-9', '0', '-1'):
+        with pytest.raises(ValueError):
+            parse_aspect(value)
+    flt = SizeFilter(min_width=800, min_height=600, min_aspect=1.0)
+    assert flt.check((1920, 1080)) is None
+    assert flt.check(None) is None
+    assert flt.check((640, 480))
+    assert flt.check((1080, 1920))
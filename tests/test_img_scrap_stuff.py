@@ -0,0 +1,221 @@
+import time
+import struct
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+pytest.importorskip('requests')
+
+from redditdownload import htmlparse
+from redditdownload.plugins import img_scrap_stuff
+
+
+def png(width, height, size):
+    head = (b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' +
+            struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00')
+    return head + b'\0' * (size - len(head))
+
+
+FILES = {
+    '/big.png': ('image/png', png(1000, 800, 100000)),
+    '/small.png': ('image/png', png(100, 100, 5000)),
+    '/skip.png': ('image/png', png(1000, 800, 5000)),
+    '/text.html': ('text/html', b'<p>not an image</p>'),
+    '/page.html': ('text/html', b'<img src="/big.png"><img src="small.png">'
+                                b'<a href="/skip.png">s</a><a href="/text.html">t</a>'
+                                b'<a href="mailto:x@example.com">m</a>'),
+}
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves FILES, with Range support unless the server `ignore_range`s"""
+
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        self.server.requests.append((self.path, rng))
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        mime, body = FILES[self.path]
+        status = 200
+        if rng and not self.server.ignore_range:
+            first, last = (int(v) for v in rng.split('=')[1].split('-'))
+            body, status = body[first:last + 1], 206
+        self.send_response(status)
+        self.send_header('Content-Type', mime)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *ar):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), FileHandler)
+    server.requests, server.ignore_range = [], False
+    server.url = 'http://127.0.0.1:%d' % server.server_port
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_probe_is_ranged(server):
+    mime, size = img_scrap_stuff.probe_image(server.url + '/big.png', probe_bytes=1024)
+    assert (mime, size) == ('image/png', (1000, 800))
+    assert server.requests == [('/big.png', 'bytes=0-1023')]
+    assert img_scrap_stuff.probe_image(server.url + '/text.html') == ('text/html', None)
+
+
+def test_full_get_when_range_is_ignored(server):
+    server.ignore_range = True
+    assert img_scrap_stuff.probe_image(server.url + '/big.png')[1] == (1000, 800)
+    data, resp, held = img_scrap_stuff.do_horrible_thing(server.url + '/big.png')
+    # the probe was cut off, the download is the whole file
+    assert data == FILES['/big.png'][1]
+    assert held.size == len(data)
+    assert resp.status_code == 200
+    assert [rng for _, rng in server.requests] == ['bytes=0-16383', 'bytes=0-16383', None]
+
+
+def test_small_images_are_not_downloaded(server):
+    assert img_scrap_stuff.do_horrible_thing(server.url + '/small.png') is None
+    assert server.requests == [('/small.png', 'bytes=0-16383')]
+
+
+def test_horrible_things_skip_and_dedup(server):
+    skip = server.url + '/skip.png'
+    to_check, found = img_scrap_stuff.do_horrible_things(
+        server.url + '/page.html', urls_to_skip={skip: 1})
+    assert sorted(to_check) == sorted(server.url + path for path in (
+        '/big.png', '/small.png', '/text.html'))
+    assert [(url, data) for url, data, _ in found] == [
+        (server.url + '/big.png', FILES['/big.png'][1])]
+    # skipped urls are never requested; only the large image in full
+    paths = [path for path, _ in server.requests]
+    assert '/skip.png' not in paths
+    assert [path for path, rng in server.requests if rng is None] == ['/page.html', '/big.png']
+
+
+def test_horrible_things_bounded_fetches(server):
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def fetch_image(url, mime, size):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return url.encode(), None, None
+
+    to_check, found = img_scrap_stuff.do_horrible_things(
+        server.url + '/page.html', check_image_func=lambda url: ('image/png', None),
+        fetch_image_func=fetch_image)
+    assert [url for url, _, _ in found] == to_check
+    assert peak[0] <= img_scrap_stuff._FETCH_WORKERS
+    # nothing but the page is fetched in full here
+    assert [path for path, rng in server.requests if rng is None] == ['/page.html']
+
+
+def test_horrible_things_fetch_as_consumed(server):
+    started = []
+
+    def fetch_image(url, mime, size):
+        started.append(url)
+        return url.encode(), None, None
+
+    to_check, found = img_scrap_stuff.do_horrible_things(
+        server.url + '/page.html', check_image_func=lambda url: ('image/png', None),
+        fetch_image_func=fetch_image)
+    # nothing is downloaded before it's wanted, then a couple ahead at most
+    assert len(to_check) == 4 and started == []
+    assert next(found)[0] == to_check[0]
+    assert len(started) <= img_scrap_stuff._FETCH_WORKERS
+
+
+def flickr_url(num):
+    return 'https://www.flickr.com/photos/someone/%09d/' % num
+
+
+def fake_site(monkeypatch, links, delay=0):
+    """get_page over `links` (flickr_url(num) -> linked urls); returns the
+    fetched urls and the peak of concurrent fetches per host"""
+    fetched, active, peak = [], {}, {}
+    lock = threading.Lock()
+
+    def get_page(url, want=None):
+        host = url.split('/')[2]
+        with lock:
+            fetched.append(url)
+            active[host] = active.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), active[host])
+        time.sleep(delay)
+        with lock:
+            active[host] -= 1
+        num = int(url.rstrip('/').rsplit('/', 1)[1])
+        page_links = list(links.get(flickr_url(num), [])) + ['https://live.staticflickr.com/%d_o.jpg' % num]
+        return '', htmlparse.Page(links=page_links)
+
+    monkeypatch.setattr(img_scrap_stuff, 'get_page', get_page)
+    return fetched, peak
+
+
+def test_url_key():
+    key = img_scrap_stuff._url_key
+    assert key('https://WWW.Flickr.com/photos/x/') == key('https://www.flickr.com/photos/x')
+    assert key('https://www.flickr.com/photos/x?page=2') != key('https://www.flickr.com/photos/x')
+    assert key('https://www.flickr.com/Photos/x') != key('https://www.flickr.com/photos/x')
+
+
+def test_host_limiter():
+    limit = img_scrap_stuff._HostLimiter(2)
+    sem = limit('http://a.example.com/1')
+    assert limit('http://A.example.com/2') is sem
+    assert limit('http://b.example.com/1') is not sem
+    assert sem.acquire(False) and sem.acquire(False)
+    assert not sem.acquire(False)
+
+
+def test_crawl_flickr_visits_each_page_once(monkeypatch):
+    root = flickr_url(1)
+    links = {
+        # the same pages, differently spelled
+        root: [flickr_url(2), flickr_url(3), flickr_url(2).rstrip('/'),
+               flickr_url(3).replace('www.', 'WWW.')],
+        flickr_url(2): [root, flickr_url(3), flickr_url(4)],
+        flickr_url(3): [flickr_url(5)],
+        flickr_url(4): [flickr_url(6)],
+    }
+    fetched, _ = fake_site(monkeypatch, links)
+    ok, found = img_scrap_stuff.crawl_flickr(root, max_depth=2, workers=4)
+    assert ok
+    assert sorted(url.lower().rstrip('/') for url in fetched) == [
+        flickr_url(num).rstrip('/') for num in range(1, 6)]
+    assert found == ['https://live.staticflickr.com/%d_o.jpg' % num for num in range(1, 6)]
+
+    # depth 0: the album page only; a page cap counts the album too
+    del fetched[:]
+    img_scrap_stuff.crawl_flickr(root, max_depth=0)
+    assert fetched == [root]
+    del fetched[:]
+    img_scrap_stuff.crawl_flickr(root, max_depth=5, max_pages=3)
+    assert len(fetched) == 3
+
+
+def test_crawl_flickr_per_host_limit(monkeypatch):
+    root = flickr_url(1)
+    links = {root: [flickr_url(num) for num in range(2, 12)] +
+             ['https://other.flickr.com/photos/someone/%09d/' % num for num in range(12, 16)]}
+    fetched, peak = fake_site(monkeypatch, links, delay=0.05)
+    img_scrap_stuff.crawl_flickr(root, workers=8, per_host=2)
+    assert len(fetched) == 15
+    assert peak == {'www.flickr.com': 2, 'other.flickr.com': 2}
@@ -0,0 +1,63 @@
+import doctest
+
+import pytest
+
+from redditdownload import jobspec
+from redditdownload.jobspec import Job, JobSpecError
+
+
+def test_doctests():
+    assert doctest.testmod(jobspec).failed == 0
+
+
+def test_jsonl(tmpdir):
+    path = tmpdir.join('jobs.jsonl')
+    path.write('{"subreddit": "r/wallpapers", "sort-type": "top", "weight": 2}\n'
+               '\n'
+               '{"subreddit": "EarthPorn", "dir": "nature", "min_width": 1920}\n')
+    assert list(jobspec.iter_jobs(str(path), 'out')) == [
+        Job('wallpapers', 'out/wallpapers', (('sort_type', 'top'),), 2.0, 0),
+        Job('EarthPorn', 'out/nature', (('min_width', 1920),), 1.0, 0)]
+
+
+def test_json_array_is_read_in_chunks(tmpdir):
+    path = tmpdir.join('jobs.json')
+    path.write('[\n  {"subreddit": "a", "regex": "[a-z]+ , ]"},\n'
+               '  {"subreddit": "b", "num": 10}\n]\n')
+    with open(str(path)) as f:
+        entries = list(jobspec._iter_json_array(f, chunk_size=7))
+    assert entries == [{'subreddit': 'a', 'regex': '[a-z]+ , ]'},
+                       {'subreddit': 'b', 'num': 10}]
+    assert [job.subreddit for job in jobspec.iter_jobs(str(path), '.')] == ['a', 'b']
+
+
+def test_toml(tmpdir):
+    path = tmpdir.join('jobs.toml')
+    path.write('[[job]]\nsubreddit = "pics"\npriority = 3\nnsfw = true\n')
+    assert list(jobspec.iter_jobs(str(path), 'out')) == [
+        Job('pics', 'out/pics', (('nsfw', True),), 1.0, 3)]
+
+
+@pytest.mark.parametrize('content, message', [
+    ('{"subreddit": "pics", "verbose": true}\n', 'unknown option(s) verbose'),
+    ('{"dir": "x"}\n', 'no valid subreddit'),
+    ('{"subreddit": "pics", "weight": 0}\n', 'weight must be positive'),
+    ('{"subreddit": "pics"\n', 'line 1'),
+    ('["pics"]\n', 'job entries are mappings'),
+    ('{"subreddit": "pics", "nsfw": "false"}\n', 'nsfw is true or false'),
+    ('{"subreddit": "pics", "regex": ["a"]}\n', 'regex is a string or number'),
+    ('{"subreddit": "pics", "num": {"n": 1}}\n', 'num is a string or number'),
+])
+def test_errors(tmpdir, content, message):
+    path = tmpdir.join('jobs.jsonl')
+    path.write(content)
+    with pytest.raises(JobSpecError) as exc:
+        list(jobspec.iter_jobs(str(path), '.'))
+    assert message in str(exc.value)
+
+
+def test_flag_options_are_the_flags():
+    make_parser = pytest.importorskip('redditdownload.redditdownload').make_parser
+    flags = [action.dest for action in make_parser()._actions
+             if action.dest in jobspec.ENTRY_OPTIONS and action.nargs == 0]
+    assert sorted(flags) == sorted(jobspec.FLAG_OPTIONS)
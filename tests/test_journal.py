@@ -0,0 +1,90 @@
+import io
+import json
+from collections import namedtuple
+
+import pytest
+
+from redditdownload import journal
+
+
+Result = namedtuple('Result', 'status subreddit item_id url path reason error elapsed')
+
+
+def result(n, status='downloaded'):
+    return Result(status, 'pics', 'id%i' % n, 'http://example.com/%i.png' % n,
+                  '/pics/id%i.png' % n, None, None, 0.25)
+
+
+def read(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_journal_batches_and_closes(tmpdir):
+    path = str(tmpdir.join('journal.jsl'))
+    log = journal.Journal(path, queue_size=10, batch_size=4, flush_interval=60)
+    for n in range(25):
+        log.record(result(n))
+    log.close()
+    events = read(path)
+    assert [event['id'] for event in events] == ['id%i' % n for n in range(25)]
+    assert events[0]['event'] == 'downloaded'
+    assert events[0]['elapsed'] == 0.25
+    assert set(events[0]) == {'time', 'event', 'subreddit', 'id', 'url', 'path',
+                              'reason', 'error', 'elapsed'}
+
+    # usable again, appends
+    log.record(result(25, 'failed')._replace(error='URLError'))
+    log.close()
+    assert read(path)[-1]['error'] == 'URLError'
+    assert len(read(path)) == 26
+
+
+def test_journal_close_without_events(tmpdir):
+    path = tmpdir.join('journal.jsl')
+    journal.Journal(str(path)).close()
+    assert path.read() == ''
+
+
+def test_console_rate_limit():
+    now = [0.0]
+    out = io.StringIO()
+    console = journal.Console(lambda r: r.item_id if r.status != 'exists' else None,
+                              rate=2, out=out, clock=lambda: now[0])
+    for n in range(5):
+        console(result(n))
+    console(result(5, 'exists'))  # not shown at all
+    console(result(6, 'failed'))
+    now[0] = 1.5
+    console(result(7))
+    console.summarize()
+    assert out.getvalue().splitlines() == [
+        'id0', 'id1', '    ... 4 more (3 downloaded, 1 failed)', 'id7']
+
+
+def test_console_unlimited():
+    out = io.StringIO()
+    console = journal.Console(lambda r: r.item_id, rate=0, out=out, clock=lambda: 0)
+    for n in range(50):
+        console(result(n))
+    assert len(out.getvalue().splitlines()) == 50
+
+
+def test_bad_path_fails_up_front(tmpdir):
+    with pytest.raises(IOError):
+        journal.Journal(str(tmpdir.join('missing', 'j.jsl')), queue_size=5)
+
+
+def test_write_errors_dont_block(tmpdir):
+    class FullDisk(io.StringIO):
+        def write(self, text):
+            raise OSError(28, 'No space left on device')
+        writelines = write
+
+    log = journal.Journal(str(tmpdir.join('j.jsl')), queue_size=2, batch_size=1)
+    log._fo.close()
+    log._fo = FullDisk()
+    # more events than the queue holds: the writer keeps draining it
+    for n in range(20):
+        log.record(result(n))
+    log.close()
@@ -0,0 +1,21 @@
+from redditdownload.plugins.jsobjects import get_all_objects, iter_object_spans
+
+
+def test_strings_and_nesting():
+    text = ('<p>It\'s {not json}</p><script>var a = {"u": "http:\\/\\/x\\"}{", '
+            '"n": {"k": [1, 2]}}; var b = {c: 1};</script>')
+    res = list(get_all_objects(text))
+    assert {'u': 'http://x"}{', 'n': {'k': [1, 2]}} in res
+    assert {'c': 1} in res
+    # nested objects of a decoded object are not repeated
+    assert {'k': [1, 2]} not in res
+
+
+def test_json_only():
+    assert list(get_all_objects('x = {a: 1}', lenient=False)) == []
+    assert list(get_all_objects(b'x = {"a": 1}', lenient=False)) == [{'a': 1}]
+
+
+def test_unbalanced():
+    text = '}} { "a": 1 } {{ "b": '
+    assert [text[a:b] for a, b in iter_object_spans(text)] == ['{ "a": 1 }']
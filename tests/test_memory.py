@@ -0,0 +1,74 @@
+import doctest
+import threading
+import time
+
+from redditdownload import memory
+
+
+def test_doctests():
+    assert doctest.testmod(memory).failed == 0
+
+
+def test_work_waits_for_room():
+    budget = memory.MemoryBudget(100, rss=lambda: None, poll_interval=0.01)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def worker():
+        with budget.reserve(60):
+            acquired.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired.is_set()
+    budget.release(60)
+    thread.join(1)
+    assert acquired.is_set()
+    assert (budget.used, budget.peak, budget.waits) == (0, 60, 1)
+
+
+def test_oversized_work_goes_through_alone():
+    budget = memory.MemoryBudget(100, rss=lambda: None)
+    with budget.reserve(500):
+        assert budget.used == 500
+    # read-ahead doesn't block work (it never waits itself)
+    assert budget.try_acquire(80)
+    with budget.reserve(50):
+        assert budget.used == 130
+    assert not budget.try_acquire(80)
+    assert budget.try_acquire(80, force=True)
+
+
+def test_rss_over_budget():
+    rss = [50]
+    budget = memory.MemoryBudget(100, rss=lambda: rss[0])
+    assert budget.try_acquire(10)
+    rss[0] = 150
+    assert not budget.try_acquire(10)
+    report = budget.report()
+    assert (report['limit'], report['reserved'], report['reserved_peak']) == (100, 10, 10)
+
+
+def test_module_functions_without_budget():
+    memory.configure(None)
+    with memory.reserve(10 ** 12):
+        pass
+    assert memory.try_acquire(10 ** 12)
+    assert 'limit' not in memory.report()
+
+
+def test_held_buffers(monkeypatch):
+    budget = memory.MemoryBudget(100, rss=lambda: None)
+    monkeypatch.setattr(memory, '_budget', budget)
+    held = memory.hold(80)
+    assert budget.used == 80
+    # no other work in flight: work doesn't wait for held buffers
+    with memory.reserve(50):
+        assert budget.used == 130
+    held.release()
+    held.release()
+    assert budget.used == 0
+    held = memory.hold(30)
+    del held  # dropped without release
+    assert budget.used == 0
@@ -0,0 +1,35 @@
+from redditdownload.plugins.parse_subreddit_list import group_subreddits
+
+
+def test_group_subreddits():
+    entries = [('pics', '/p/pics'), ('aww', '/p/aww'), ('Pics', '/q/pics'),
+               ('gifs', '/p/gifs')]
+    groups = group_subreddits(entries)
+    # the duplicate subreddit can't share a listing with the other one
+    assert groups == [
+        ('aww+gifs+Pics', {'pics': ('Pics', '/q/pics'), 'aww': ('aww', '/p/aww'),
+                           'gifs': ('gifs', '/p/gifs')}),
+        ('pics', {'pics': ('pics', '/p/pics')})]
+
+
+def test_group_limits_and_key():
+    entries = [('sub%02d' % i, '/d') for i in range(10)]
+    groups = group_subreddits(entries, max_count=4)
+    assert sorted(len(routes) for _, routes in groups) == [2, 2, 3, 3]
+    assert all(len(routes) <= 4 for _, routes in groups)
+    groups = group_subreddits(entries, max_length=len('sub00+sub01'))
+    assert all(len(name) <= len('sub00+sub01') for name, _ in groups)
+    groups = group_subreddits(entries, key=lambda entry: int(entry[0][-1]) % 2)
+    assert [name for name, _ in groups] == [
+        'sub00+sub02+sub04+sub06+sub08', 'sub01+sub03+sub05+sub07+sub09']
+
+
+def test_grouping_is_stable():
+    entries = [('sub%02d' % i, '/d') for i in range(40)]
+    groups = dict(group_subreddits(entries, max_count=10))
+    # order doesn't matter, an edit only renames the group it touches
+    assert dict(group_subreddits(entries[::-1], max_count=10)) == groups
+    edited = dict(group_subreddits(entries[1:] + [('new', '/d')], max_count=10))
+    assert len(set(groups) - set(edited)) <= 2
+    assert sorted(sum((list(routes) for routes in edited.values()), [])) == sorted(
+        ['new'] + ['sub%02d' % i for i in range(1, 40)])
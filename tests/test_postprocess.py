@@ -0,0 +1,98 @@
+import os
+import json
+import stat
+
+import pytest
+
+from redditdownload import postprocess, cpupool, memory
+
+
+@pytest.fixture
+def ffmpeg(tmpdir):
+    """Stand-in ffmpeg writing a small file to its last argument"""
+    path = tmpdir.join('ffmpeg')
+    path.write('#!/bin/sh\nfor last; do :; done\nprintf mp4 > "$last"\n')
+    os.chmod(str(path), os.stat(str(path)).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_gif_to_mp4(tmpdir, ffmpeg):
+    gif = tmpdir.join('abc.gif')
+    gif.write(b'GIF89a' + b'x' * 100, mode='wb')
+    record = postprocess.task_postprocess(str(gif), ffmpeg=ffmpeg)
+    assert record['error'] is None
+    assert record['actions'] == ['mp4']
+    assert record['new_path'] == str(tmpdir.join('abc.mp4'))
+    assert (record['size'], record['new_size']) == (106, 3)
+    assert not gif.exists() and tmpdir.join('abc.mp4').read() == 'mp4'
+    assert postprocess.ratio(record) == 0.028
+
+
+def test_untouched_and_errors(tmpdir, ffmpeg):
+    other = tmpdir.join('abc.txt')
+    other.write('text')
+    record = postprocess.task_postprocess(str(other), (10, 10), 80, ffmpeg)
+    assert record['actions'] == [] and record['error'] is None
+    record = postprocess.task_postprocess(str(tmpdir.join('gone.gif')), ffmpeg=ffmpeg)
+    assert record['error'].startswith('FileNotFoundError')
+
+
+def test_downscale_and_recompress(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmpdir.join('big.jpg'))
+    Image.new('RGB', (400, 200), (200, 10, 10)).save(path, quality=100)
+    record = postprocess.task_postprocess(path, (100, 100), 60)
+    assert record['actions'] == ['resize 100x50', 'quality 60']
+    assert record['new_size'] < record['size']
+    with Image.open(path) as img:
+        assert img.size == (100, 50)
+
+
+def test_recompress_keeps_the_colour_profile(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    ImageCms = pytest.importorskip('PIL.ImageCms')
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    path = str(tmpdir.join('wide.jpg'))
+    Image.new('RGB', (400, 200), (200, 10, 10)).save(path, quality=100, icc_profile=profile)
+    assert postprocess.task_postprocess(path, None, 60)['actions'] == ['quality 60']
+    with Image.open(path) as img:
+        assert img.info.get('icc_profile') == profile
+
+
+def test_postprocessor_records(tmpdir, ffmpeg, monkeypatch):
+    monkeypatch.setattr(postprocess.shutil, 'which', lambda name: ffmpeg)
+    cpupool.configure(0)
+    gif = tmpdir.join('abc.gif')
+    gif.write('x' * 100)
+    tmpdir.join('keep.gif').write('x')  # ffmpeg's output would be bigger
+    processor = postprocess.Postprocessor(gif_to_mp4=True)
+    processor.submit(str(gif), id='abc', url='http://i.imgur.com/abc.gif')
+    processor.submit(str(tmpdir.join('keep.gif')), id='keep')
+    records = sorted(processor.done(wait_all=True), key=lambda record: record['id'])
+    assert [(r['id'], r['actions']) for r in records] == [('abc', ['mp4']), ('keep', [])]
+    assert records[0]['ratio'] == 0.03
+    assert processor.converted(str(gif)) == str(tmpdir.join('abc.mp4'))
+
+    # the record file has the changed files only, and is read back
+    with open(str(tmpdir.join(postprocess.RECORD_FILE))) as f:
+        saved = [json.loads(line) for line in f]
+    assert [record['id'] for record in saved] == ['abc']
+    assert saved[0]['url'] == 'http://i.imgur.com/abc.gif'
+    processor = postprocess.Postprocessor()
+    assert processor.converted(str(gif)) == str(tmpdir.join('abc.mp4'))
+    assert processor.converted(str(tmpdir.join('keep.gif'))) is None
+
+
+def test_postprocessor_reserves_decoded_size(tmpdir, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    budget = memory.MemoryBudget(10 ** 9, rss=lambda: None)
+    monkeypatch.setattr(memory, '_budget', budget)
+    cpupool.configure(0)
+    path = str(tmpdir.join('big.png'))
+    Image.new('RGB', (400, 200)).save(path)
+    assert postprocess.decoded_size(path) == 400 * 200 * 4
+    processor = postprocess.Postprocessor(max_size=(100, 100))
+    processor.submit(path, id='big')
+    processor.done(wait_all=True)
+    # held by the submitter while the job ran (in whichever process)
+    assert budget.peak == 400 * 200 * 4 and budget.used == 0
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+
+from redditdownload import quota
+
+
+def download(root, name, size):
+    path = os.path.join(root, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_evicts_oldest_down_to_low_water(tmpdir):
+    root = str(tmpdir)
+    folder = quota.Quota(root, max_bytes=1000, low_water=0.5)
+    for n in range(5):
+        assert folder.add(download(root, '%i.jpg' % n, 200), 200, 'id%i' % n) == []
+    assert folder.size == 1000
+    evicted = folder.add(download(root, '5.jpg', 200), 200, 'id5')
+    # down to 500 bytes, oldest first
+    assert evicted == [(os.path.join(root, '%i.jpg' % n), 'id%i' % n) for n in range(4)]
+    assert set(os.listdir(root)) == {'4.jpg', '5.jpg', quota.QUOTA_FILE}
+    assert folder.size == 400
+    assert folder.was_evicted('id0') and not folder.was_evicted('id5')
+    folder.close()
+
+    # the index is reloaded, not rescanned
+    folder = quota.Quota(root, max_bytes=1000)
+    assert folder.size == 400 and len(folder.files) == 2
+    assert folder.was_evicted('id3')
+
+
+def test_max_files_and_never_the_new_file(tmpdir):
+    root = str(tmpdir)
+    folder = quota.Quota(root, max_files=1, low_water=0.5)
+    folder.add(download(root, 'a.jpg', 10), 10, 'a')
+    assert folder.add(download(root, 'b.jpg', 10), 10, 'b') == [
+        (os.path.join(root, 'a.jpg'), 'a')]
+    assert list(folder.files) == ['b.jpg']
+
+
+def test_lru(tmpdir):
+    root = str(tmpdir)
+    folder = quota.Quota(root, max_files=2, policy='lru', low_water=1)
+    for name in ('a.jpg', 'b.jpg'):
+        folder.add(download(root, name, 10), 10, name[0])
+    # a was viewed recently, b wasn't
+    now = time.time()
+    os.utime(os.path.join(root, 'a.jpg'), (now + 100, now - 100))
+    os.utime(os.path.join(root, 'b.jpg'), (now - 50, now - 50))
+    evicted = folder.add(download(root, 'c.jpg', 10), 10, 'c')
+    assert evicted == [(os.path.join(root, 'b.jpg'), 'b')]
+
+
+
+def test_lru_stats_the_oldest_only(tmpdir, monkeypatch):
+    root = str(tmpdir)
+    now = time.time()
+    with open(os.path.join(root, quota.QUOTA_FILE), 'w') as f:
+        for num in range(100):
+            name = '%03d.jpg' % num
+            added = now - (100 - num) * 3600
+            download(root, name, 10)
+            os.utime(os.path.join(root, name), (added, added))
+            f.write(json.dumps(dict(path=name, size=10, time=added, id=name[:3])) + '\n')
+    # the oldest one was viewed recently
+    os.utime(os.path.join(root, '000.jpg'), (now, now - 100 * 3600))
+    folder = quota.Quota(root, max_files=100, policy='lru')
+    stats = []
+    real_stat = os.stat
+
+    def stat(path, *ar, **kwa):
+        stats.append(path)
+        return real_stat(path, *ar, **kwa)
+    monkeypatch.setattr(os, 'stat', stat)
+    evicted = folder.add(download(root, 'new.jpg', 10), 10, 'new')
+    assert [item_id for _, item_id in evicted] == ['%03d' % num for num in range(1, 12)]
+    assert len(stats) < 20
+
+def test_first_use_scans_the_folder(tmpdir):
+    root = str(tmpdir)
+    download(root, 'old.jpg', 300)
+    download(root, '._history.txt', 50)
+    tmpdir.mkdir('sub')
+    download(str(tmpdir.join('sub')), 'other.jpg', 300)
+    folder = quota.Quota(root, max_bytes=500)
+    assert list(folder.files) == ['old.jpg'] and folder.size == 300
+    assert folder.add(download(root, 'new.jpg', 300), 300, 'new') == [
+        (os.path.join(root, 'old.jpg'), None)]
+
+
+def test_index_is_compacted(tmpdir):
+    root = str(tmpdir)
+    folder = quota.Quota(root, max_files=2, low_water=1)
+    for n in range(200):
+        folder.add(download(root, '%i.jpg' % n, 1), 1, 'id%i' % n)
+    folder.close()
+    with open(os.path.join(root, quota.QUOTA_FILE)) as f:
+        lines = len(f.readlines())
+    assert lines <= 2 * (2 + 198) + 100
+    folder = quota.Quota(root, max_files=2)
+    assert sorted(folder.files) == ['198.jpg', '199.jpg']
+    assert len(folder.evicted) == 198
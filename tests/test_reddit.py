@@ -1,13 +1,15 @@
 import json
 try:  # py3
     from unittest import mock
+    from urllib.error import HTTPError
 except ImportError:  # py2
     import mock
     from urllib2 import HTTPError
 
 import pytest
 
-from redditdownload.reddit import getitems
+from redditdownload.plugins.reddit import getitems
+from redditdownload.Exceptions import RedditAPIException
 
 
 def test_empty_string():
@@ -16,8 +18,8 @@ def test_empty_string():
     assert isinstance(res, list)
     assert len(res) > 0
 
-@mock.patch('redditdownload.reddit.urlopen')
-@mock.patch('redditdownload.reddit.Request')
+@mock.patch('redditdownload.plugins.reddit.urlopen')
+@mock.patch('redditdownload.plugins.reddit.Request')
 def test_empty_string_mock(mock_requests, mock_urlopen):
     """test empty string but with mocking external dependencies.
 
@@ -28,9 +30,9 @@ def test_empty_string_mock(mock_requests, mock_urlopen):
     """
     expected_url = 'http://www.reddit.com/r/.json'
     mock_resp = mock.Mock()
-    mock_items = range(5)
+    mock_items = list(range(5))
     mock_data = [{'data' :x} for x in mock_items]
-    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}})
+    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}}).encode('utf-8')
     mock_urlopen.return_value = mock_resp
 
     res = getitems("")
@@ -39,14 +41,14 @@ def test_empty_string_mock(mock_requests, mock_urlopen):
     mock_requests.assert_called_once_with(expected_url, headers=mock.ANY)
 
 
-@mock.patch('redditdownload.reddit.urlopen')
-@mock.patch('redditdownload.reddit.Request')
+@mock.patch('redditdownload.plugins.reddit.urlopen')
+@mock.patch('redditdownload.plugins.reddit.Request')
 def test_sort_type(mock_requests, mock_urlopen):
     """test sort_type."""
     mock_resp = mock.Mock()
-    mock_items = range(5)
+    mock_items = list(range(5))
     mock_data = [{'data' :x} for x in mock_items]
-    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}})
+    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}}).encode('utf-8')
     mock_urlopen.return_value = mock_resp
 
     # sort_type none, input is multireddit
@@ -84,15 +86,15 @@ def test_sort_type(mock_requests, mock_urlopen):
 
             mock_requests.assert_called_once_with(expected_url, headers=mock.ANY)
 
-@mock.patch('redditdownload.reddit.urlopen')
-@mock.patch('redditdownload.reddit.Request')
+@mock.patch('redditdownload.plugins.reddit.urlopen')
+@mock.patch('redditdownload.plugins.reddit.Request')
 def test_advanced_sort_and_last_id(mock_requests, mock_urlopen):
     """test for advanced sort and last id."""
     last_id = '44h81z'
     mock_resp = mock.Mock()
-    mock_items = range(5)
+    mock_items = list(range(5))
     mock_data = [{'data' :x} for x in mock_items]
-    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}})
+    mock_resp.read.return_value = json.dumps({'data':{'children':mock_data}}).encode('utf-8')
     mock_urlopen.return_value = mock_resp
 
     # test with advanced_sort
@@ -109,36 +111,31 @@ def test_advanced_sort_and_last_id(mock_requests, mock_urlopen):
             mock_requests.assert_called_once_with(expected_url, headers=mock.ANY)
 
 
-@mock.patch('redditdownload.reddit.Request')
+@mock.patch('redditdownload.plugins.reddit.Request')
 def test_raise_error_on_request(mock_requests):
     """test when error raised on requests."""
-    errors = [
-        HTTPError(None, 404, 'mock error', None, None), KeyboardInterrupt]
-    for error in  errors:
-        mock_requests.side_effect = error
+    mock_requests.side_effect = HTTPError(None, 404, 'mock error', None, None)
+    with pytest.raises(RedditAPIException):
+        getitems('cats')
 
-        with pytest.raises(SystemExit):
-            getitems('cats')
+    # interrupting is left to the caller
+    mock_requests.side_effect = KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        getitems('cats')
 
-@mock.patch('redditdownload.reddit.Request')
+@mock.patch('redditdownload.plugins.reddit.Request')
 def test_value_error_on_request(mock_requests):
     """test value error on requests."""
-    mock_requests.side_effect = ValueError('Mock error')
-    with pytest.raises(ValueError):
-        getitems('cats')
-
-    # value error contain specific message which raise other error.
-    msg = 'No JSON object could be decoded'
-    mock_requests.side_effect = ValueError(msg)
-    with pytest.raises(SystemExit):
+    mock_requests.side_effect = ValueError('No JSON object could be decoded')
+    with pytest.raises(RedditAPIException):
         getitems('cats')
 
 def test_error_on_multireddit_input():
     """test wrong multireddit flag on multireddit input."""
     # multireddit flag raised but input is normal subreddit
-    with pytest.raises(SystemExit):
+    with pytest.raises(ValueError):
         getitems('cats', multireddit=True)
 
     # multireddit input given but multireddit flag is False
-    with pytest.raises(SystemExit):
+    with pytest.raises(ValueError):
         getitems('someuser/m/some_multireddit', multireddit=False)
@@ -0,0 +1,358 @@
+import os
+import json
+import logging
+import asyncio
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('requests')
+
+from redditdownload.redditdownload import RedditImageGrab, DownloadResult, main
+from redditdownload.catalog import Catalog
+from redditdownload.Exceptions import FileExistsException, RedditAPIException
+
+
+def make_items():
+    return [
+        dict(id='c', url='http://example.com/c.png', score=10, over_18=False,
+             title='c', subreddit='pics', created_utc=300),
+        dict(id='b', url='http://example.com/b.png', score=1, over_18=False,
+             title='b', subreddit='pics', created_utc=200),
+        dict(id='a', url='http://example.com/a.png', score=10, over_18=False,
+             title='a', subreddit='pics', created_utc=100),
+    ]
+
+
+def make_item(id, created_utc, subreddit='pics'):
+    return dict(id=id, url='http://example.com/%s.png' % id, score=1, over_18=False,
+                title=id, subreddit=subreddit, created_utc=created_utc)
+
+
+def saved_mark(folder, sort_type):
+    history = json.loads(folder.join('._history.txt').read())
+    return history['pics'][sort_type].get('watermark')
+
+
+def fake_download(url, dest_file, size_filter=None, sink=None):
+    if url.endswith('a.png'):
+        raise FileExistsException('a.png already downloaded.')
+    return 123, '0' * 40
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_run_streams_results(mock_getitems, mock_download, mock_sleep, tmpdir):
+    mock_getitems.side_effect = [make_items(), []]
+    grab = RedditImageGrab('pics', str(tmpdir), score=5)
+    results = list(grab.run())
+    assert [(r.status, r.item_id) for r in results] == [
+        (DownloadResult.DOWNLOADED, 'c'),
+        (DownloadResult.SKIPPED, 'b'),
+        (DownloadResult.EXISTS, 'a')]
+    assert results[0].path == str(tmpdir.join('c.png'))
+    assert grab.stats['processed'] == 3
+    # resumes after the last submission
+    assert mock_getitems.call_args_list[-1][1]['previd'] == 'a'
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_arun(mock_getitems, mock_download, mock_sleep, tmpdir):
+    mock_getitems.side_effect = [make_items(), []]
+    grab = RedditImageGrab('pics', str(tmpdir), num=1)
+
+    async def collect():
+        return [result async for result in grab.arun()]
+
+    results = asyncio.run(collect())
+    assert [r.status for r in results] == [DownloadResult.DOWNLOADED]
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_catalog(mock_getitems, mock_download, mock_sleep, tmpdir):
+    mock_getitems.side_effect = [make_items(), []]
+    path = str(tmpdir.join('cat.sqlite'))
+    list(RedditImageGrab('pics', str(tmpdir), score=5, catalog=path).run())
+    # flushed and closed
+    assert not os.path.exists(path + '-wal')
+    # only what was downloaded
+    assert Catalog(path).search() == [('c', 'pics', 10, 'c', str(tmpdir.join('c.png')))]
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_journal(mock_getitems, mock_download, mock_sleep, tmpdir):
+    mock_getitems.side_effect = [make_items(), []]
+    path = str(tmpdir.join('journal.jsl'))
+    results = list(RedditImageGrab('pics', str(tmpdir), score=5, journal=path).run())
+    with open(path) as f:
+        events = [json.loads(line) for line in f]
+    assert [(e['event'], e['id']) for e in events] == [
+        (r.status, r.item_id) for r in results]
+    assert events[1]['reason'].startswith('SCORE')
+    assert all(e['elapsed'] >= 0 for e in events)
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.budget.head_size', side_effect=lambda url: 100 if 'b' in url else 50)
+@mock.patch('redditdownload.redditdownload.download_from_url')
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_byte_budget(mock_getitems, mock_download, mock_head, mock_sleep, tmpdir):
+    def download(url, dest_file, size_filter=None, sink=None):
+        return (100 if 'b' in url else 50), '0' * 40
+    mock_download.side_effect = download
+    items = make_items()
+    items[0]['score'] = 5  # c, a, then b
+    items[1]['score'] = 10
+    items[2]['score'] = 20
+    mock_getitems.side_effect = [items, []]
+    # a fits, b doesn't, c fits
+    grab = RedditImageGrab('pics', str(tmpdir), byte_budget=120 / 2.0 ** 20)
+    assert [(r.status, r.item_id) for r in grab.run()] == [
+        (DownloadResult.DOWNLOADED, 'a'),
+        (DownloadResult.SKIPPED, 'b'),
+        (DownloadResult.DOWNLOADED, 'c')]
+    assert grab.budget.bytes_left == 20
+    # the whole page is done, b is checkpointed
+    assert mock_getitems.call_args_list[-1][1]['previd'] == 'a'
+
+    # next time b goes first, then the budget is used up
+    mock_getitems.side_effect = [[dict(items[0], id='e')], []]
+    grab = RedditImageGrab('pics', str(tmpdir), byte_budget=150 / 2.0 ** 20)
+    assert [(r.status, r.item_id) for r in grab.run()] == [
+        (DownloadResult.DOWNLOADED, 'b'),
+        (DownloadResult.DOWNLOADED, 'e')]
+    assert grab.budget.exhausted()
+    assert not tmpdir.join('._deferred.json').read().count('"id"')
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url')
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_quota(mock_getitems, mock_download, mock_sleep, tmpdir):
+    def download(url, dest_file, size_filter=None, sink=None):
+        with open(dest_file, 'wb') as f:
+            f.write(b'x' * 100)
+        return 100, '0' * 40
+    mock_download.side_effect = download
+    mock_getitems.side_effect = [make_items(), []]
+    grab = RedditImageGrab('pics', str(tmpdir), max_files=1)
+    assert [(r.status, r.item_id) for r in grab.run()] == [
+        (DownloadResult.DOWNLOADED, 'c'),
+        (DownloadResult.DOWNLOADED, 'b'),
+        (DownloadResult.EVICTED, 'c'),
+        (DownloadResult.DOWNLOADED, 'a'),
+        (DownloadResult.EVICTED, 'b')]
+    assert tmpdir.join('a.png').exists() and not tmpdir.join('c.png').exists()
+
+    # evicted submissions are not downloaded again
+    mock_getitems.side_effect = [make_items(), []]
+    grab = RedditImageGrab('pics', str(tmpdir), max_files=1, restart=True)
+    assert [(r.status, r.item_id) for r in grab.run()][:2] == [
+        (DownloadResult.SKIPPED, 'c'),
+        (DownloadResult.SKIPPED, 'b')]
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_job_spec(mock_getitems, mock_download, mock_sleep, tmpdir):
+    spec = tmpdir.join('jobs.jsonl')
+    spec.write('{"subreddit": "quiet", "num": 3}\n'
+               '{"subreddit": "pics", "dir": "nature", "score": "5", "priority": 1}\n')
+    mock_getitems.side_effect = [make_items(), [], []]
+    grab = RedditImageGrab(str(spec), str(tmpdir))
+    results = list(grab.run())
+    # the higher priority first, with its own options
+    assert mock_getitems.call_args_list[0][0][0] == 'pics'
+    assert [(r.status, r.item_id) for r in results] == [
+        (DownloadResult.DOWNLOADED, 'c'),
+        (DownloadResult.SKIPPED, 'b'),
+        (DownloadResult.EXISTS, 'a')]
+    assert results[0].path == str(tmpdir.join('nature', 'c.png'))
+    # nothing was written for the empty one: no folder
+    assert not tmpdir.join('quiet').exists()
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_combined_listings(mock_getitems, mock_download, mock_sleep, tmpdir):
+    def item(id, subreddit, created_utc):
+        return dict(id=id, url='http://example.com/%s.png' % id, score=1, over_18=False,
+                    title=id, subreddit=subreddit, created_utc=created_utc)
+    subs = tmpdir.join('subs.txt')
+    subs.write('pics\naww\ngifs\n')
+    out = tmpdir.join('out')
+    options = dict(batch_subreddits=True, incremental=True, sort_type='new')
+    mock_getitems.side_effect = [[item('f', 'aww', 600), item('e', 'pics', 500),
+                                  item('d', 'gifs', 400)], []]
+    results = list(RedditImageGrab(str(subs), str(out), **options).run())
+    # one listing for the three, each post saved in its subreddit's folder
+    assert mock_getitems.call_args_list[0][0][0] == 'aww+gifs+pics'
+    assert [r.path for r in results] == [str(out.join(sub, '%s.png' % id))
+                                         for id, sub in (('f', 'aww'), ('e', 'pics'),
+                                                         ('d', 'gifs'))]
+    for sub in ('aww', 'pics', 'gifs'):
+        history = json.loads(out.join(sub, '._history.txt').read())
+        assert history[sub]['new']['watermark'] == {'created_utc': 600.0, 'id': 'f'}
+
+    # gifs is dropped: the listing is renamed, its subreddits' marks still apply
+    subs.write('pics\naww\n')
+    mock_getitems.side_effect = [[item('g', 'pics', 700), item('f', 'aww', 600),
+                                  item('e', 'pics', 500)]]
+    results = list(RedditImageGrab(str(subs), str(out), **options).run())
+    assert mock_getitems.call_args_list[-1][0][0] == 'aww+pics'
+    assert [r.item_id for r in results] == ['g']
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url')
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_gif_to_mp4(mock_getitems, mock_download, mock_sleep, tmpdir):
+    ffmpeg = tmpdir.join('ffmpeg')
+    ffmpeg.write('#!/bin/sh\nfor last; do :; done\nprintf mp4 > "$last"\n')
+    ffmpeg.chmod(0o755)
+    folder = tmpdir.mkdir('pics')
+
+    def download(url, dest_file, size_filter=None, sink=None):
+        with open(dest_file, 'wb') as f:
+            f.write(b'x' * 100)
+        return 100, '0' * 40
+    mock_download.side_effect = download
+    item = dict(make_items()[0], url='http://example.com/c.gif')
+    mock_getitems.side_effect = [[item], []]
+    with mock.patch('redditdownload.postprocess.shutil.which', return_value=str(ffmpeg)):
+        grab = RedditImageGrab('pics', str(folder), gif_to_mp4=True, max_files=10)
+    results = list(grab.run())
+    assert [r.status for r in results] == [DownloadResult.DOWNLOADED,
+                                           DownloadResult.TRANSCODED]
+    assert results[1].path == str(folder.join('c.mp4'))
+    assert results[1].reason == 'mp4: 100 -> 3 bytes (3%)'
+    assert list(grab._quota(str(folder)).files) == ['c.mp4']
+
+    # the gif is known to be downloaded
+    mock_getitems.side_effect = [[item], []]
+    grab = RedditImageGrab('pics', str(folder), gif_to_mp4=True, restart=True)
+    assert [r.status for r in grab.run()] == [DownloadResult.EXISTS]
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_incremental_stops_at_the_mark(mock_getitems, mock_download, mock_sleep, tmpdir):
+    options = dict(incremental=True, sort_type='new')
+    mock_getitems.side_effect = [[make_item('c', 300), make_item('b', 200)], []]
+    list(RedditImageGrab('pics', str(tmpdir), **options).run())
+    assert saved_mark(tmpdir, 'new') == {'created_utc': 300.0, 'id': 'c'}
+
+    # the listing is walked from the top, down to the mark only
+    mock_getitems.reset_mock()
+    mock_getitems.side_effect = [[make_item('e', 500), make_item('d', 400),
+                                  make_item('c', 300), make_item('b', 200)],
+                                 [make_item('x', 100)]]
+    results = list(RedditImageGrab('pics', str(tmpdir), **options).run())
+    assert [(r.status, r.item_id) for r in results] == [
+        (DownloadResult.DOWNLOADED, 'e'), (DownloadResult.DOWNLOADED, 'd')]
+    assert mock_getitems.call_count == 1
+    assert mock_getitems.call_args[1]['previd'] == ''
+    assert saved_mark(tmpdir, 'new') == {'created_utc': 500.0, 'id': 'e'}
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_incremental_num_keeps_the_mark(mock_getitems, mock_download, mock_sleep, tmpdir):
+    options = dict(incremental=True, sort_type='new')
+    mock_getitems.side_effect = [[make_item('c', 300)], []]
+    list(RedditImageGrab('pics', str(tmpdir), **options).run())
+
+    # stopped by --num above the mark: d is still unseen, the mark stays
+    mock_getitems.side_effect = [[make_item('e', 500), make_item('d', 400),
+                                  make_item('c', 300)]]
+    results = list(RedditImageGrab('pics', str(tmpdir), num=1, **options).run())
+    assert [r.item_id for r in results] == ['e']
+    assert saved_mark(tmpdir, 'new') == {'created_utc': 300.0, 'id': 'c'}
+
+    mock_getitems.side_effect = [[make_item('e', 500), make_item('d', 400),
+                                  make_item('c', 300)]]
+    results = list(RedditImageGrab('pics', str(tmpdir), **options).run())
+    assert [r.item_id for r in results] == ['e', 'd']
+    assert saved_mark(tmpdir, 'new') == {'created_utc': 500.0, 'id': 'e'}
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_incremental_hot_stops_after_an_old_page(mock_getitems, mock_download, mock_sleep,
+                                                 tmpdir):
+    options = dict(incremental=True, sort_type='hot')
+    mock_getitems.side_effect = [[make_item('c', 300), make_item('b', 200)], []]
+    list(RedditImageGrab('pics', str(tmpdir), **options).run())
+
+    # not time-ordered: old posts are passed over until a page has nothing new
+    mock_getitems.reset_mock()
+    mock_getitems.side_effect = [[make_item('b', 200), make_item('f', 600)],
+                                 [make_item('c', 300), make_item('x', 100)],
+                                 [make_item('g', 700)]]
+    results = list(RedditImageGrab('pics', str(tmpdir), **options).run())
+    assert [(r.status, r.item_id) for r in results] == [
+        (DownloadResult.SKIPPED, 'b'), (DownloadResult.DOWNLOADED, 'f'),
+        (DownloadResult.SKIPPED, 'c'), (DownloadResult.SKIPPED, 'x')]
+    assert mock_getitems.call_count == 2
+    assert saved_mark(tmpdir, 'hot') == {'created_utc': 600.0, 'id': 'f'}
+
+
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_errors_are_raised(mock_getitems, tmpdir):
+    mock_getitems.side_effect = RedditAPIException('HTTP ERROR: Code 403')
+    with pytest.raises(RedditAPIException):
+        list(RedditImageGrab('pics', str(tmpdir)).run())
+    with pytest.raises(TypeError):
+        RedditImageGrab('pics', str(tmpdir), no_such_option=1)
+
+
+def test_main_exits_on_misused_options(tmpdir):
+    # a subreddit with --multireddit: getitems refuses it
+    with pytest.raises(SystemExit) as info:
+        main(['pics', str(tmpdir), '--multireddit'])
+    assert "doesn't look like a multireddit" in str(info.value)
+
+
+@mock.patch('redditdownload.redditdownload.time.sleep')
+@mock.patch('redditdownload.redditdownload.download_from_url', side_effect=fake_download)
+@mock.patch('redditdownload.redditdownload.getitems')
+def test_main_output(mock_getitems, mock_download, mock_sleep, tmpdir, monkeypatch,
+                     capsys, caplog):
+    monkeypatch.chdir(str(tmpdir))
+    caplog.set_level(logging.INFO)
+    # progress messages are logged, not printed
+    mock_getitems.side_effect = [make_items(), []]
+    main(['pics', str(tmpdir.join('out')), '--verbose'])
+    assert 'No more ITEMS for pics' in caplog.text
+    assert 'No more ITEMS' not in capsys.readouterr().out
+    # --quiet: not even the summary
+    mock_getitems.side_effect = [make_items(), []]
+    main(['pics', str(tmpdir.join('out')), '--quiet', '--restart'])
+    assert capsys.readouterr().out == ''
+
+
+@mock.patch('redditdownload.redditdownload.httpcache.urlopen')
+def test_direct_imgur_media_is_not_fetched(mock_urlopen):
+    from redditdownload.redditdownload import process_imgur_url
+    assert process_imgur_url('http://i.imgur.com/abc.png') == ['http://i.imgur.com/abc.jpg']
+    assert process_imgur_url('http://i.imgur.com/abc.mp4') == ['http://i.imgur.com/abc.mp4']
+    assert process_imgur_url('http://i.imgur.com/abc') == ['http://i.imgur.com/abc.jpg']
+    assert not mock_urlopen.called
+    # pages are, for their video
+    mock_urlopen.return_value.read.return_value = (
+        b'<video><source type="video/webm" src="//i.imgur.com/abc.webm"></video>')
+    assert process_imgur_url('http://i.imgur.com/abc.gifv') == ['http://i.imgur.com/abc.webm']
+    assert process_imgur_url('http://imgur.com/abc') == ['http://i.imgur.com/abc.webm']
+    assert mock_urlopen.call_count == 2
@@ -0,0 +1,64 @@
+import pytest
+
+from redditdownload.resolution import (
+    parse_resolution, pick_rendition, imgur_candidates)
+
+
+def _item(source, resolutions):
+    return {'preview': {'images': [{
+        'source': {'width': source[0], 'height': source[1],
+                   'url': 'https://i.redd.it/src.jpg'},
+        'resolutions': [
+            {'width': w, 'height': h,
+             'url': 'https://preview.redd.it/x.jpg?width=%d&amp;s=abc' % w}
+            for w, h in resolutions],
+    }]}}
+
+
+def test_parse_resolution():
+    assert parse_resolution('1920x1080') == (1920, 1080)
+    assert parse_resolution(' 800 X 600 ') == (800, 600)
+    for value in ['', '1920', 'axb', '0x100']:
+        with pytest.raises(ValueError):
+            parse_resolution(value)
+
+
+def test_pick_smallest_covering_preview():
+    item = _item((7680, 4320), [(640, 360), (1920, 1080), (3840, 2160)])
+    res = pick_rendition('https://i.redd.it/src.png', item, (1920, 1080))
+    assert res == 'https://preview.redd.it/x.jpg?width=1920&s=abc'
+
+
+def test_fallback_to_original():
+    url = 'https://i.redd.it/src.png'
+    # nothing big enough
+    item = _item((7680, 4320), [(640, 360), (1080, 608)])
+    assert pick_rendition(url, item, (1920, 1080)) == url
+    # original smaller than target
+    item = _item((1280, 720), [(640, 360)])
+    assert pick_rendition(url, item, (1920, 1080)) == url
+    # no preview metadata at all
+    assert pick_rendition(url, {}, (1920, 1080)) == url
+    # animated content is never replaced by a still preview
+    item = _item((7680, 4320), [(3840, 2160)])
+    gif = 'https://i.imgur.com/abcdefg.gifv'
+    assert pick_rendition(gif, item, (1920, 1080)) == gif
+    # nor is a link to a page whose preview is a thumbnail
+    for url in ('https://www.youtube.com/watch?v=abc', 'https://www.redgifs.com/watch/abc',
+                'https://example.com/article.html'):
+        assert pick_rendition(url, item, (1920, 1080)) == url
+    # unless reddit says it is an image
+    item['post_hint'] = 'image'
+    assert pick_rendition('https://example.com/photo', item, (1920, 1080)) != \
+        'https://example.com/photo'
+
+
+def test_imgur_suffix():
+    cands = list(imgur_candidates('https://i.imgur.com/abcdefg.png', (4000, 2000)))
+    assert cands == [
+        (320, 160, 'https://i.imgur.com/abcdefgm.jpg'),
+        (640, 320, 'https://i.imgur.com/abcdefgl.jpg'),
+        (1024, 512, 'https://i.imgur.com/abcdefgh.jpg')]
+    item = _item((4000, 2000), [(3840, 1920)])
+    res = pick_rendition('https://i.imgur.com/abcdefg.png', item, (1000, 500))
+    assert res == 'https://i.imgur.com/abcdefgh.jpg'
@@ -0,0 +1,62 @@
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('atomicfile')
+
+from redditdownload.plugins import scrap_wrongies
+
+
+def test_filename_allocator(tmpdir):
+    tmpdir.join('a.jpg').write('')
+    tmpdir.join('a__01.jpg').write('')
+    allocate = scrap_wrongies.FilenameAllocator()
+    path = str(tmpdir.join('a.jpg'))
+    assert allocate(path) == str(tmpdir.join('a__02.jpg'))
+    assert allocate(path) == str(tmpdir.join('a__03.jpg'))
+    assert allocate(str(tmpdir.join('b.png'))) == str(tmpdir.join('b.png'))
+    assert allocate(str(tmpdir.join('b.png'))) == str(tmpdir.join('b__01.png'))
+    assert allocate(str(tmpdir.join('noext'))) == str(tmpdir.join('noext'))
+    assert allocate(str(tmpdir.join('noext'))) == str(tmpdir.join('noext__01'))
+    # a directory that doesn't exist yet
+    assert allocate(str(tmpdir.join('new', 'a.jpg'))) == str(tmpdir.join('new', 'a.jpg'))
+
+
+def test_processed_index(tmpdir):
+    filename = str(tmpdir.join('done.idx'))
+    index = scrap_wrongies.ProcessedIndex(filename)
+    assert index.claim('http://a/1')
+    assert not index.claim('http://a/1')  # in progress
+    index.add('http://a/1')
+    index.release('http://a/1')
+    assert 'http://a/1' in index and not index.claim('http://a/1')
+    # released without being done: may be tried again
+    assert index.claim('http://a/2')
+    index.release('http://a/2')
+    assert index.claim('http://a/2')
+
+    # only the hashes are kept, and they persist
+    assert 'http://a' not in open(filename).read()
+    index = scrap_wrongies.ProcessedIndex(filename)
+    assert 'http://a/1' in index and 'http://a/2' not in index
+
+
+def test_processed_index_migration(tmpdir):
+    debug_out = tmpdir.join('out.jsl')
+    debug_out.write('{"url": "http://a/1"}\n{"url": "http://a/2"}\n')
+    filename = str(tmpdir.join('done.idx'))
+    index = scrap_wrongies.ProcessedIndex(filename, debug_out=str(debug_out))
+    assert 'http://a/1' in index and 'http://a/2' in index
+    assert len(open(filename).read().split()) == 2
+
+
+def test_guess_mime():
+    resp = mock.Mock(headers={'content-type': 'image/png; charset=binary'})
+    assert scrap_wrongies.guess_mime(b'', resp) == 'image/png'
+    resp = mock.Mock(headers={'content-type': 'application/octet-stream'})
+    assert scrap_wrongies.guess_mime(b'\xff\xd8\xff\xe0', resp) == 'image/jpeg'
+    assert scrap_wrongies.guess_mime(b'GIF89a') == 'image/gif'
+    assert scrap_wrongies.guess_mime(b'RIFF\0\0\0\0WEBPVP8 ') == 'image/webp'
+    magic = mock.Mock(**{'from_buffer.return_value': 'image/x-other'})
+    with mock.patch.dict('sys.modules', magic=magic):
+        assert scrap_wrongies.guess_mime(b'????') == 'image/x-other'
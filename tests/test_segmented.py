@@ -0,0 +1,171 @@
+import os
+import threading
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from redditdownload import segmented
+from redditdownload import storage
+from redditdownload.redditdownload import download_from_url
+
+
+DATA = os.urandom(1024 * 1024 + 123)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves DATA (version `server.etag`) with Range support; drops the
+    first try of every segment halfway through"""
+
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        rng = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if not rng or (if_range and if_range != self.server.etag):
+            self.server.ranges.append(rng and 'changed')
+            self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', self.server.etag)
+            self.send_header('Content-Length', str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        self.server.ranges.append(rng)
+        first, last = (int(v) for v in rng.split('=')[1].split('-'))
+        body = DATA[first:last + 1]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, len(DATA)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        with self.server.lock:
+            flaky = last not in self.server.dropped
+            self.server.dropped.add(last)
+        self.wfile.write(body[:len(body) // 2] if flaky else body)
+
+    def log_message(self, *ar):
+        pass
+
+
+class NoRangeHandler(BaseHTTPRequestHandler):
+    """Advertises ranges but answers every request with the whole of DATA"""
+
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get('Range'))
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Last-Modified', 'Mon, 19 Oct 2026 09:00:00 GMT')
+        self.send_header('Content-Length', str(len(DATA)))
+        self.end_headers()
+        self.wfile.write(DATA)
+
+    def log_message(self, *ar):
+        pass
+
+
+def serve(handler):
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    server.ranges, server.dropped, server.lock = [], set(), threading.Lock()
+    server.etag = '"v1"'
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def server():
+    for server in serve(RangeHandler):
+        yield server
+
+
+@pytest.fixture
+def no_range_server():
+    for server in serve(NoRangeHandler):
+        yield server
+
+
+def test_should_segment():
+    segmented.configure(min_size=100, segments=4)
+    tagged = {'accept-ranges': 'bytes', 'etag': '"abc"'}
+    try:
+        assert segmented.should_segment(dict(tagged, **{'content-length': '100'})) == 100
+        assert segmented.should_segment(dict(tagged, **{'accept-ranges': 'none',
+                                                         'content-length': '100'})) is None
+        assert segmented.should_segment(dict(tagged, **{'content-length': '99'})) is None
+        assert segmented.should_segment(tagged) is None
+        # a change couldn't be noticed
+        assert segmented.should_segment({'accept-ranges': 'bytes', 'content-length': '100',
+                                         'etag': 'W/"abc"'}) is None
+        segmented.configure(min_size=100, segments=1)
+        assert segmented.should_segment(dict(tagged, **{'content-length': '100'})) is None
+    finally:
+        segmented.configure()
+
+
+def test_segments_retry_and_resume(server, tmpdir):
+    url = 'http://127.0.0.1:%d/video.mp4' % server.server_port
+    dest = str(tmpdir.join('video.mp4'))
+    segmented.download(url, dest, len(DATA), head=DATA[:10], segments=4, validator='"v1"')
+    with open(dest, 'rb') as f:
+        assert f.read() == DATA
+    assert not os.path.exists(dest + '.part')
+    # every segment was cut off once and resumed from where it stopped
+    assert len(server.ranges) == 8
+    assert len(server.dropped) == 4
+    assert server.ranges.count('bytes=10-262181') == 1
+
+
+def test_changed_file_is_not_stitched(server, tmpdir):
+    url = 'http://127.0.0.1:%d/video.mp4' % server.server_port
+    dest = str(tmpdir.join('video.mp4'))
+    server.etag = '"v2"'
+    with pytest.raises(segmented.FileChanged):
+        segmented.download(url, dest, len(DATA), head=DATA[:10], segments=4, validator='"v1"')
+    assert not os.path.exists(dest) and not os.path.exists(dest + '.part')
+    assert set(server.ranges) == {'changed'}
+
+
+def test_retries_back_off(tmpdir, monkeypatch):
+    waits = []
+    monkeypatch.setattr(segmented, 'urlopen', mock.Mock(side_effect=IOError('reset')))
+    abort = mock.Mock(**{'is_set.return_value': False})
+    abort.wait.side_effect = lambda delay: waits.append(delay)
+    with pytest.raises(segmented.SegmentError):
+        segmented._fetch_segment('http://h/f', None, 0, 9, {}, None, abort, retries=4,
+                                 backoff=0.5)
+    assert waits == [0.5, 1.0, 2.0]
+
+
+def test_short_file_is_removed(server, tmpdir):
+    url = 'http://127.0.0.1:%d/video.mp4' % server.server_port
+    dest = str(tmpdir.join('video.mp4'))
+    with pytest.raises(segmented.SegmentError):
+        # claims more than the server has
+        segmented.download(url, dest, len(DATA) + 10, segments=2)
+    assert not os.path.exists(dest) and not os.path.exists(dest + '.part')
+
+
+def test_ignored_ranges_fall_back_to_streaming(no_range_server, tmpdir):
+    url = 'http://127.0.0.1:%d/video.mp4' % no_range_server.server_port
+    dest = str(tmpdir.join('video.mp4'))
+    with pytest.raises(segmented.RangeIgnored):
+        segmented.download(url, dest, len(DATA), segments=4)
+    assert not os.path.exists(dest + '.part')
+
+    del no_range_server.ranges[:]
+    segmented.configure(min_size=1024, segments=4)
+    try:
+        download_from_url(url, dest, sink=storage.DirectorySink())
+    finally:
+        segmented.configure()
+    with open(dest, 'rb') as f:
+        assert f.read() == DATA
+    # the first request, (some of) the ranges, then one plain download
+    assert no_range_server.ranges[0] is None and no_range_server.ranges[-1] is None
+    assert any(no_range_server.ranges[1:-1])
@@ -0,0 +1,111 @@
+import os
+import tarfile
+
+import pytest
+
+from redditdownload import storage
+
+
+def write(sink, path, data):
+    with sink.open_write(path) as f:
+        f.write(data)
+
+
+def test_tar_shards_roll_and_index(tmpdir):
+    root = str(tmpdir)
+    sink = storage.TarShardSink(root, shard_size=4096)
+    files = {os.path.join(root, 'pics', '%s.jpg' % n): os.urandom(1500 + n)
+             for n in range(6)}
+    long_name = os.path.join(root, 'pics', 'x' * 150 + '.png')
+    files[long_name] = b'long name'
+    for path, data in files.items():
+        write(sink, path, data)
+    sink.close()
+
+    shards = sorted(f for f in os.listdir(root) if f.endswith('.tar'))
+    assert len(shards) > 1
+    assert all(os.path.exists(os.path.join(root, s + '.idx')) for s in shards)
+
+    # the shards are plain tar files
+    members = {}
+    for shard in shards:
+        with tarfile.open(os.path.join(root, shard)) as tar:
+            for info in tar:
+                members[info.name] = tar.extractfile(info).read()
+    assert members == {os.path.relpath(p, root): d for p, d in files.items()}
+
+    # a new instance finds everything through the indexes
+    sink = storage.TarShardSink(root, shard_size=4096)
+    for path, data in files.items():
+        assert sink.exists(path)
+        assert sink.open_read(path).read() == data
+    assert not sink.exists(os.path.join(root, 'pics', 'nope.jpg'))
+
+
+def test_tar_discard_error_and_torn_member(tmpdir):
+    root = str(tmpdir)
+    sink = storage.TarShardSink(root)
+    write(sink, os.path.join(root, 'a.jpg'), b'a' * 100)
+    with sink.open_write(os.path.join(root, 'b.jpg')) as f:
+        f.write(b'b' * 100)
+        f.discard()
+    with pytest.raises(IOError):
+        with sink.open_write(os.path.join(root, 'c.jpg')) as f:
+            f.write(b'c' * 100)
+            raise IOError('connection reset')
+    # simulate a crash in the middle of a member
+    sink._fo.write(b'\0' * 512 + b'torn')
+    sink._fo.flush()
+
+    sink = storage.TarShardSink(root)
+    assert sink.exists(os.path.join(root, 'a.jpg'))
+    assert not sink.exists(os.path.join(root, 'b.jpg'))
+    assert not sink.exists(os.path.join(root, 'c.jpg'))
+    write(sink, os.path.join(root, 'd.jpg'), b'd' * 10)
+    sink.close()
+    with tarfile.open(os.path.join(root, 'shard-000000.tar')) as tar:
+        assert tar.getnames() == ['a.jpg', 'd.jpg']
+
+
+def test_tar_lost_index_is_rebuilt(tmpdir):
+    root = str(tmpdir)
+    sink = storage.TarShardSink(root)
+    write(sink, os.path.join(root, 'a.jpg'), b'a' * 100)
+    write(sink, os.path.join(root, 'x' * 150 + '.jpg'), b'x' * 600)
+    sink.close()
+    shard = os.path.join(root, 'shard-000000.tar')
+    os.remove(shard + '.idx')
+
+    sink = storage.TarShardSink(root)
+    assert sink.open_read(os.path.join(root, 'x' * 150 + '.jpg')).read() == b'x' * 600
+    write(sink, os.path.join(root, 'b.jpg'), b'b' * 10)
+    sink.close()
+    with tarfile.open(shard) as tar:
+        assert tar.getnames() == ['a.jpg', 'x' * 150 + '.jpg', 'b.jpg']
+    assert len(open(shard + '.idx').readlines()) == 3
+
+    # not a shard of ours: left alone
+    os.remove(shard + '.idx')
+    with open(shard, 'r+b') as f:
+        f.seek(-2 * tarfile.BLOCKSIZE, os.SEEK_END)  # the end-of-archive blocks
+        f.write(b'junk' * 200)
+    size = os.path.getsize(shard)
+    with pytest.raises(IOError):
+        storage.TarShardSink(root)
+    assert os.path.getsize(shard) == size
+
+
+def test_directory_sink(tmpdir):
+    sink = storage.DirectorySink()
+    path = str(tmpdir.join('a.jpg'))
+    write(sink, path, b'data')
+    assert sink.exists(path)
+    with sink.open_write(str(tmpdir.join('b.jpg'))) as f:
+        f.discard()
+    assert not tmpdir.join('b.jpg').exists()
+    temp = sink.temp_path(str(tmpdir.join('c.jpg')))
+    with open(temp, 'wb') as f:
+        f.write(b'c')
+    sink.put_file(str(tmpdir.join('c.jpg')), temp)
+    assert tmpdir.join('c.jpg').read_binary() == b'c'
+    assert not os.path.exists(temp)
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import threading
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen, Request
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from redditdownload import trace, httpcache
+
+
+DELAY = 0.2
+
+
+class PageHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.hits += 1
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path == '/slow':
+            time.sleep(DELAY)
+        body = ('page %s, hit %d' % (self.path, self.server.hits)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *ar):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(('127.0.0.1', 0), PageHandler)
+    server.hits = 0
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d' % server.server_port
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_trace():
+    yield
+    trace.close()
+
+
+def test_record_and_replay(tmpdir, server):
+    trace_dir = str(tmpdir.join('trace'))
+    trace.configure(record=trace_dir)
+    assert urlopen(server + '/a').read() == b'page /a, hit 1'
+    assert urlopen(server + '/a').read() == b'page /a, hit 2'
+    # through the http cache's transport as well
+    assert httpcache.urlopen(Request(server + '/b')).read() == b'page /b, hit 3'
+    with pytest.raises(HTTPError):
+        urlopen(server + '/missing')
+    trace.close()
+
+    with open(os.path.join(trace_dir, trace.TRACE_FILE)) as f:
+        entries = [json.loads(line) for line in f]
+    assert [(e['url'][len(server):], e['status']) for e in entries] == [
+        ('/a', 200), ('/a', 200), ('/b', 200), ('/missing', 404)]
+    assert entries[0]['size'] == 14 and entries[0]['ttfb'] <= entries[0]['elapsed']
+    assert len(os.listdir(os.path.join(trace_dir, trace.BODIES_DIR))) == 4
+
+    trace.configure(replay=trace_dir, latency='zero')
+    assert trace.replaying()
+    response = urlopen(server + '/a')
+    assert response.read() == b'page /a, hit 1'
+    assert response.info()['content-type'] == 'text/html'
+    assert urlopen(server + '/a').read() == b'page /a, hit 2'
+    assert urlopen(server + '/a').read() == b'page /a, hit 2'  # the last one again
+    with pytest.raises(HTTPError) as exc:
+        urlopen(server + '/missing')
+    assert exc.value.code == 404
+    with pytest.raises(URLError):
+        urlopen(server + '/other')
+
+
+def test_replay_latency_and_hashed_bodies(tmpdir, server):
+    trace_dir = str(tmpdir.join('trace'))
+    trace.configure(record=trace_dir, bodies='hash')
+    urlopen(server + '/slow').read()
+    trace.close()
+    assert os.listdir(os.path.join(trace_dir, trace.BODIES_DIR)) == []
+
+    trace.configure(replay=trace_dir, latency='original')
+    started = time.time()
+    body = urlopen(server + '/slow').read()
+    assert time.time() - started >= DELAY * 0.9
+    assert body == b'\0' * len(b'page /slow, hit 1')
+    trace.configure(replay=trace_dir, latency='zero')
+    started = time.time()
+    urlopen(server + '/slow').read()
+    assert time.time() - started < DELAY / 2
@@ -0,0 +1,100 @@
+import json
+import threading
+
+from redditdownload import watch
+
+
+def test_rate_and_interval():
+    assert watch.update_rate(None, 10, 100) == 0.1
+    assert watch.update_rate(0.1, 0, 100, alpha=0.5) == 0.05
+    assert watch.update_rate(0.1, 3, 0) == 0.1
+    assert watch.next_interval(None, 10, 1000) == 10
+    assert watch.next_interval(0, 10, 1000) == 1000
+    assert watch.next_interval(0.01, 10, 1000, target=5) == 500
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_watcher_adapts_and_checkpoints(tmpdir):
+    clock = FakeClock()
+    polled = []
+    # 'busy' posts every 10s, 'quiet' never
+    posts = {'busy': lambda: [clock.now - 10 * i for i in range(1, 4)], 'quiet': lambda: []}
+
+    def poll(section):
+        polled.append(section[0])
+        return posts[section[0]]()
+
+    sections = [('busy', '/d', None), ('quiet', '/d', None)]
+    state_file = str(tmpdir.join('state.json'))
+    watcher = watch.Watcher(lambda: sections, poll, state_file=state_file,
+                            min_interval=10, max_interval=1000, clock=clock)
+    watcher.reload()
+    for _ in range(2):
+        due, key = watcher._pop_due()
+        watcher._queue.pop(0)
+        watcher.poll_one(key)
+    assert sorted(polled) == ['busy', 'quiet']
+    busy, quiet = (watcher.state[watch.section_key(s)] for s in sections)
+    assert busy['due'] - clock.now < 100
+    # nothing seen yet: no rate, poll again soon
+    assert quiet['due'] - clock.now == 10
+    clock.now += 10
+    watcher._queue.remove((quiet['due'], watch.section_key(sections[1])))
+    watcher.poll_one(watch.section_key(sections[1]))
+    assert quiet['rate'] == 0
+    assert quiet['due'] - clock.now == 1000
+    with open(state_file) as f:
+        assert json.load(f) == watcher.state
+
+    # restart picks up the schedule; dropped sections go away
+    sections.pop()
+    watcher = watch.Watcher(lambda: sections, poll, state_file=state_file, clock=clock)
+    watcher.reload()
+    assert list(watcher.state) == [watch.section_key(sections[0])]
+    assert watcher.state[watch.section_key(sections[0])]['due'] == busy['due']
+
+
+def test_watcher_reloads_list_and_stops(tmpdir):
+    list_file = tmpdir.join('subs.txt')
+    list_file.write('a\n')
+    stop = threading.Event()
+    polled = []
+
+    def load():
+        return [(line, '/d', None) for line in list_file.read().split()]
+
+    def poll(section):
+        polled.append(section[0])
+        if section[0] == 'a':
+            list_file.write('a\nb\n')
+            list_file.setmtime(list_file.mtime() + 5)
+        else:
+            stop.set()
+        return []
+
+    watcher = watch.Watcher(load, poll, watch_file=str(list_file),
+                            min_interval=0.01, max_interval=60, stop=stop)
+    watcher.run()
+    assert polled == ['a', 'b']
+
+
+def test_weight_shortens_the_interval():
+    clock = FakeClock()
+    sections = [('heavy', '/d', None, 4.0), ('light', '/d', None, 1.0)]
+    watcher = watch.Watcher(lambda: sections, lambda section: [], min_interval=10,
+                            max_interval=1000, clock=clock,
+                            weight=lambda section: section[3])
+    watcher.reload()
+    for section in sections:
+        key = watch.section_key(section)
+        watcher.state[key]['rate'] = 0  # nothing posted: max interval
+        watcher.poll_one(key)
+    heavy, light = (watcher.state[watch.section_key(s)] for s in sections)
+    assert (heavy['due'] - clock.now, light['due'] - clock.now) == (250, 1000)
@@ -0,0 +1,16 @@
+from redditdownload import watermark
+
+
+def test_marks():
+    old = {'id': '8x0aaa', 'created_utc': 100.0}
+    same_second = {'id': '8x0aab', 'created_utc': 100.0}
+    new = {'id': '8x0abc', 'created_utc': 200.0}
+    mark = watermark.item_mark(old)
+    assert watermark.is_seen(old, mark)
+    assert not watermark.is_seen(same_second, mark)
+    assert not watermark.is_seen(new, mark)
+    assert not watermark.is_seen(old, None)
+    assert watermark.newer(mark, watermark.item_mark(new))['id'] == '8x0abc'
+    assert watermark.newer(None, mark) == mark
+    assert watermark.is_time_ordered('new')
+    assert not watermark.is_time_ordered('hot')